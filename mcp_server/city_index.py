@@ -0,0 +1,319 @@
+"""
+内置城市索引
+每个地点只保存一条记录，中文名、英文名、拼音及 市/区/县 后缀变体统一进入别名表，
+查询时不区分大小写、忽略空格和标点，O(1) 命中；
+另有前缀树（前缀补全）和字符二元组倒排索引 + 编辑距离（拼写纠错）用于模糊匹配
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+@dataclass(frozen=True)
+class City:
+    """内置城市记录"""
+    name: str            # 中文名（规范名称）
+    name_en: str         # 英文名
+    pinyin: str          # 中文名拼音
+    country: str         # 国家中文名
+    country_code: str    # ISO 3166-1 国家代码
+    lat: float
+    lon: float
+    aliases: Tuple[str, ...] = ()
+
+    @property
+    def coordinates(self) -> Tuple[float, float]:
+        return (self.lat, self.lon)
+
+
+def _cities(country: str, country_code: str, rows) -> List[City]:
+    return [City(name, name_en, pinyin, country, country_code, lat, lon, tuple(aliases))
+            for name, name_en, pinyin, lat, lon, *aliases in rows]
+
+
+# 内置城市表 - 支持全球主要城市
+BUILTIN_CITIES: Tuple[City, ...] = tuple(
+    # === 中国城市 ===
+    _cities("中国", "CN", [
+        ("北京", "Beijing", "beijing", 39.9042, 116.4074, "Peking"),
+        ("上海", "Shanghai", "shanghai", 31.2304, 121.4737),
+        ("广州", "Guangzhou", "guangzhou", 23.1291, 113.2644, "Canton"),
+        ("深圳", "Shenzhen", "shenzhen", 22.5431, 114.0579),
+        ("杭州", "Hangzhou", "hangzhou", 30.2741, 120.1551),
+        ("南京", "Nanjing", "nanjing", 32.0603, 118.7969),
+        ("武汉", "Wuhan", "wuhan", 30.5928, 114.3055),
+        ("成都", "Chengdu", "chengdu", 30.5728, 104.0668),
+        ("西安", "Xi'an", "xian", 34.3416, 108.9398),
+        ("重庆", "Chongqing", "chongqing", 29.5630, 106.5516),
+        ("天津", "Tianjin", "tianjin", 39.3434, 117.3616),
+        ("苏州", "Suzhou", "suzhou", 31.2989, 120.5853),
+        ("青岛", "Qingdao", "qingdao", 36.0671, 120.3826),
+        ("宁波", "Ningbo", "ningbo", 29.8683, 121.5440),
+        ("无锡", "Wuxi", "wuxi", 31.5912, 120.3019),
+        ("济南", "Jinan", "jinan", 36.6512, 117.1201),
+        ("大连", "Dalian", "dalian", 38.9140, 121.6147),
+        ("沈阳", "Shenyang", "shenyang", 41.8057, 123.4315),
+        ("长春", "Changchun", "changchun", 43.8171, 125.3235),
+        ("哈尔滨", "Harbin", "haerbin", 45.8038, 126.5349),
+        ("福州", "Fuzhou", "fuzhou", 26.0745, 119.2965),
+        ("厦门", "Xiamen", "xiamen", 24.4798, 118.0894),
+        ("昆明", "Kunming", "kunming", 25.0389, 102.7183),
+        ("南昌", "Nanchang", "nanchang", 28.6820, 115.8581),
+        ("合肥", "Hefei", "hefei", 31.8669, 117.2741),
+        ("石家庄", "Shijiazhuang", "shijiazhuang", 38.0428, 114.5149),
+        ("太原", "Taiyuan", "taiyuan", 37.8706, 112.5489),
+        ("郑州", "Zhengzhou", "zhengzhou", 34.7466, 113.6254),
+        ("长沙", "Changsha", "changsha", 28.2282, 112.9388),
+        ("南宁", "Nanning", "nanning", 22.8170, 108.3669),
+        ("海口", "Haikou", "haikou", 20.0444, 110.1999),
+        ("贵阳", "Guiyang", "guiyang", 26.6470, 106.6302),
+        ("兰州", "Lanzhou", "lanzhou", 36.0611, 103.8343),
+        ("银川", "Yinchuan", "yinchuan", 38.4681, 106.2731),
+        ("西宁", "Xining", "xining", 36.6171, 101.7782),
+        ("乌鲁木齐", "Urumqi", "wulumuqi", 43.7793, 87.6177),
+        ("拉萨", "Lhasa", "lasa", 29.6625, 91.1110),
+    ])
+    # === 日本城市 ===
+    + _cities("日本", "JP", [
+        ("东京", "Tokyo", "dongjing", 35.6762, 139.6503),
+        ("大阪", "Osaka", "daban", 34.6937, 135.5023),
+        ("京都", "Kyoto", "jingdu", 35.0116, 135.7681),
+        ("横滨", "Yokohama", "hengbin", 35.4437, 139.6380),
+        ("名古屋", "Nagoya", "mingguwu", 35.1815, 136.9066),
+        ("札幌", "Sapporo", "zhahuang", 43.0642, 141.3469),
+        ("福冈", "Fukuoka", "fugang", 33.5904, 130.4017),
+        ("神户", "Kobe", "shenhu", 34.6901, 135.1956),
+        ("广岛", "Hiroshima", "guangdao", 34.3853, 132.4553),
+        ("仙台", "Sendai", "xiantai", 38.2682, 140.8694),
+        ("印西", "Inzai", "yinxi", 35.832, 140.145),
+    ])
+    # === 韩国城市 ===
+    + _cities("韩国", "KR", [
+        ("首尔", "Seoul", "shouer", 37.5665, 126.9780),
+        ("釜山", "Busan", "fushan", 35.1796, 129.0756),
+        ("仁川", "Incheon", "renchuan", 37.4563, 126.7052),
+        ("大邱", "Daegu", "daqiu", 35.8714, 128.6014),
+        ("大田", "Daejeon", "datian", 36.3504, 127.3845),
+        ("光州", "Gwangju", "guangzhou", 35.1595, 126.8526),
+    ])
+    # === 美国城市 ===
+    + _cities("美国", "US", [
+        ("纽约", "New York", "niuyue", 40.7128, -74.0060, "New York City", "NYC"),
+        ("洛杉矶", "Los Angeles", "luoshanji", 34.0522, -118.2437, "LA"),
+        ("芝加哥", "Chicago", "zhijiage", 41.8781, -87.6298),
+        ("休斯顿", "Houston", "xiusidun", 29.7604, -95.3698),
+        ("凤凰城", "Phoenix", "fenghuangcheng", 33.4484, -112.0740),
+        ("费城", "Philadelphia", "feicheng", 39.9526, -75.1652),
+        ("圣安东尼奥", "San Antonio", "shengandongniao", 29.4241, -98.4936),
+        ("圣地亚哥", "San Diego", "shengdiyage", 32.7157, -117.1611),
+        ("达拉斯", "Dallas", "dalasi", 32.7767, -96.7970),
+        ("圣何塞", "San Jose", "shenghesai", 37.3382, -121.8863),
+        ("奥斯汀", "Austin", "aositing", 30.2672, -97.7431),
+        ("迈阿密", "Miami", "maiami", 25.7617, -80.1918),
+        ("西雅图", "Seattle", "xiyatu", 47.6062, -122.3321),
+        ("旧金山", "San Francisco", "jiujinshan", 37.7749, -122.4194, "三藩市"),
+        ("拉斯维加斯", "Las Vegas", "lasiweijiasi", 36.1699, -115.1398),
+        ("华盛顿", "Washington", "huashengdun", 38.9072, -77.0369, "Washington DC"),
+        ("波士顿", "Boston", "boshidun", 42.3601, -71.0589),
+    ])
+    # === 德国城市 ===
+    + _cities("德国", "DE", [
+        ("柏林", "Berlin", "bolin", 52.5200, 13.4050),
+        ("慕尼黑", "Munich", "munihei", 48.1351, 11.5820, "München"),
+        ("汉堡", "Hamburg", "hanbao", 53.5511, 9.9937),
+        ("科隆", "Cologne", "kelong", 50.9375, 6.9603, "Köln"),
+        ("法兰克福", "Frankfurt", "falankefu", 50.1109, 8.6821),
+        ("斯图加特", "Stuttgart", "situjiate", 48.7758, 9.1829),
+        ("杜塞尔多夫", "Dusseldorf", "duseerduofu", 51.2277, 6.7735, "Düsseldorf"),
+        ("多特蒙德", "Dortmund", "duotemengde", 51.5136, 7.4653),
+    ])
+    # === 英国城市 ===
+    + _cities("英国", "GB", [
+        ("伦敦", "London", "lundun", 51.5074, -0.1278),
+        ("曼彻斯特", "Manchester", "manchesite", 53.4808, -2.2426),
+        ("伯明翰", "Birmingham", "bominghan", 52.4862, -1.8904),
+        ("利物浦", "Liverpool", "liwupu", 53.4084, -2.9916),
+        ("爱丁堡", "Edinburgh", "aidingbao", 55.9533, -3.1883),
+        ("格拉斯哥", "Glasgow", "gelasige", 55.8642, -4.2518),
+    ])
+    # === 法国城市 ===
+    + _cities("法国", "FR", [
+        ("巴黎", "Paris", "bali", 48.8566, 2.3522),
+        ("马赛", "Marseille", "masai", 43.2965, 5.3698),
+        ("里昂", "Lyon", "liang", 45.7640, 4.8357),
+        ("图卢兹", "Toulouse", "tuluzi", 43.6047, 1.4442),
+        ("尼斯", "Nice", "nisi", 43.7102, 7.2620),
+    ])
+    # === 其他主要城市 ===
+    + _cities("澳大利亚", "AU", [
+        ("悉尼", "Sydney", "xini", -33.8688, 151.2093),
+        ("墨尔本", "Melbourne", "moerben", -37.8136, 144.9631),
+    ])
+    + _cities("加拿大", "CA", [
+        ("多伦多", "Toronto", "duolunduo", 43.6532, -79.3832),
+        ("温哥华", "Vancouver", "wengehua", 49.2827, -123.1207),
+    ])
+    + _cities("新加坡", "SG", [("新加坡", "Singapore", "xinjiapo", 1.3521, 103.8198)])
+    + _cities("泰国", "TH", [("曼谷", "Bangkok", "mangu", 13.7563, 100.5018)])
+    + _cities("阿联酋", "AE", [("迪拜", "Dubai", "dibai", 25.2048, 55.2708)])
+    + _cities("俄罗斯", "RU", [("莫斯科", "Moscow", "mosike", 55.7558, 37.6176)])
+)
+
+# 中文行政区划后缀：北京市、朝阳区、xx县 与不带后缀的名称等价
+_CJK_SUFFIXES = ("市", "区", "县")
+_IGNORED_CHARS = re.compile(r"[\s\-_.'’·,]+")
+
+
+def normalize_name(name: str) -> str:
+    """规范化城市名：不区分大小写，忽略空格和标点，去掉 市/区/县 后缀"""
+    key = _IGNORED_CHARS.sub("", name.strip()).casefold()
+    if len(key) > 2 and key.endswith(_CJK_SUFFIXES):
+        key = key[:-1]
+    return key
+
+
+def _is_cjk(key: str) -> bool:
+    return any(ord(ch) > 0x2E80 for ch in key)
+
+
+def _bigrams(key: str) -> List[str]:
+    padded = f"^{key}$"
+    return [padded[i:i + 2] for i in range(len(padded) - 1)]
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein 距离，超过 limit 时提前返回 limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class _TrieNode:
+    __slots__ = ("children", "cities")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.cities: Set[int] = set()
+
+
+class CityIndex:
+    """城市别名索引：规范化别名 -> 城市记录下标
+
+    别名优先级：中文名、英文名、额外别名优先于拼音；
+    拼音重名时（如 广州/光州 都是 guangzhou）保留先登记的城市。
+    模糊匹配只在结果唯一时返回城市，有歧义时返回 None 交给地理编码 API。
+    """
+
+    # 前缀补全的最短长度（规范化后），中文字符信息量更大，要求更短；
+    # 拉丁字母的短前缀（Lon、Par、Tai）多半是别的地名或单词，不补全
+    MIN_PREFIX = 5
+    MIN_PREFIX_CJK = 2
+
+    def __init__(self, cities: Iterable[City]):
+        self.cities: List[City] = list(cities)
+        self._aliases: Dict[str, int] = {}
+        for i, city in enumerate(self.cities):
+            for alias in (city.name, city.name_en, *city.aliases):
+                self._aliases[normalize_name(alias)] = i
+        for i, city in enumerate(self.cities):
+            self._aliases.setdefault(normalize_name(city.pinyin), i)
+
+        self._trie = _TrieNode()
+        self._grams: Dict[str, List[str]] = {}
+        for alias, i in self._aliases.items():
+            node = self._trie
+            for ch in alias:
+                node = node.children.setdefault(ch, _TrieNode())
+                node.cities.add(i)
+            for gram in set(_bigrams(alias)):
+                self._grams.setdefault(gram, []).append(alias)
+
+    def lookup(self, name: str) -> Optional[City]:
+        """按任意别名查找城市"""
+        if not name:
+            return None
+        i = self._aliases.get(normalize_name(name))
+        return self.cities[i] if i is not None else None
+
+    def complete(self, prefix: str, limit: int = 10) -> List[City]:
+        """前缀补全：返回别名以 prefix 开头的城市（按内置表顺序）"""
+        node = self._trie
+        for ch in normalize_name(prefix):
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return [self.cities[i] for i in sorted(node.cities)[:limit]]
+
+    @staticmethod
+    def max_typos(key: str) -> int:
+        """允许的编辑距离：短名称不纠错，避免把 大田 纠成 大阪 这类误判
+
+        拉丁字母名称的编辑距离须小于长度的 1/5（至少 6 个字母才纠错一处）：
+        拼音改一个字母往往就是另一个真实地名（Hebei 河北 -> Hefei 合肥）。
+        """
+        if _is_cjk(key):
+            return 1 if len(key) >= 3 else 0
+        return min(2, (len(key) - 1) // 5)
+
+    def fuzzy_lookup(self, name: str) -> Optional[City]:
+        """模糊匹配：唯一的前缀补全，其次是编辑距离最小且唯一的别名
+
+        带 市/区/县 后缀的名称是完整地名（凤凰县、多伦县），不做前缀补全。
+        """
+        key = normalize_name(name) if name else ""
+        if not key:
+            return None
+
+        complete_name = _is_cjk(key) and name.strip().endswith(_CJK_SUFFIXES)
+        if not complete_name and len(key) >= (self.MIN_PREFIX_CJK if _is_cjk(key) else self.MIN_PREFIX):
+            candidates = self.complete(key, limit=2)
+            if len(candidates) == 1:
+                return candidates[0]
+
+        limit = self.max_typos(key)
+        if limit == 0:
+            return None
+        # q-gram 引理：每次编辑最多破坏 2 个二元组，共享二元组过少的别名不可能在距离内
+        grams = _bigrams(key)
+        shared = Counter(alias for gram in set(grams) for alias in self._grams.get(gram, ()))
+        best, matches = limit + 1, set()
+        for alias, count in shared.items():
+            if count < max(len(grams), len(alias) + 1) - 2 * limit:
+                continue
+            distance = edit_distance(key, alias, min(limit, best))
+            if distance > limit:
+                continue
+            if distance < best:
+                best, matches = distance, {self._aliases[alias]}
+            elif distance == best:
+                matches.add(self._aliases[alias])
+        if len(matches) == 1:
+            return self.cities[matches.pop()]
+        return None
+
+    def resolve(self, name: str) -> Optional[City]:
+        """精确匹配，未命中时模糊匹配"""
+        return self.lookup(name) or self.fuzzy_lookup(name)
+
+    def aliases(self) -> Dict[str, City]:
+        """规范化别名到城市的映射（只读视图用）"""
+        return {alias: self.cities[i] for alias, i in self._aliases.items()}
+
+    def __contains__(self, name: str) -> bool:
+        return self.lookup(name) is not None
+
+    def __iter__(self):
+        return iter(self.cities)
+
+    def __len__(self) -> int:
+        return len(self.cities)
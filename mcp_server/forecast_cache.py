@@ -0,0 +1,169 @@
+"""
+天气预报缓存
+按网格化坐标 + 预报天数缓存彩云天气响应，TTL 由响应的 server_time 推算，LRU 淘汰，
+过期后在 max_stale 时间内仍可作为陈旧数据使用（stale-while-revalidate）
+"""
+
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+Cell = Tuple[int, int]
+
+
+@dataclass
+class CacheEntry:
+    """缓存条目"""
+    data: Dict[str, Any]
+    steps: int
+    expires_at: float
+    size: int
+
+
+class ForecastCache:
+    """彩云天气预报的进程内 LRU 缓存
+
+    同一网格内的坐标共享缓存条目；请求天数不超过已缓存天数时直接命中，
+    例如 2 天的请求可以由已缓存的 15 天响应满足。
+    条目过期后继续保留 max_stale 秒，期间可通过 lookup 取得陈旧数据。
+    snap 可将坐标吸附到附近的代表点（如最近的城市），使相邻查询共享同一网格。
+    """
+
+    def __init__(
+        self,
+        ttl: float = 1800.0,
+        grid: float = 0.01,
+        max_entries: int = 1024,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_stale: float = 0.0,
+        clock: Callable[[], float] = time.time,
+        snap: Optional[Callable[[float, float], Optional[Tuple[float, float]]]] = None,
+    ):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.grid = grid
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.snap = snap
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Tuple[int, int, int], CacheEntry]" = OrderedDict()
+        self._steps_by_cell: Dict[Cell, Set[int]] = {}
+
+    def cell(self, lat: float, lon: float) -> Cell:
+        """坐标对齐到缓存网格"""
+        if self.snap is not None:
+            snapped = self.snap(lat, lon)
+            if snapped is not None:
+                lat, lon = snapped
+        return (round(lat / self.grid), round(lon / self.grid))
+
+    def get(self, lat: float, lon: float, steps: int) -> Optional[Dict[str, Any]]:
+        """查找覆盖 steps 天的有效缓存（不返回陈旧数据）"""
+        found = self.lookup(lat, lon, steps)
+        if found is None or not found[1]:
+            return None
+        return found[0]
+
+    def lookup(self, lat: float, lon: float, steps: int) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """查找覆盖 steps 天的缓存，返回 (数据, 是否新鲜)，优先返回新鲜数据"""
+        cell = self.cell(lat, lon)
+        now = self.clock()
+        stale_key = None
+        for cached_steps in sorted(self._steps_by_cell.get(cell, ())):
+            if cached_steps < steps:
+                continue
+            key = (*cell, cached_steps)
+            entry = self._entries[key]
+            if entry.expires_at + self.max_stale <= now:
+                self._remove(key)
+                continue
+            if entry.expires_at <= now:
+                stale_key = stale_key or key
+                continue
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.data, True
+
+        if stale_key is not None:
+            self._entries.move_to_end(stale_key)
+            self.stale_hits += 1
+            return self._entries[stale_key].data, False
+        self.misses += 1
+        return None
+
+    def ttl_remaining(self, lat: float, lon: float, steps: int) -> Optional[float]:
+        """覆盖 steps 天的条目距离过期的秒数（不影响命中统计和 LRU 顺序），没有条目时返回 None"""
+        cell = self.cell(lat, lon)
+        expires = [
+            self._entries[(*cell, cached_steps)].expires_at
+            for cached_steps in self._steps_by_cell.get(cell, ())
+            if cached_steps >= steps
+        ]
+        if not expires:
+            return None
+        return max(expires) - self.clock()
+
+    def put(self, lat: float, lon: float, steps: int, data: Dict[str, Any]):
+        """写入缓存，过期时间 = 数据生成时间（server_time）+ TTL"""
+        now = self.clock()
+        server_time = data.get("server_time")
+        issued_at = now
+        if isinstance(server_time, (int, float)) and 0 <= now - server_time < self.ttl:
+            issued_at = server_time
+
+        cell = self.cell(lat, lon)
+        key = (*cell, steps)
+        if key in self._entries:
+            self._remove(key)
+
+        size = len(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        self._entries[key] = CacheEntry(data, steps, issued_at + self.ttl, size)
+        self._steps_by_cell.setdefault(cell, set()).add(steps)
+        self.total_bytes += size
+
+        # 更短天数的条目已被新条目覆盖，不再需要
+        for cached_steps in list(self._steps_by_cell[cell]):
+            if cached_steps < steps:
+                self._remove((*cell, cached_steps))
+
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Tuple[int, int, int]):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry.size
+        cell = key[:2]
+        steps = self._steps_by_cell[cell]
+        steps.discard(key[2])
+        if not steps:
+            del self._steps_by_cell[cell]
+
+    def clear(self):
+        """清空缓存（保留统计计数）"""
+        self._entries.clear()
+        self._steps_by_cell.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
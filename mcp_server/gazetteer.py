@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+离线地名库
+将 GeoNames 风格的 TSV（如 cities500.txt）编译为紧凑的二进制文件，运行时通过 mmap 只读映射：
+名称按 UTF-8 字节序排序存放在字符串表中，坐标存放在 float32 数组中，二分查找，启动快、常驻内存低
+
+用法：python mcp_server/gazetteer.py cities500.txt .cache/gazetteer.bin
+"""
+
+import array
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mcp_server.city_index import normalize_name
+
+logger = logging.getLogger("weather-mcp-server")
+
+MAGIC = b"GZTR"
+VERSION = 1
+# 文件头：magic、版本、地点数、名称数，以及 9 个分段的起始偏移
+_HEADER = struct.Struct("<4sIII9Q")
+_SECTIONS = (
+    "lat", "lon", "population", "country",
+    "label_offsets", "labels", "key_offsets", "keys", "key_places",
+)
+
+# GeoNames 列：geonameid, name, asciiname, alternatenames, latitude, longitude,
+# feature class, feature code, country code, ..., population（第 15 列）
+_COL_NAME, _COL_ASCII, _COL_ALT, _COL_LAT, _COL_LON, _COL_CLASS, _COL_COUNTRY, _COL_POPULATION = 1, 2, 3, 4, 5, 6, 8, 14
+
+
+@dataclass(frozen=True)
+class Place:
+    """离线地名库中的地点"""
+    name: str
+    country_code: str
+    lat: float
+    lon: float
+    population: int
+
+    @property
+    def coordinates(self) -> Tuple[float, float]:
+        return (self.lat, self.lon)
+
+
+def parse_geonames(lines: Iterable[str], feature_classes: Sequence[str] = ("P",)) -> Iterator[Tuple[str, List[str], float, float, str, int]]:
+    """解析 GeoNames TSV，产出 (名称, 别名列表, 纬度, 经度, 国家代码, 人口)"""
+    for line in lines:
+        if not line.strip() or line.startswith("#"):
+            continue
+        cols = line.rstrip("\n").split("\t")
+        if len(cols) <= _COL_LON:
+            continue
+        if len(cols) > _COL_CLASS and feature_classes and cols[_COL_CLASS] not in feature_classes:
+            continue
+        try:
+            lat, lon = float(cols[_COL_LAT]), float(cols[_COL_LON])
+        except ValueError:
+            continue
+        names = [cols[_COL_NAME], cols[_COL_ASCII]] + [n for n in cols[_COL_ALT].split(",") if n]
+        country = cols[_COL_COUNTRY] if len(cols) > _COL_COUNTRY else ""
+        population = int(cols[_COL_POPULATION]) if len(cols) > _COL_POPULATION and cols[_COL_POPULATION].isdigit() else 0
+        yield cols[_COL_NAME], names, lat, lon, country, population
+
+
+def _string_table(strings: Sequence[bytes]) -> Tuple[bytes, bytes]:
+    offsets = array.array("I", [0])
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    return offsets.tobytes(), b"".join(strings)
+
+
+def build(source: str, target: str, feature_classes: Sequence[str] = ("P",)) -> int:
+    """将 TSV 地名库编译为二进制文件，返回地点数
+
+    同一名称对应多个地点时只保留人口最多的一个。
+    """
+    lats, lons, populations = array.array("f"), array.array("f"), array.array("I")
+    countries, labels = bytearray(), []
+    best: Dict[bytes, int] = {}
+
+    with open(source, encoding="utf-8") as f:
+        for name, names, lat, lon, country, population in parse_geonames(f, feature_classes):
+            place = len(labels)
+            lats.append(lat)
+            lons.append(lon)
+            populations.append(min(population, 0xFFFFFFFF))
+            countries += country.encode("ascii", "replace")[:2].ljust(2)
+            labels.append(name.encode("utf-8"))
+            for alias in names:
+                key = normalize_name(alias).encode("utf-8")
+                if key and (key not in best or populations[best[key]] < populations[place]):
+                    best[key] = place
+
+    keys = sorted(best)
+    key_places = array.array("I", (best[key] for key in keys))
+    label_offsets, label_blob = _string_table(labels)
+    key_offsets, key_blob = _string_table(keys)
+    sections = [
+        lats.tobytes(), lons.tobytes(), populations.tobytes(), bytes(countries),
+        label_offsets, label_blob, key_offsets, key_blob, key_places.tobytes(),
+    ]
+
+    # 各分段按 8 字节对齐，便于 memoryview 按数值类型读取
+    offsets, position = [], _HEADER.size
+    for section in sections:
+        position += -position % 8
+        offsets.append(position)
+        position += len(section)
+
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    tmp = f"{target}.tmp"
+    with open(tmp, "wb") as out:
+        out.write(_HEADER.pack(MAGIC, VERSION, len(labels), len(keys), *offsets))
+        for offset, section in zip(offsets, sections):
+            out.write(b"\0" * (offset - out.tell()))
+            out.write(section)
+    os.replace(tmp, target)
+    logger.info(f"🗂️ 离线地名库编译完成：{len(labels)} 个地点，{len(keys)} 个名称 -> {target}")
+    return len(labels)
+
+
+class _KeyView(Sequence):
+    """名称表的只读序列视图，供 bisect 二分查找"""
+
+    def __init__(self, offsets: memoryview, blob: memoryview, count: int):
+        self._offsets = offsets
+        self._blob = blob
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> bytes:
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes()
+
+
+class Gazetteer:
+    """只读的 mmap 离线地名库"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        self._views = [view]
+        if len(view) < _HEADER.size:
+            self.close()
+            raise ValueError(f"不是有效的离线地名库文件：{path}")
+        magic, version, self.place_count, self.name_count, *offsets = _HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"不是有效的离线地名库文件：{path}")
+        sections = dict(zip(_SECTIONS, offsets))
+
+        def section(name: str, length: int, fmt: str = "B") -> memoryview:
+            start = sections[name]
+            raw = view[start:start + length]
+            self._views += [raw, raw.cast(fmt)]
+            return self._views[-1]
+
+        n, k = self.place_count, self.name_count
+        self.lats = section("lat", 4 * n, "f")
+        self.lons = section("lon", 4 * n, "f")
+        self.populations = section("population", 4 * n, "I")
+        self._countries = section("country", 2 * n)
+        self._label_offsets = section("label_offsets", 4 * (n + 1), "I")
+        self._labels = section("labels", self._label_offsets[n] if n else 0)
+        key_offsets = section("key_offsets", 4 * (k + 1), "I")
+        self._keys = _KeyView(key_offsets, section("keys", key_offsets[k] if k else 0), k)
+        self._key_places = section("key_places", 4 * k, "I")
+
+    def place(self, i: int) -> Place:
+        """按下标读取地点"""
+        name = self._labels[self._label_offsets[i]:self._label_offsets[i + 1]].tobytes().decode("utf-8")
+        country = self._countries[2 * i:2 * i + 2].tobytes().decode("ascii").strip()
+        return Place(name, country, round(self.lats[i], 5), round(self.lons[i], 5), self.populations[i])
+
+    def lookup(self, name: str) -> Optional[Place]:
+        """按名称精确查找（与内置城市索引相同的规范化规则）"""
+        key = normalize_name(name).encode("utf-8") if name else b""
+        if not key:
+            return None
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self.place(self._key_places[i])
+        return None
+
+    def __len__(self) -> int:
+        return self.place_count
+
+    def close(self):
+        """释放映射"""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+        self._file.close()
+
+
+def load_gazetteer(source: str, compiled: str) -> Optional[Gazetteer]:
+    """加载离线地名库：source 为 TSV 时按需（缺失或源文件更新时）编译到 compiled 后映射"""
+    if not source:
+        return None
+    try:
+        if not source.endswith(".bin"):
+            if not os.path.exists(compiled) or os.path.getmtime(compiled) < os.path.getmtime(source):
+                build(source, compiled)
+            source = compiled
+        gazetteer = Gazetteer(source)
+        logger.info(f"🗂️ 已加载离线地名库：{len(gazetteer)} 个地点")
+        return gazetteer
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ 离线地名库加载失败，仅使用内置城市和高德地图API：{e}")
+        return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="编译 GeoNames 风格的离线地名库")
+    parser.add_argument("source", help="GeoNames TSV 文件，如 cities500.txt")
+    parser.add_argument("target", help="输出的二进制文件路径")
+    parser.add_argument("--feature-classes", default="P", help="保留的要素类别（逗号分隔，默认 P 即居民点）")
+    args = parser.parse_args()
+    build(args.source, args.target, [c for c in args.feature_classes.split(",") if c])
@@ -0,0 +1,115 @@
+"""
+持久化地理编码缓存
+基于 SQLite（WAL 模式），支持 TTL 和未命中结果缓存，多个服务器进程可共享同一个数据库文件
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("weather-mcp-server")
+
+Coordinates = Tuple[float, float]
+
+
+@dataclass
+class GeocodeEntry:
+    """地理编码缓存条目，coordinates 为 None 表示已确认查无此地"""
+    coordinates: Optional[Coordinates]
+    expires_at: float
+
+
+class GeocodeStore:
+    """地理编码持久化存储
+
+    启动时将未过期的记录预加载到内存；内存未命中时再查询数据库，
+    以便读取到其他进程新写入的结果。path 为 ":memory:" 时不落盘。
+    """
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        ttl: float = 30 * 24 * 3600,
+        negative_ttl: float = 24 * 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._memory: Dict[str, GeocodeEntry] = {}
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS geocode (
+                name TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self.load()
+
+    def load(self) -> int:
+        """清理过期记录并把有效记录预加载到内存"""
+        now = self.clock()
+        self._conn.execute("DELETE FROM geocode WHERE expires_at <= ?", (now,))
+        rows = self._conn.execute("SELECT name, lat, lon, expires_at FROM geocode").fetchall()
+        self._memory = {name: self._entry(lat, lon, expires_at) for name, lat, lon, expires_at in rows}
+        if self._memory:
+            logger.info(f"📦 已预加载 {len(self._memory)} 条地理编码缓存")
+        return len(self._memory)
+
+    @staticmethod
+    def _entry(lat: Optional[float], lon: Optional[float], expires_at: float) -> GeocodeEntry:
+        coordinates = (lat, lon) if lat is not None and lon is not None else None
+        return GeocodeEntry(coordinates, expires_at)
+
+    def get(self, name: str) -> Optional[GeocodeEntry]:
+        """查询缓存，返回 None 表示没有有效记录"""
+        now = self.clock()
+        entry = self._memory.get(name)
+        if entry is None or entry.expires_at <= now:
+            # 内存中没有或已过期时查询数据库，其他进程可能已写入新结果
+            row = self._conn.execute(
+                "SELECT lat, lon, expires_at FROM geocode WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None or row[2] <= now:
+                self._memory.pop(name, None)
+                return None
+            entry = self._entry(*row)
+            self._memory[name] = entry
+        return entry
+
+    def put(self, name: str, coordinates: Optional[Coordinates]):
+        """写入地理编码结果，coordinates 为 None 时按未命中 TTL 缓存"""
+        ttl = self.ttl if coordinates is not None else self.negative_ttl
+        entry = GeocodeEntry(coordinates, self.clock() + ttl)
+        self._memory[name] = entry
+        lat, lon = coordinates if coordinates is not None else (None, None)
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (name, lat, lon, expires_at) VALUES (?, ?, ?, ?)",
+                (name, lat, lon, entry.expires_at),
+            )
+        except sqlite3.Error as e:
+            # 写入失败不影响本进程的内存缓存
+            logger.warning(f"⚠️ 地理编码缓存写入失败：{name}, 错误：{e}")
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def __len__(self) -> int:
+        return len(self._memory)
@@ -0,0 +1,110 @@
+"""
+共享 HTTP 客户端池
+按上游主机复用 keep-alive 连接，避免每次工具调用都重新建立 TCP/TLS 连接
+"""
+
+import asyncio
+import logging
+from typing import Dict
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger("weather-mcp-server")
+
+
+def http2_available() -> bool:
+    """检查是否安装了 HTTP/2 支持（h2 包）"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HttpClientPool:
+    """按上游主机划分的 httpx.AsyncClient 连接池
+
+    每个 scheme://host:port 对应一个长连接客户端，HTTP/2 通过 ALPN 自动协商，
+    上游不支持时自动回退到 HTTP/1.1。
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 10.0,
+        http2: bool = True,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.http2 = http2 and http2_available()
+        # 连接绑定在创建它的事件循环上，每个事件循环各自一组客户端
+        self._clients: Dict[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]] = {}
+        self._closers: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _loop_clients(self) -> Dict[str, httpx.AsyncClient]:
+        """当前事件循环的客户端；首次使用时登记关闭任务，事件循环退出时随之关闭客户端"""
+        loop = asyncio.get_running_loop()
+        clients = self._clients.get(loop)
+        if clients is None:
+            # 没有正常退出（未取消剩余任务）就关闭的事件循环，其连接已无法关闭，只移除记录
+            for closed in [other for other in self._clients if other.is_closed()]:
+                self._clients.pop(closed)
+                self._closers.pop(closed, None)
+            clients = self._clients[loop] = {}
+            self._closers[loop] = loop.create_task(self._close_on_exit(loop, clients))
+        return clients
+
+    async def _close_on_exit(self, loop: asyncio.AbstractEventLoop, clients: Dict[str, httpx.AsyncClient]):
+        """等待到事件循环退出（asyncio.run 退出前会取消剩余任务），然后关闭该事件循环的客户端"""
+        try:
+            await loop.create_future()
+        finally:
+            if self._clients.get(loop) is clients:
+                await self._close_clients(loop)
+
+    async def _close_clients(self, loop: asyncio.AbstractEventLoop):
+        clients = self._clients.pop(loop, {})
+        self._closers.pop(loop, None)
+        for client in clients.values():
+            await client.aclose()
+        if clients:
+            logger.info(f"🔒 已关闭 {len(clients)} 个共享HTTP客户端")
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """获取 url 所属主机的共享客户端（按需创建）"""
+        clients = self._loop_clients()
+        origin = self._origin(url)
+        client = clients.get(origin)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+            )
+            clients[origin] = client
+            logger.info(f"🔗 创建共享HTTP客户端：{origin}（HTTP/2：{'开启' if self.http2 else '关闭'}）")
+        return client
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        """通过共享客户端发送 GET 请求"""
+        return await self.get_client(url).get(url, **kwargs)
+
+    async def aclose(self):
+        """关闭当前事件循环的所有客户端，释放连接（其他事件循环的客户端在各自退出时关闭）"""
+        loop = asyncio.get_running_loop()
+        closer = self._closers.get(loop)
+        await self._close_clients(loop)
+        if closer is not None:
+            closer.cancel()
@@ -0,0 +1,153 @@
+"""
+IP 定位
+可插拔的定位服务：在线 ipapi.co 或离线 MaxMind DB（mmap），外层按客户端 IP 做带 TTL 的 LRU 缓存
+"""
+
+import ipaddress
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from mcp_server.singleflight import SingleFlight
+
+logger = logging.getLogger("weather-mcp-server")
+
+
+@dataclass(frozen=True)
+class IPLocation:
+    """IP 定位结果，字段缺失时为空字符串或 None"""
+    ip: str
+    country: str = ""
+    region: str = ""
+    city: str = ""
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+
+class IPLocationProvider(ABC):
+    """定位服务接口，ip 为 None 时定位本机出口 IP；持有资源的实现覆盖 close"""
+
+    name = "unknown"
+
+    @abstractmethod
+    async def locate(self, ip: Optional[str]) -> IPLocation:
+        """定位 ip，失败时抛出异常"""
+
+    def close(self):
+        pass
+
+
+class IpapiProvider(IPLocationProvider):
+    """ipapi.co 在线定位"""
+
+    name = "ipapi"
+
+    def __init__(self, http, guard, url: str = "https://ipapi.co/json/", ip_url: str = "https://ipapi.co/{ip}/json/"):
+        self.http = http
+        self.guard = guard
+        self.url = url
+        self.ip_url = ip_url
+
+    async def locate(self, ip: Optional[str]) -> IPLocation:
+        url = self.ip_url.format(ip=ip) if ip else self.url
+        response = await self.guard.request(lambda: self.http.get(url, timeout=10.0))
+        response.raise_for_status()
+        data = response.json()
+        return IPLocation(
+            ip=data.get("ip", ip or ""),
+            country=data.get("country_name", "") or "",
+            region=data.get("region", "") or "",
+            city=data.get("city", "") or "",
+            latitude=data.get("latitude"),
+            longitude=data.get("longitude"),
+        )
+
+
+def _localized(record: Dict[str, Any], language: str) -> str:
+    names = record.get("names", {}) if record else {}
+    return names.get(language) or names.get("en", "")
+
+
+class MmdbProvider(IPLocationProvider):
+    """离线 MaxMind DB（GeoLite2-City / GeoIP2-City 格式）定位
+
+    本地数据库无法得知本机出口 IP，ip 为 None 时交给 fallback（通常是在线服务）。
+    """
+
+    name = "mmdb"
+
+    def __init__(self, reader, fallback: Optional[IPLocationProvider] = None, language: str = "zh-CN"):
+        self.reader = reader
+        self.fallback = fallback
+        self.language = language
+
+    async def locate(self, ip: Optional[str]) -> IPLocation:
+        if not ip:
+            if self.fallback is None:
+                return IPLocation(ip="")
+            return await self.fallback.locate(None)
+        record = self.reader.get(ip)
+        if not record:
+            return IPLocation(ip=ip)
+        location = record.get("location", {})
+        subdivisions = record.get("subdivisions") or [{}]
+        return IPLocation(
+            ip=ip,
+            country=_localized(record.get("country"), self.language),
+            region=_localized(subdivisions[0], self.language),
+            city=_localized(record.get("city"), self.language),
+            latitude=location.get("latitude"),
+            longitude=location.get("longitude"),
+        )
+
+    def close(self):
+        self.reader.close()
+
+
+class CachedIPLocator:
+    """按客户端 IP 缓存定位结果（LRU + TTL），相同 IP 的并发请求合并为一次查询"""
+
+    def __init__(
+        self,
+        provider: IPLocationProvider,
+        ttl: float = 3600.0,
+        max_entries: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.provider = provider
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[IPLocation, float]]" = OrderedDict()
+        self.inflight = SingleFlight()
+
+    async def locate(self, ip: Optional[str] = None) -> IPLocation:
+        """定位指定 IP（为空时定位本机出口 IP），无效 IP 抛出 ValueError"""
+        key = str(ipaddress.ip_address(ip.strip())) if ip and ip.strip() else ""
+        cached = self._entries.get(key)
+        if cached is not None and cached[1] > self.clock():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+
+        self.misses += 1
+        return await self.inflight.do(("ip", key), lambda: self._refresh(key))
+
+    async def _refresh(self, key: str) -> IPLocation:
+        location = await self.provider.locate(key or None)
+        self._entries[key] = (location, self.clock() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return location
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        self.provider.close()
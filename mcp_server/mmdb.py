@@ -0,0 +1,166 @@
+"""
+MaxMind DB（.mmdb）只读解析器
+通过 mmap 映射数据库文件，按位遍历搜索树后解码数据段，用于离线 IP 定位（如 GeoLite2-City）；
+安装了 maxminddb 时优先使用官方实现
+"""
+
+import ipaddress
+import mmap
+import struct
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import maxminddb
+except ImportError:  # maxminddb 为可选依赖
+    maxminddb = None
+
+_METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+# 数据段与搜索树之间的 16 字节分隔
+_DATA_SECTION_SEPARATOR = 16
+
+
+class InvalidDatabaseError(ValueError):
+    """数据库文件格式错误"""
+
+
+class MmdbReader:
+    """最小化的 MaxMind DB 读取器，支持 24/28/32 位记录和 IPv4/IPv6 搜索树"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        marker = self._buffer.rfind(_METADATA_MARKER, max(0, len(self._buffer) - 128 * 1024))
+        if marker < 0:
+            self.close()
+            raise InvalidDatabaseError(f"不是有效的 MaxMind DB 文件：{path}")
+        metadata_start = marker + len(_METADATA_MARKER)
+        self.metadata: Dict[str, Any] = self._decode(metadata_start, base=metadata_start)[0]
+        try:
+            self.node_count = self.metadata["node_count"]
+            self.record_size = self.metadata["record_size"]
+            self.ip_version = self.metadata["ip_version"]
+        except KeyError as e:
+            self.close()
+            raise InvalidDatabaseError(f"MaxMind DB 元数据缺少字段：{e}") from None
+        if self.record_size not in (24, 28, 32):
+            self.close()
+            raise InvalidDatabaseError(f"不支持的记录长度：{self.record_size}")
+        self._node_bytes = self.record_size // 4
+        self._data_start = self.node_count * self._node_bytes + _DATA_SECTION_SEPARATOR
+        self._ipv4_start: Optional[int] = None
+
+    def _read_record(self, node: int, bit: int) -> int:
+        offset = node * self._node_bytes
+        buf = self._buffer
+        if self.record_size == 24:
+            start = offset + 3 * bit
+            return int.from_bytes(buf[start:start + 3], "big")
+        if self.record_size == 28:
+            middle = buf[offset + 3]
+            if bit == 0:
+                return ((middle & 0xF0) << 20) | int.from_bytes(buf[offset:offset + 3], "big")
+            return ((middle & 0x0F) << 24) | int.from_bytes(buf[offset + 4:offset + 7], "big")
+        start = offset + 4 * bit
+        return int.from_bytes(buf[start:start + 4], "big")
+
+    def _start_node(self, bit_count: int) -> int:
+        # IPv6 树中的 IPv4 地址位于 ::/96 子树
+        if self.ip_version == 4 or bit_count == 128:
+            return 0
+        if self._ipv4_start is None:
+            node = 0
+            for _ in range(96):
+                if node >= self.node_count:
+                    break
+                node = self._read_record(node, 0)
+            self._ipv4_start = node
+        return self._ipv4_start
+
+    def get(self, ip: str) -> Optional[Any]:
+        """查找 IP 对应的记录，未收录时返回 None"""
+        address = ipaddress.ip_address(ip)
+        if address.version == 6 and self.ip_version == 4:
+            raise ValueError(f"IPv4 数据库无法查询 IPv6 地址：{ip}")
+        packed = address.packed
+        bit_count = len(packed) * 8
+        node = self._start_node(bit_count)
+        for i in range(bit_count):
+            if node >= self.node_count:
+                break
+            bit = (packed[i >> 3] >> (7 - (i & 7))) & 1
+            node = self._read_record(node, bit)
+        if node == self.node_count:
+            return None
+        if node < self.node_count:
+            raise InvalidDatabaseError("搜索树结构无效")
+        offset = node - self.node_count - _DATA_SECTION_SEPARATOR
+        return self._decode(self._data_start + offset, base=self._data_start)[0]
+
+    def _decode(self, offset: int, base: int) -> Tuple[Any, int]:
+        """从 offset 处解码一个值，返回 (值, 下一个值的偏移)；指针相对于 base"""
+        buf = self._buffer
+        control = buf[offset]
+        offset += 1
+        kind = control >> 5
+        if kind == 0:  # 扩展类型
+            kind = 7 + buf[offset]
+            offset += 1
+
+        if kind == 1:  # 指针
+            size = (control >> 3) & 0x3
+            value = control & 0x7
+            if size == 0:
+                pointer = (value << 8) | buf[offset]
+            elif size == 1:
+                pointer = ((value << 16) | int.from_bytes(buf[offset:offset + 2], "big")) + 2048
+            elif size == 2:
+                pointer = ((value << 24) | int.from_bytes(buf[offset:offset + 3], "big")) + 526336
+            else:
+                pointer = int.from_bytes(buf[offset:offset + 4], "big")
+            return self._decode(base + pointer, base)[0], offset + size + 1
+
+        size = control & 0x1F
+        if size >= 29:
+            extra = size - 28
+            value = int.from_bytes(buf[offset:offset + extra], "big")
+            size = (29, 285, 65821)[extra - 1] + value
+            offset += extra
+
+        if kind == 2:  # UTF-8 字符串
+            return buf[offset:offset + size].decode("utf-8"), offset + size
+        if kind == 3:  # double
+            return struct.unpack(">d", buf[offset:offset + 8])[0], offset + 8
+        if kind == 4:  # bytes
+            return bytes(buf[offset:offset + size]), offset + size
+        if kind in (5, 6, 9, 10):  # 无符号整数
+            return int.from_bytes(buf[offset:offset + size], "big"), offset + size
+        if kind == 8:  # int32
+            return int.from_bytes(buf[offset:offset + size], "big", signed=size == 4), offset + size
+        if kind == 7:  # map
+            result = {}
+            for _ in range(size):
+                key, offset = self._decode(offset, base)
+                result[key], offset = self._decode(offset, base)
+            return result, offset
+        if kind == 11:  # array
+            items = []
+            for _ in range(size):
+                item, offset = self._decode(offset, base)
+                items.append(item)
+            return items, offset
+        if kind == 14:  # boolean（值保存在 size 中）
+            return bool(size), offset
+        if kind == 15:  # float
+            return struct.unpack(">f", buf[offset:offset + 4])[0], offset + 4
+        raise InvalidDatabaseError(f"不支持的数据类型：{kind}")
+
+    def close(self):
+        self._buffer.close()
+
+
+def open_mmdb(path: str):
+    """打开 MaxMind DB：优先使用 maxminddb（MODE_MMAP），未安装时使用内置读取器"""
+    if maxminddb is not None:
+        return maxminddb.open_database(path, maxminddb.MODE_MMAP)
+    return MmdbReader(path)
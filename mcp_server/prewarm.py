@@ -0,0 +1,72 @@
+"""
+热门城市预热调度器
+周期性刷新热门城市的天气缓存，使用户请求几乎总能命中缓存
+"""
+
+import asyncio
+import logging
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger("weather-mcp-server")
+
+
+class PrewarmScheduler:
+    """后台预热调度器
+
+    预热目标 = 配置的热门城市 + 按请求次数统计的前 top_k 个城市。
+    每一轮把刷新均匀分散在 interval 秒内，且只刷新在下一轮之前会过期的条目，
+    上游请求仍经过 WeatherAPI 的限流器。
+    """
+
+    def __init__(
+        self,
+        weather_api,
+        interval: float = 600.0,
+        hot_cities: Iterable[str] = (),
+        top_k: int = 0,
+    ):
+        self.weather_api = weather_api
+        self.interval = interval
+        self.hot_cities = [city for city in hot_cities if city]
+        self.top_k = top_k
+        self.refreshed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def targets(self) -> List[str]:
+        """本轮需要预热的城市（去重，保持顺序）"""
+        observed = [city for city, _ in self.weather_api.request_counts.most_common(self.top_k)] if self.top_k > 0 else []
+        return list(dict.fromkeys(self.hot_cities + observed))
+
+    async def run_once(self):
+        """执行一轮预热，刷新间隔均匀分布在 interval 内"""
+        targets = self.targets()
+        if not targets:
+            await asyncio.sleep(self.interval)
+            return
+
+        spacing = self.interval / len(targets)
+        for city in targets:
+            try:
+                if await self.weather_api.prewarm(city, within=self.interval):
+                    self.refreshed += 1
+            except Exception as e:
+                logger.warning(f"⚠️ 预热{city}天气失败：{e}")
+            await asyncio.sleep(spacing)
+
+    async def run(self):
+        """持续运行，直到被取消"""
+        logger.info(f"🔥 天气预热已启动：间隔{self.interval}秒，热门城市{len(self.hot_cities)}个，Top-{self.top_k}")
+        while True:
+            await self.run_once()
+
+    def start(self):
+        """在当前事件循环中启动后台任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        """停止后台任务"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,172 @@
+"""
+上游保护
+令牌桶限流 + 带抖动的指数退避重试（遵循 Retry-After）+ 熔断器
+"""
+
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+logger = logging.getLogger("weather-mcp-server")
+
+# 可重试的响应状态码
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """异步令牌桶，rate 为每秒补充的令牌数，rate <= 0 表示不限流"""
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.updated_at = clock()
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """获取一个令牌，不足时按先来后到等待"""
+        if self.rate <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 锁绑定在事件循环上，切换事件循环后重建
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时快速失败"""
+
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，冷却期后放行一次试探请求"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_started_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def check(self):
+        """请求前检查，熔断中直接抛出 CircuitOpenError"""
+        state = self.state
+        if state == "half_open":
+            # 同一时间只放行一个试探请求；试探请求未返回结果（如被取消）时，冷却期后再放行
+            now = self.clock()
+            if self._trial_started_at is None or now - self._trial_started_at >= self.reset_timeout:
+                self._trial_started_at = now
+                return
+        if state != "closed":
+            raise CircuitOpenError(f"{self.name}服务暂时不可用（熔断中），请稍后再试")
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_started_at = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"🚧 {self.name}连续失败{self.failures}次，熔断器打开")
+            self.opened_at = self.clock()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamGuard:
+    """单个上游服务的保护策略：限流、重试与熔断"""
+
+    def __init__(
+        self,
+        name: str,
+        bucket: TokenBucket,
+        breaker: CircuitBreaker,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        self.name = name
+        self.bucket = bucket
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+
+    def backoff(self, attempt: int) -> float:
+        """全抖动指数退避"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def request(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """执行请求；可重试的错误按退避策略重试，最后一次的响应或异常原样返回给调用方"""
+        for attempt in range(self.max_retries + 1):
+            self.breaker.check()
+            await self.bucket.acquire()
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await send()
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                if last_attempt:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"🔁 {self.name}请求失败（{e.__class__.__name__}），{delay:.2f}秒后重试")
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    self.breaker.record_success()
+                    return response
+                # 429 表示配额受限而非服务故障，不计入熔断
+                if response.status_code != 429:
+                    self.breaker.record_failure()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if last_attempt or (retry_after is not None and retry_after > self.backoff_max):
+                    return response
+                delay = retry_after if retry_after is not None else self.backoff(attempt)
+                logger.warning(f"🔁 {self.name}返回{response.status_code}，{delay:.2f}秒后重试")
+            await self.sleep(delay)
@@ -0,0 +1,136 @@
+"""
+空间索引
+坐标转换为单位球面上的三维向量后建立 KD 树，弦长与球面距离单调对应，可精确查找最近邻；
+安装了 NumPy 时使用向量化建树和批量查询，否则使用纯 Python 实现
+"""
+
+import math
+from typing import List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+
+# 批量查询时每块的 查询点数 × 索引点数 上限，控制临时矩阵的内存占用
+_BATCH_CELLS = 4_000_000
+# 索引点数不超过该值时批量查询使用向量化暴力计算，否则逐点查询 KD 树
+_BRUTE_FORCE_MAX_POINTS = 4096
+# 建树时区间小于该长度改用 Python 排序（NumPy 调用开销在小区间上占主导）
+_NUMPY_MIN_SEGMENT = 512
+
+
+def to_unit_vector(lat: float, lon: float) -> Tuple[float, float, float]:
+    """经纬度转换为单位球面向量"""
+    phi, lam = math.radians(lat), math.radians(lon)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+def chord_to_km(chord: float) -> float:
+    """单位球面弦长转换为地表距离（公里）"""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """两点间的球面距离（公里）"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex:
+    """最近邻索引
+
+    KD 树以隐式数组存储（区间中点为节点），首次查询时才建树，
+    因此为大型离线地名库创建索引不会拖慢启动。
+    """
+
+    def __init__(self, lats: Sequence[float], lons: Sequence[float]):
+        if len(lats) != len(lons):
+            raise ValueError("纬度和经度数量不一致")
+        self._lats = lats
+        self._lons = lons
+        self._order: Optional[List[int]] = None
+        self._xyz: Optional[Tuple[List[float], List[float], List[float]]] = None
+        self._vectors = None  # NumPy 可用时的 (n, 3) 数组
+
+    def __len__(self) -> int:
+        return len(self._lats)
+
+    def _build(self):
+        if self._order is not None:
+            return
+        n = len(self)
+        if np is not None:
+            phi = np.radians(np.asarray(self._lats, dtype=np.float64))
+            lam = np.radians(np.asarray(self._lons, dtype=np.float64))
+            self._vectors = np.column_stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+            self._xyz = tuple(self._vectors[:, k].tolist() for k in range(3))
+        else:
+            points = [to_unit_vector(self._lats[i], self._lons[i]) for i in range(n)]
+            self._xyz = tuple([p[k] for p in points] for k in range(3))
+
+        order = np.arange(n) if np is not None else list(range(n))
+        stack = [(0, n, 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if hi - lo <= 1:
+                continue
+            mid = (lo + hi) // 2
+            if np is not None and hi - lo >= _NUMPY_MIN_SEGMENT:
+                segment = order[lo:hi]
+                order[lo:hi] = segment[np.argpartition(self._vectors[segment, axis], mid - lo)]
+            else:
+                coord = self._xyz[axis]
+                order[lo:hi] = sorted(order[lo:hi].tolist() if np is not None else order[lo:hi], key=coord.__getitem__)
+            stack += [(lo, mid, (axis + 1) % 3), (mid + 1, hi, (axis + 1) % 3)]
+        self._order = order.tolist() if np is not None else order
+
+    def nearest(self, lat: float, lon: float) -> Optional[Tuple[int, float]]:
+        """最近的点，返回 (下标, 距离公里数)；索引为空时返回 None"""
+        if not len(self):
+            return None
+        self._build()
+        q = to_unit_vector(lat, lon)
+        xyz, order = self._xyz, self._order
+        best_i, best_d2 = -1, math.inf
+        # 栈元素：(区间起点, 区间终点, 划分轴, 区间到查询点距离平方的下界)
+        stack = [(0, len(order), 0, 0.0)]
+        while stack:
+            lo, hi, axis, bound = stack.pop()
+            if lo >= hi or bound >= best_d2:
+                continue
+            mid = (lo + hi) // 2
+            i = order[mid]
+            dx, dy, dz = q[0] - xyz[0][i], q[1] - xyz[1][i], q[2] - xyz[2][i]
+            d2 = dx * dx + dy * dy + dz * dz
+            if d2 < best_d2:
+                best_i, best_d2 = i, d2
+            diff = q[axis] - xyz[axis][i]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            next_axis = (axis + 1) % 3
+            # 后压入的近侧先搜索，远侧出栈时按更新后的最优距离剪枝
+            stack.append((*far, next_axis, diff * diff))
+            stack.append((*near, next_axis, 0.0))
+        return best_i, chord_to_km(math.sqrt(best_d2))
+
+    def nearest_many(self, lats: Sequence[float], lons: Sequence[float]) -> List[Optional[Tuple[int, float]]]:
+        """批量最近邻查询；NumPy 可用时分块向量化计算"""
+        if np is None or not len(self) or len(self) > _BRUTE_FORCE_MAX_POINTS:
+            return [self.nearest(lat, lon) for lat, lon in zip(lats, lons)]
+        self._build()
+        phi = np.radians(np.asarray(lats, dtype=np.float64))
+        lam = np.radians(np.asarray(lons, dtype=np.float64))
+        queries = np.column_stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+        chunk = max(1, _BATCH_CELLS // len(self))
+        results: List[Optional[Tuple[int, float]]] = []
+        for start in range(0, len(queries), chunk):
+            # 单位向量点积最大即距离最近
+            dots = queries[start:start + chunk] @ self._vectors.T
+            best = dots.argmax(axis=1)
+            chords = np.sqrt(np.clip(2 - 2 * dots[np.arange(len(best)), best], 0, 4))
+            results += [(int(i), chord_to_km(float(c))) for i, c in zip(best, chords)]
+        return results
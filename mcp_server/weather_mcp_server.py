@@ -7,14 +7,17 @@
 import os
 import sys
 import httpx
+import ipaddress
+import json
+import asyncio
 import logging
+from collections import Counter
+from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 
-# 必须在导入 FastMCP 之前设置环境变量和日志配置
-os.environ["FASTMCP_LOG_LEVEL"] = "CRITICAL"
-os.environ["NO_COLOR"] = "1"
-os.environ["TERM"] = "dumb"
+from fastmcp import FastMCP
+from fastmcp.utilities.logging import configure_logging as configure_fastmcp_logging
 
 # 自定义日志过滤器，过滤掉特定消息
 class MessageFilter(logging.Filter):
@@ -25,34 +28,63 @@ class MessageFilter(logging.Filter):
             return False
         return True
 
-# 设置基本日志配置
-logging.basicConfig(level=logging.INFO, format='%(message)s')
+def configure_server_logging():
+    """作为独立服务器进程（stdio/HTTP/SSE）运行时的环境变量和日志配置
+    
+    只在以脚本方式运行时调用：进程内加载本模块时不修改宿主进程的环境变量和日志级别，
+    服务器日志遵循宿主（如命令行界面的简洁模式）的根日志配置。
+    """
+    os.environ["FASTMCP_LOG_LEVEL"] = "CRITICAL"
+    os.environ["NO_COLOR"] = "1"
+    os.environ["TERM"] = "dumb"
+    # FastMCP 在导入时已按默认级别配置了日志处理器，这里按新的环境变量重新配置
+    configure_fastmcp_logging(level="CRITICAL")
+
+    # 设置基本日志配置
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-# 为根日志器添加过滤器
-root_logger = logging.getLogger()
-root_logger.addFilter(MessageFilter())
+    # 为根日志器添加过滤器
+    logging.getLogger().addFilter(MessageFilter())
 
-# 预先设置所有可能的日志器级别
-for logger_name in [
-    "FastMCP", "FastMCP.server", "FastMCP.server.server",
-    "fastmcp", "fastmcp.server", "fastmcp.server.server",
-    "mcp", "mcp.server", "rich", "httpx"
-]:
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.WARNING)  # 允许警告和错误，但过滤掉 INFO 级别的启动消息
-    logger.addFilter(MessageFilter())
+    # 预先设置所有可能的日志器级别
+    for logger_name in [
+        "FastMCP", "FastMCP.server", "FastMCP.server.server",
+        "fastmcp", "fastmcp.server", "fastmcp.server.server",
+        "mcp", "mcp.server", "rich", "httpx"
+    ]:
+        library_logger = logging.getLogger(logger_name)
+        library_logger.setLevel(logging.WARNING)  # 允许警告和错误，但过滤掉 INFO 级别的启动消息
+        library_logger.addFilter(MessageFilter())
 
-# 现在才导入 FastMCP
-from fastmcp import FastMCP
+    # 允许天气服务器的关键日志
+    logging.getLogger("weather-mcp-server").setLevel(logging.INFO)
+
+# 以独立服务器进程运行时，在加载配置和初始化共享资源之前完成日志配置
+if __name__ == "__main__":
+    configure_server_logging()
 
 # 加载环境变量
-parent_dir = os.path.dirname(os.path.dirname(__file__))
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 load_dotenv(os.path.join(parent_dir, ".env.local"))
 load_dotenv(os.path.join(parent_dir, ".env"))
 
-# 允许天气服务器的关键日志
+# 以脚本方式运行时，确保可以导入 mcp_server 包内的其他模块
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+from mcp_server.http_clients import HttpClientPool
+from mcp_server.forecast_cache import ForecastCache
+from mcp_server.singleflight import SingleFlight
+from mcp_server.geocode_store import GeocodeStore
+from mcp_server.rate_limit import CircuitBreaker, TokenBucket, UpstreamGuard
+from mcp_server.prewarm import PrewarmScheduler
+from mcp_server.city_index import BUILTIN_CITIES, CityIndex
+from mcp_server.gazetteer import Gazetteer, load_gazetteer
+from mcp_server.spatial import SpatialIndex
+from mcp_server.ip_location import CachedIPLocator, IpapiProvider, MmdbProvider
+from mcp_server.mmdb import open_mmdb
+
 logger = logging.getLogger("weather-mcp-server")
-logger.setLevel(logging.INFO)
 
 # API 配置
 CAIYUN_API_KEY = os.getenv("CAIYUN_API_KEY")
@@ -69,183 +101,88 @@ if not AMAP_API_KEY:
 
 AMAP_BASE_URL = os.getenv("AMAP_BASE_URL", "https://restapi.amap.com/v3/geocode/geo")
 
-# 城市坐标映射 - 支持全球主要城市
-CITY_COORDINATES = {
-    # === 中国城市 ===
-    "北京": (39.9042, 116.4074),
-    "上海": (31.2304, 121.4737),
-    "广州": (23.1291, 113.2644),
-    "深圳": (22.5431, 114.0579),
-    "杭州": (30.2741, 120.1551),
-    "南京": (32.0603, 118.7969),
-    "武汉": (30.5928, 114.3055),
-    "成都": (30.5728, 104.0668),
-    "西安": (34.3416, 108.9398),
-    "重庆": (29.5630, 106.5516),
-    "天津": (39.3434, 117.3616),
-    "苏州": (31.2989, 120.5853),
-    "青岛": (36.0671, 120.3826),
-    "宁波": (29.8683, 121.5440),
-    "无锡": (31.5912, 120.3019),
-    "济南": (36.6512, 117.1201),
-    "大连": (38.9140, 121.6147),
-    "沈阳": (41.8057, 123.4315),
-    "长春": (43.8171, 125.3235),
-    "哈尔滨": (45.8038, 126.5349),
-    "福州": (26.0745, 119.2965),
-    "厦门": (24.4798, 118.0894),
-    "昆明": (25.0389, 102.7183),
-    "南昌": (28.6820, 115.8581),
-    "合肥": (31.8669, 117.2741),
-    "石家庄": (38.0428, 114.5149),
-    "太原": (37.8706, 112.5489),
-    "郑州": (34.7466, 113.6254),
-    "长沙": (28.2282, 112.9388),
-    "南宁": (22.8170, 108.3669),
-    "海口": (20.0444, 110.1999),
-    "贵阳": (26.6470, 106.6302),
-    "兰州": (36.0611, 103.8343),
-    "银川": (38.4681, 106.2731),
-    "西宁": (36.6171, 101.7782),
-    "乌鲁木齐": (43.7793, 87.6177),
-    "拉萨": (29.6625, 91.1110),
-    
-    # === 日本城市 ===
-    "Tokyo": (35.6762, 139.6503),
-    "东京": (35.6762, 139.6503),
-    "Osaka": (34.6937, 135.5023),
-    "大阪": (34.6937, 135.5023),
-    "Kyoto": (35.0116, 135.7681),
-    "京都": (35.0116, 135.7681),
-    "Yokohama": (35.4437, 139.6380),
-    "横滨": (35.4437, 139.6380),
-    "Nagoya": (35.1815, 136.9066),
-    "名古屋": (35.1815, 136.9066),
-    "Sapporo": (43.0642, 141.3469),
-    "札幌": (43.0642, 141.3469),
-    "Fukuoka": (33.5904, 130.4017),
-    "福冈": (33.5904, 130.4017),
-    "Kobe": (34.6901, 135.1956),
-    "神户": (34.6901, 135.1956),
-    "Hiroshima": (34.3853, 132.4553),
-    "广岛": (34.3853, 132.4553),
-    "Sendai": (38.2682, 140.8694),
-    "仙台": (38.2682, 140.8694),
-    "Inzai": (35.832, 140.145),
-    "印西": (35.832, 140.145),
-    
-    # === 韩国城市 ===
-    "Seoul": (37.5665, 126.9780),
-    "首尔": (37.5665, 126.9780),
-    "Busan": (35.1796, 129.0756),
-    "釜山": (35.1796, 129.0756),
-    "Incheon": (37.4563, 126.7052),
-    "仁川": (37.4563, 126.7052),
-    "Daegu": (35.8714, 128.6014),
-    "大邱": (35.8714, 128.6014),
-    "Daejeon": (36.3504, 127.3845),
-    "大田": (36.3504, 127.3845),
-    "Gwangju": (35.1595, 126.8526),
-    "光州": (35.1595, 126.8526),
-    
-    # === 美国城市 ===
-    "New York": (40.7128, -74.0060),
-    "纽约": (40.7128, -74.0060),
-    "Los Angeles": (34.0522, -118.2437),
-    "洛杉矶": (34.0522, -118.2437),
-    "Chicago": (41.8781, -87.6298),
-    "芝加哥": (41.8781, -87.6298),
-    "Houston": (29.7604, -95.3698),
-    "休斯顿": (29.7604, -95.3698),
-    "Phoenix": (33.4484, -112.0740),
-    "凤凰城": (33.4484, -112.0740),
-    "Philadelphia": (39.9526, -75.1652),
-    "费城": (39.9526, -75.1652),
-    "San Antonio": (29.4241, -98.4936),
-    "圣安东尼奥": (29.4241, -98.4936),
-    "San Diego": (32.7157, -117.1611),
-    "圣地亚哥": (32.7157, -117.1611),
-    "Dallas": (32.7767, -96.7970),
-    "达拉斯": (32.7767, -96.7970),
-    "San Jose": (37.3382, -121.8863),
-    "圣何塞": (37.3382, -121.8863),
-    "Austin": (30.2672, -97.7431),
-    "奥斯汀": (30.2672, -97.7431),
-    "Miami": (25.7617, -80.1918),
-    "迈阿密": (25.7617, -80.1918),
-    "Seattle": (47.6062, -122.3321),
-    "西雅图": (47.6062, -122.3321),
-    "San Francisco": (37.7749, -122.4194),
-    "旧金山": (37.7749, -122.4194),
-    "Las Vegas": (36.1699, -115.1398),
-    "拉斯维加斯": (36.1699, -115.1398),
-    "Washington": (38.9072, -77.0369),
-    "华盛顿": (38.9072, -77.0369),
-    "Boston": (42.3601, -71.0589),
-    "波士顿": (42.3601, -71.0589),
-    
-    # === 德国城市 ===
-    "Berlin": (52.5200, 13.4050),
-    "柏林": (52.5200, 13.4050),
-    "Munich": (48.1351, 11.5820),
-    "慕尼黑": (48.1351, 11.5820),
-    "Hamburg": (53.5511, 9.9937),
-    "汉堡": (53.5511, 9.9937),
-    "Cologne": (50.9375, 6.9603),
-    "科隆": (50.9375, 6.9603),
-    "Frankfurt": (50.1109, 8.6821),
-    "法兰克福": (50.1109, 8.6821),
-    "Stuttgart": (48.7758, 9.1829),
-    "斯图加特": (48.7758, 9.1829),
-    "Dusseldorf": (51.2277, 6.7735),
-    "杜塞尔多夫": (51.2277, 6.7735),
-    "Dortmund": (51.5136, 7.4653),
-    "多特蒙德": (51.5136, 7.4653),
-    
-    # === 英国城市 ===
-    "London": (51.5074, -0.1278),
-    "伦敦": (51.5074, -0.1278),
-    "Manchester": (53.4808, -2.2426),
-    "曼彻斯特": (53.4808, -2.2426),
-    "Birmingham": (52.4862, -1.8904),
-    "伯明翰": (52.4862, -1.8904),
-    "Liverpool": (53.4084, -2.9916),
-    "利物浦": (53.4084, -2.9916),
-    "Edinburgh": (55.9533, -3.1883),
-    "爱丁堡": (55.9533, -3.1883),
-    "Glasgow": (55.8642, -4.2518),
-    "格拉斯哥": (55.8642, -4.2518),
-    
-    # === 法国城市 ===
-    "Paris": (48.8566, 2.3522),
-    "巴黎": (48.8566, 2.3522),
-    "Marseille": (43.2965, 5.3698),
-    "马赛": (43.2965, 5.3698),
-    "Lyon": (45.7640, 4.8357),
-    "里昂": (45.7640, 4.8357),
-    "Toulouse": (43.6047, 1.4442),
-    "图卢兹": (43.6047, 1.4442),
-    "Nice": (43.7102, 7.2620),
-    "尼斯": (43.7102, 7.2620),
-    
-    # === 其他主要城市 ===
-    "Sydney": (-33.8688, 151.2093),
-    "悉尼": (-33.8688, 151.2093),
-    "Melbourne": (-37.8136, 144.9631),
-    "墨尔本": (-37.8136, 144.9631),
-    "Toronto": (43.6532, -79.3832),
-    "多伦多": (43.6532, -79.3832),
-    "Vancouver": (49.2827, -123.1207),
-    "温哥华": (49.2827, -123.1207),
-    "Singapore": (1.3521, 103.8198),
-    "新加坡": (1.3521, 103.8198),
-    "Bangkok": (13.7563, 100.5018),
-    "曼谷": (13.7563, 100.5018),
-    "Dubai": (25.2048, 55.2708),
-    "迪拜": (25.2048, 55.2708),
-    "Moscow": (55.7558, 37.6176),
-    "莫斯科": (55.7558, 37.6176),
-}
+# 高德批量地理编码单次请求最多支持 10 个地址（batch=true，地址之间以 | 分隔）
+AMAP_BATCH_SIZE = 10
+
+# 地理编码持久化缓存配置（默认位于用户缓存目录，设置为空字符串时仅使用内存缓存）
+USER_CACHE_DIR = os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "weather_mcp")
+GEOCODE_CACHE_PATH = os.path.expanduser(os.getenv("GEOCODE_CACHE_PATH", os.path.join(USER_CACHE_DIR, "geocode.sqlite3"))) or ":memory:"
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+GEOCODE_NEGATIVE_CACHE_TTL = float(os.getenv("GEOCODE_NEGATIVE_CACHE_TTL", str(24 * 3600)))
+
+# 离线地名库（GeoNames 风格 TSV，首次加载时编译为 mmap 二进制文件；留空表示不启用）
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "")
+GAZETTEER_COMPILED_PATH = os.getenv("GAZETTEER_COMPILED_PATH", os.path.join(parent_dir, ".cache", "gazetteer.bin"))
+
+# 工具默认输出格式：text（面向用户的文本）或 json（紧凑结构化数据，供程序或模板渲染）
+OUTPUT_FORMATS = ("text", "json")
+
+def default_output_format(value: str) -> str:
+    """校验配置的默认输出格式，无效时（如拼写错误）警告并使用 text，避免所有工具调用都返回格式错误"""
+    output_format = value.strip().lower()
+    if output_format not in OUTPUT_FORMATS:
+        logger.warning(f"⚠️ 不支持的 WEATHER_OUTPUT_FORMAT：{value}，可选值为 {'、'.join(OUTPUT_FORMATS)}，使用 text")
+        return "text"
+    return output_format
+
+WEATHER_OUTPUT_FORMAT = default_output_format(os.getenv("WEATHER_OUTPUT_FORMAT", "text"))
+
+# 多城市批量查询配置
+WEATHER_BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", "8"))
+WEATHER_BATCH_MAX_CITIES = int(os.getenv("WEATHER_BATCH_MAX_CITIES", "50"))
+
+# 彩云天气单次请求的最大预报天数：每个位置统一拉取一次，各工具按需切片
+CAIYUN_MAX_DAILY_STEPS = 15
+
+IP_LOCATION_URL = os.getenv("IP_LOCATION_URL", "https://ipapi.co/json/")
+IP_LOCATION_IP_URL = os.getenv("IP_LOCATION_IP_URL", "https://ipapi.co/{ip}/json/")
+# IP 定位服务：ipapi（在线）或 mmdb（离线 MaxMind DB，未指定 IP 时仍通过在线服务定位本机出口 IP）
+IP_LOCATION_PROVIDER = os.getenv("IP_LOCATION_PROVIDER", "ipapi").lower()
+IP_LOCATION_MMDB_PATH = os.getenv("IP_LOCATION_MMDB_PATH", "")
+IP_LOCATION_CACHE_TTL = float(os.getenv("IP_LOCATION_CACHE_TTL", "3600"))
+IP_LOCATION_CACHE_MAX_ENTRIES = int(os.getenv("IP_LOCATION_CACHE_MAX_ENTRIES", "1024"))
+# IP 定位坐标与最近已知城市的最大距离（公里），超出时使用定位服务返回的城市名
+IP_LOCATION_MAX_DISTANCE_KM = float(os.getenv("IP_LOCATION_MAX_DISTANCE_KM", "50"))
+
+# HTTP 连接池配置（每个上游主机一个长连接客户端）
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+# 上游限流、重试与熔断配置（速率单位：次/秒，0 表示不限流）
+CAIYUN_RATE_LIMIT = float(os.getenv("CAIYUN_RATE_LIMIT", "10"))
+CAIYUN_RATE_BURST = int(os.getenv("CAIYUN_RATE_BURST", "10"))
+AMAP_RATE_LIMIT = float(os.getenv("AMAP_RATE_LIMIT", "3"))
+AMAP_RATE_BURST = int(os.getenv("AMAP_RATE_BURST", "3"))
+IP_LOCATION_RATE_LIMIT = float(os.getenv("IP_LOCATION_RATE_LIMIT", "1"))
+IP_LOCATION_RATE_BURST = int(os.getenv("IP_LOCATION_RATE_BURST", "2"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# 天气预报缓存配置
+FORECAST_CACHE_TTL = float(os.getenv("FORECAST_CACHE_TTL", "1800"))
+FORECAST_CACHE_GRID = float(os.getenv("FORECAST_CACHE_GRID", "0.01"))
+FORECAST_CACHE_MAX_ENTRIES = int(os.getenv("FORECAST_CACHE_MAX_ENTRIES", "1024"))
+FORECAST_CACHE_MAX_BYTES = int(os.getenv("FORECAST_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# 距离已知城市不超过该半径（公里）的查询共享该城市的缓存网格，0 表示不吸附
+FORECAST_CACHE_SNAP_KM = float(os.getenv("FORECAST_CACHE_SNAP_KM", "0"))
+# 过期后立即返回旧数据并在后台刷新；上游出错时也回退到旧数据（不超过 FORECAST_MAX_STALE 秒）
+FORECAST_STALE_WHILE_REVALIDATE = os.getenv("FORECAST_STALE_WHILE_REVALIDATE", "true").lower() == "true"
+FORECAST_MAX_STALE = float(os.getenv("FORECAST_MAX_STALE", str(6 * 3600)))
+
+# 热门城市预热配置（PREWARM_CITIES 以逗号分隔，PREWARM_TOP_K 按请求次数自动选取）
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "false").lower() == "true"
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", "600"))
+PREWARM_CITIES = [city.strip() for city in os.getenv("PREWARM_CITIES", "").split(",") if city.strip()]
+PREWARM_TOP_K = int(os.getenv("PREWARM_TOP_K", "20"))
+
+# 内置城市索引 - 支持全球主要城市，中英文、拼音及 市/区/县 后缀均可命中
+city_index = CityIndex(BUILTIN_CITIES)
+city_spatial_index = SpatialIndex([city.lat for city in city_index], [city.lon for city in city_index])
 
 # 天气现象映射
 SKYCON_MAP = {
@@ -271,55 +208,164 @@ SKYCON_MAP = {
     "WIND": "大风"
 }
 
+# 共享 HTTP 客户端池
+http_clients = HttpClientPool(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    http2=HTTP2_ENABLED,
+)
+
+def build_upstream_guard(name: str, rate: float, burst: int) -> UpstreamGuard:
+    """按全局配置创建上游保护策略"""
+    return UpstreamGuard(
+        name,
+        TokenBucket(rate, burst),
+        CircuitBreaker(name, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT),
+        max_retries=UPSTREAM_MAX_RETRIES,
+        backoff_base=UPSTREAM_BACKOFF_BASE,
+        backoff_max=UPSTREAM_BACKOFF_MAX,
+    )
+
+ip_location_guard = build_upstream_guard("IP定位", IP_LOCATION_RATE_LIMIT, IP_LOCATION_RATE_BURST)
+
+def build_ip_locator() -> CachedIPLocator:
+    """根据配置创建 IP 定位服务（离线数据库打开失败时回退到在线服务）"""
+    provider = IpapiProvider(http_clients, ip_location_guard, IP_LOCATION_URL, IP_LOCATION_IP_URL)
+    if IP_LOCATION_PROVIDER == "mmdb":
+        try:
+            provider = MmdbProvider(open_mmdb(IP_LOCATION_MMDB_PATH), fallback=provider)
+            logger.info(f"🌐 使用离线IP数据库：{IP_LOCATION_MMDB_PATH}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ 离线IP数据库加载失败，使用在线定位服务：{e}")
+    return CachedIPLocator(provider, ttl=IP_LOCATION_CACHE_TTL, max_entries=IP_LOCATION_CACHE_MAX_ENTRIES)
+
+ip_locator = build_ip_locator()
+
+# 进入生命周期的会话数：stdio 只有一个会话，HTTP/SSE 服务的每个客户端会话都会进入一次生命周期
+_lifespan_users = 0
+
+@asynccontextmanager
+async def server_lifespan(server: FastMCP):
+    """服务器生命周期：第一个会话进入时启动预热，最后一个会话退出时关闭共享连接"""
+    global _lifespan_users
+    _lifespan_users += 1
+    if _lifespan_users == 1 and PREWARM_ENABLED:
+        prewarm_scheduler.start()
+    try:
+        yield {}
+    finally:
+        _lifespan_users -= 1
+        if _lifespan_users == 0:
+            await prewarm_scheduler.stop()
+            await weather_api.aclose()
+            await http_clients.aclose()
+            ip_locator.close()
+
 # 创建 FastMCP 服务器实例
-mcp = FastMCP("weather-mcp-server")
+mcp = FastMCP("weather-mcp-server", lifespan=server_lifespan)
 
 # 工具类和辅助函数
 class AmapGeocoder:
     """高德地图地理编码客户端"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        http: Optional[HttpClientPool] = None,
+        store: Optional[GeocodeStore] = None,
+        guard: Optional[UpstreamGuard] = None,
+        gazetteer: Optional[Gazetteer] = None,
+    ):
         self.api_key = AMAP_API_KEY
         self.base_url = AMAP_BASE_URL
-        self.coord_cache = {}
+        self.http = http or http_clients
+        self.guard = guard or build_upstream_guard("高德地图", AMAP_RATE_LIMIT, AMAP_RATE_BURST)
+        if store is None:
+            store = GeocodeStore(
+                GEOCODE_CACHE_PATH,
+                ttl=GEOCODE_CACHE_TTL,
+                negative_ttl=GEOCODE_NEGATIVE_CACHE_TTL,
+            )
+        self.coord_cache = store
+        self.gazetteer = gazetteer
+        self.inflight = SingleFlight()
+    
+    def _local_coordinates(self, city_name: str) -> Optional[tuple[float, float]]:
+        """本地解析坐标：内置城市精确匹配、离线地名库"""
+        builtin = city_index.lookup(city_name)
+        if builtin is not None:
+            logger.info(f"📍 使用内置坐标：{city_name} -> {builtin.coordinates}")
+            return builtin.coordinates
+        if self.gazetteer is not None:
+            place = self.gazetteer.lookup(city_name)
+            if place is not None:
+                logger.info(f"📍 使用离线地名库坐标：{city_name} -> {place.name} {place.coordinates}")
+                return place.coordinates
+        return None
+    
+    def _fuzzy_coordinates(self, city_name: str) -> Optional[tuple[float, float]]:
+        """内置城市前缀补全和拼写纠错
+        
+        只在缓存和高德都没有结果（或未配置高德）时使用，避免把真实存在的地名（凤凰县、Hebei）
+        猜成名字相近的内置城市。
+        """
+        builtin = city_index.fuzzy_lookup(city_name)
+        if builtin is None:
+            return None
+        logger.info(f"📍 模糊匹配内置城市：{city_name} -> {builtin.name} {builtin.coordinates}")
+        return builtin.coordinates
     
     async def get_coordinates(self, city_name: str) -> Optional[tuple[float, float]]:
-        """获取城市坐标"""
-        if city_name in CITY_COORDINATES:
-            coordinates = CITY_COORDINATES[city_name]
-            logger.info(f"📍 使用内置坐标：{city_name} -> {coordinates}")
+        """获取城市坐标：本地精确匹配 > 缓存 > 高德地理编码 > 内置城市模糊匹配"""
+        coordinates = self._local_coordinates(city_name)
+        if coordinates is not None:
             return coordinates
         
-        if city_name in self.coord_cache:
-            return self.coord_cache[city_name]
+        cached = self.coord_cache.get(city_name)
+        if cached is not None and cached.coordinates is not None:
+            return cached.coordinates
         
-        # 如果没有高德 API，直接返回 None
-        if not self.api_key:
-            return None
+        # 缓存的未命中结果说明高德查无此地，不再重复请求
+        if cached is None and self.api_key:
+            # 相同城市的并发请求合并为一次 API 调用
+            coordinates = await self.inflight.do(
+                ("geocode", city_name.strip()),
+                lambda: self._request_coordinates(city_name),
+            )
+            if coordinates is not None:
+                return coordinates
         
+        return self._fuzzy_coordinates(city_name)
+    
+    async def _request_coordinates(self, city_name: str) -> Optional[tuple[float, float]]:
+        """调用高德地理编码 API"""
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                params = {
-                    "key": self.api_key,
-                    "address": city_name,
-                    "output": "json"
-                }
-                
-                response = await client.get(self.base_url, params=params)
-                response.raise_for_status()
-                
-                data = response.json()
-                if data.get("status") == "1" and data.get("count", "0") != "0":
-                    geocodes = data.get("geocodes", [])
-                    if geocodes:
-                        location = geocodes[0].get("location", "")
-                        if location:
-                            lon, lat = map(float, location.split(","))
-                            coordinates = (lat, lon)
-                            self.coord_cache[city_name] = coordinates
-                            logger.info(f"✅ 获取城市坐标成功：{city_name} -> {coordinates}")
-                            return coordinates
+            params = {
+                "key": self.api_key,
+                "address": city_name,
+                "output": "json"
+            }
             
+            response = await self.guard.request(
+                lambda: self.http.get(self.base_url, params=params, timeout=10.0)
+            )
+            response.raise_for_status()
+            
+            data = response.json()
+            if data.get("status") == "1" and data.get("count", "0") != "0":
+                geocodes = data.get("geocodes", [])
+                if geocodes:
+                    location = geocodes[0].get("location", "")
+                    if location:
+                        lon, lat = map(float, location.split(","))
+                        coordinates = (lat, lon)
+                        self.coord_cache.put(city_name, coordinates)
+                        logger.info(f"✅ 获取城市坐标成功：{city_name} -> {coordinates}")
+                        return coordinates
+            
+            # 确认查无此地时缓存未命中结果，避免重复消耗配额
+            if data.get("status") == "1":
+                self.coord_cache.put(city_name, None)
             logger.warning(f"⚠️ 未找到城市坐标：{city_name}")
             return None
             
@@ -327,32 +373,210 @@ class AmapGeocoder:
             logger.error(f"❌ 地理编码API调用失败：{city_name}, 错误：{e}")
             return None
 
+    async def get_coordinates_batch(self, city_names: list[str]) -> Dict[str, Optional[tuple[float, float]]]:
+        """批量获取城市坐标
+        
+        先使用内置坐标和缓存，剩余城市按高德批量接口分块后并发请求，仍未找到的城市再模糊匹配内置城市，
+        返回结果按输入顺序排列（重复城市只查询一次）。
+        """
+        results: Dict[str, Optional[tuple[float, float]]] = {}
+        pending = []
+        for city_name in dict.fromkeys(city_names):
+            coordinates = self._local_coordinates(city_name)
+            if coordinates is not None:
+                results[city_name] = coordinates
+                continue
+            cached = self.coord_cache.get(city_name)
+            if cached is not None:
+                results[city_name] = cached.coordinates
+            else:
+                pending.append(city_name)
+        
+        if pending and self.api_key:
+            chunks = [pending[i:i + AMAP_BATCH_SIZE] for i in range(0, len(pending), AMAP_BATCH_SIZE)]
+            logger.info(f"🗺️ 批量地理编码：{len(pending)} 个城市，分 {len(chunks)} 次请求")
+            for chunk_result in await asyncio.gather(*[self._request_coordinates_batch(chunk) for chunk in chunks]):
+                results.update(chunk_result)
+        
+        for city_name, coordinates in results.items():
+            if coordinates is None:
+                results[city_name] = self._fuzzy_coordinates(city_name)
+        for city_name in pending:
+            results.setdefault(city_name, self._fuzzy_coordinates(city_name))
+        
+        return {city_name: results.get(city_name) for city_name in city_names}
+    
+    async def _request_coordinates_batch(self, city_names: list[str]) -> Dict[str, Optional[tuple[float, float]]]:
+        """调用高德批量地理编码 API（最多 AMAP_BATCH_SIZE 个地址）"""
+        results: Dict[str, Optional[tuple[float, float]]] = {city_name: None for city_name in city_names}
+        try:
+            params = {
+                "key": self.api_key,
+                "address": "|".join(city_name.replace("|", " ") for city_name in city_names),
+                "batch": "true",
+                "output": "json"
+            }
+            
+            response = await self.guard.request(
+                lambda: self.http.get(self.base_url, params=params, timeout=10.0)
+            )
+            response.raise_for_status()
+            
+            data = response.json()
+            if data.get("status") != "1":
+                logger.warning(f"⚠️ 批量地理编码失败：{data.get('info', 'unknown')}")
+                return results
+            
+            # 批量模式下 geocodes 与输入地址一一对应，未匹配的地址 location 为空
+            geocodes = data.get("geocodes", [])
+            for city_name, geocode in zip(city_names, geocodes):
+                location = geocode.get("location") if isinstance(geocode, dict) else None
+                if location and isinstance(location, str):
+                    lon, lat = map(float, location.split(","))
+                    results[city_name] = (lat, lon)
+                self.coord_cache.put(city_name, results[city_name])
+            
+            return results
+            
+        except Exception as e:
+            logger.error(f"❌ 批量地理编码API调用失败：{city_names}, 错误：{e}")
+            return results
+
 class WeatherAPI:
     """彩云天气API客户端"""
     
-    def __init__(self, geocoder: AmapGeocoder):
+    def __init__(
+        self,
+        geocoder: AmapGeocoder,
+        http: Optional[HttpClientPool] = None,
+        forecast_cache: Optional[ForecastCache] = None,
+        guard: Optional[UpstreamGuard] = None,
+        stale_while_revalidate: bool = FORECAST_STALE_WHILE_REVALIDATE,
+    ):
         self.api_key = CAIYUN_API_KEY
         self.base_url = CAIYUN_BASE_URL
         self.geocoder = geocoder
+        self.http = http or geocoder.http
+        self.guard = guard or build_upstream_guard("彩云天气", CAIYUN_RATE_LIMIT, CAIYUN_RATE_BURST)
+        if forecast_cache is None:
+            forecast_cache = ForecastCache(
+                ttl=FORECAST_CACHE_TTL,
+                grid=FORECAST_CACHE_GRID,
+                max_entries=FORECAST_CACHE_MAX_ENTRIES,
+                max_bytes=FORECAST_CACHE_MAX_BYTES,
+                max_stale=FORECAST_MAX_STALE,
+                snap=snap_to_nearest_place if FORECAST_CACHE_SNAP_KM > 0 else None,
+            )
+        self.forecast_cache = forecast_cache
+        self.stale_while_revalidate = stale_while_revalidate
+        self.inflight = SingleFlight()
+        self._revalidating: Dict[tuple, asyncio.Task] = {}
+        # 按城市统计的请求次数，供预热调度器选取热门城市
+        self.request_counts: Counter = Counter()
     
     async def get_daily_weather(self, city: str, days: int = 1) -> Dict[str, Any]:
-        """获取天气预报"""
+        """获取天气预报
+        
+        每个位置统一拉取最大天数（15天）并缓存，再切片出请求的天数，
+        今天、明天、未来几天的查询共享同一次上游请求。
+        缓存过期后先返回旧数据并在后台刷新；上游出错时回退到未超过最大陈旧时间的旧数据。
+        """
         coordinates = await self.geocoder.get_coordinates(city)
         if not coordinates:
             raise ValueError(f"不支持的城市：{city}")
+        self._record_request(city)
+        
+        lat, lon = coordinates
+        steps = max(1, min(days, CAIYUN_MAX_DAILY_STEPS))
+        cached = self.forecast_cache.lookup(lat, lon, CAIYUN_MAX_DAILY_STEPS)
+        if cached is not None and cached[1]:
+            logger.info(f"⚡ 天气缓存命中：{city} {lat},{lon}")
+            return self._slice_daily(cached[0], steps)
+        
+        if cached is not None and self.stale_while_revalidate:
+            logger.info(f"♻️ 返回过期天气缓存并后台刷新：{city} {lat},{lon}")
+            self._schedule_revalidate(lat, lon)
+            return self._slice_daily(cached[0], steps)
+        
+        try:
+            data = await self._fetch_shared(lat, lon)
+        except Exception as e:
+            if cached is None:
+                raise
+            logger.warning(f"⚠️ 天气API调用失败，返回过期缓存：{city}，错误：{e}")
+            data = cached[0]
+        return self._slice_daily(data, steps)
+    
+    def _record_request(self, city: str, max_tracked: int = 10000):
+        """记录城市请求次数，统计项过多时只保留最常见的一部分"""
+        self.request_counts[city] += 1
+        if len(self.request_counts) > max_tracked:
+            self.request_counts = Counter(dict(self.request_counts.most_common(max_tracked // 2)))
+    
+    async def prewarm(self, city: str, within: float = 0.0) -> bool:
+        """预热城市天气缓存：缓存不存在或将在 within 秒内过期时刷新，返回是否发起了请求"""
+        coordinates = await self.geocoder.get_coordinates(city)
+        if not coordinates:
+            return False
         
         lat, lon = coordinates
+        remaining = self.forecast_cache.ttl_remaining(lat, lon, CAIYUN_MAX_DAILY_STEPS)
+        if remaining is not None and remaining > within:
+            return False
+        await self._fetch_shared(lat, lon)
+        return True
+    
+    async def _fetch_shared(self, lat: float, lon: float) -> Dict[str, Any]:
+        """同一缓存网格的并发请求合并为一次 API 调用"""
+        return await self.inflight.do(
+            ("daily", *self.forecast_cache.cell(lat, lon)),
+            lambda: self._fetch_daily(lat, lon),
+        )
+    
+    def _schedule_revalidate(self, lat: float, lon: float):
+        """后台刷新过期的缓存条目（同一网格只保留一个刷新任务）"""
+        key = self.forecast_cache.cell(lat, lon)
+        loop = asyncio.get_running_loop()
+        existing = self._revalidating.get(key)
+        if existing is not None and not existing.done() and existing.get_loop() is loop:
+            return
+        
+        async def revalidate():
+            try:
+                await self._fetch_shared(lat, lon)
+            except Exception as e:
+                logger.warning(f"⚠️ 后台刷新天气缓存失败：{lat},{lon}，错误：{e}")
+            finally:
+                if self._revalidating.get(key) is task:
+                    del self._revalidating[key]
+        
+        task = loop.create_task(revalidate())
+        self._revalidating[key] = task
+    
+    async def aclose(self):
+        """取消尚未完成的后台刷新任务"""
+        tasks = list(self._revalidating.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._revalidating.clear()
+    
+    async def _fetch_daily(self, lat: float, lon: float) -> Dict[str, Any]:
+        """从彩云天气拉取最大天数的预报并写入缓存"""
         url = f"{self.base_url}/{self.api_key}/{lon},{lat}/daily"
-        params = {"dailysteps": min(days, 15)}
+        params = {"dailysteps": CAIYUN_MAX_DAILY_STEPS}
         
         try:
-            logger.info(f"🌤️ 调用彩云天气API：{lat},{lon} 获取{days}天天气数据")
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                logger.info(f"✅ 天气API调用成功：状态 {data.get('status', 'unknown')}")
-                return data
+            logger.info(f"🌤️ 调用彩云天气API：{lat},{lon} 获取{CAIYUN_MAX_DAILY_STEPS}天天气数据")
+            response = await self.guard.request(
+                lambda: self.http.get(url, params=params, timeout=30.0)
+            )
+            response.raise_for_status()
+            data = response.json()
+            logger.info(f"✅ 天气API调用成功：状态 {data.get('status', 'unknown')}")
+            if data.get("status") == "ok":
+                self.forecast_cache.put(lat, lon, CAIYUN_MAX_DAILY_STEPS, data)
+            return data
         except httpx.HTTPError as e:
             if hasattr(e, 'response') and e.response.status_code == 429:
                 raise Exception(f"API调用频率过高，请稍后再试。彩云天气API有频率限制。")
@@ -361,18 +585,49 @@ class WeatherAPI:
         except Exception as e:
             raise Exception(f"天气API调用错误: {e}")
     
-    def format_weather_data(self, data: Dict[str, Any], city: str, target_day: int = 0) -> str:
-        """格式化天气数据"""
-        if data.get("status") != "ok":
-            return f"❌ 获取{city}天气失败"
+    async def get_daily_weather_many(
+        self,
+        cities: list[str],
+        days: int = 1,
+        concurrency: int = 8,
+    ) -> Dict[str, Any]:
+        """并发获取多个城市的天气预报
         
-        daily = data["result"]["daily"]
+        先批量地理编码，再在信号量限制下并发查询天气。
+        返回 {城市: 天气数据或异常}，单个城市失败不影响其他城市。
+        """
+        unique_cities = list(dict.fromkeys(cities))
+        await self.geocoder.get_coordinates_batch(unique_cities)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
         
-        if target_day >= len(daily["temperature"]):
-            return f"❌ 没有{city}第{target_day+1}天的天气数据"
+        async def fetch(city: str):
+            async with semaphore:
+                try:
+                    return await self.get_daily_weather(city, days=days)
+                except Exception as e:
+                    return e
         
-        date_info = daily["temperature"][target_day]
-        date = date_info["date"][:10]
+        results = await asyncio.gather(*[fetch(city) for city in unique_cities])
+        return dict(zip(unique_cities, results))
+    
+    @staticmethod
+    def _slice_daily(data: Dict[str, Any], days: int) -> Dict[str, Any]:
+        """截取前 days 天的预报（返回副本，不修改缓存中的数据）"""
+        daily = data.get("result", {}).get("daily")
+        if not isinstance(daily, dict):
+            return data
+        
+        sliced_daily = {
+            key: value[:days] if isinstance(value, list) else value
+            for key, value in daily.items()
+        }
+        return {**data, "result": {**data["result"], "daily": sliced_daily}}
+    
+    def summarize_day(self, data: Dict[str, Any], target_day: int = 0) -> Optional[Dict[str, Any]]:
+        """提取某一天的天气摘要（数值字段为数字类型），没有该天数据时返回 None"""
+        daily = data["result"]["daily"]
+        if target_day >= len(daily["temperature"]):
+            return None
         
         temp = daily["temperature"][target_day]
         temp_max = int(temp["max"])
@@ -388,18 +643,52 @@ class WeatherAPI:
         humidity_avg = int(humidity["avg"] * 100)
         
         wind = daily["wind"][target_day]
-        wind_speed = wind["avg"]["speed"]
-        wind_level = self.wind_speed_to_level(wind_speed)
+        wind_level = self.wind_speed_to_level(wind["avg"]["speed"])
+        
+        return {
+            "date": temp["date"][:10],
+            "weather": weather_desc,
+            "skycon": skycon,
+            "temp_min": temp_min,
+            "temp_max": temp_max,
+            "humidity": humidity_avg,
+            "wind_level": wind_level,
+            "rain_prob": rain_prob,
+            "tips": self._get_weather_tips(weather_desc, temp_max, temp_min, rain_prob),
+        }
+    
+    def summarize_days(self, data: Dict[str, Any], days: int) -> list[Dict[str, Any]]:
+        """提取前 days 天的天气摘要"""
+        available = len(data["result"]["daily"]["temperature"])
+        return [self.summarize_day(data, i) for i in range(min(days, available))]
+    
+    def format_weather_data(self, data: Dict[str, Any], city: str, target_day: int = 0) -> str:
+        """格式化天气数据"""
+        if data.get("status") != "ok":
+            return f"❌ 获取{city}天气失败"
         
-        tips = self._get_weather_tips(weather_desc, temp_max, temp_min, rain_prob)
+        day = self.summarize_day(data, target_day)
+        if day is None:
+            return f"❌ 没有{city}第{target_day+1}天的天气数据"
         
-        return f"""📍 {city} {date}
-🌤️ 天气：{weather_desc}
-🌡️ 温度：{temp_min}°C ~ {temp_max}°C
-💧 湿度：{humidity_avg}%
-💨 风力：{wind_level}级
-🌧️ 降水概率：{rain_prob}%
-💡 生活建议：{tips}"""
+        return f"""📍 {city} {day["date"]}
+🌤️ 天气：{day["weather"]}
+🌡️ 温度：{day["temp_min"]}°C ~ {day["temp_max"]}°C
+💧 湿度：{day["humidity"]}%
+💨 风力：{day["wind_level"]}级
+🌧️ 降水概率：{day["rain_prob"]}%
+💡 生活建议：{day["tips"]}"""
+    
+    def format_future_days(self, data: Dict[str, Any], city: str, days: int) -> str:
+        """格式化未来几天的天气预报"""
+        if data.get("status") != "ok":
+            return f"❌ 获取{city}天气失败"
+        
+        results = [f"📍 {city} 未来{days}天天气预报："]
+        for day in self.summarize_days(data, days):
+            results.append(f"📅 {day['date']}：{day['weather']}，{day['temp_min']}°C ~ {day['temp_max']}°C")
+        
+        return "\n".join(results)
     
     def wind_speed_to_level(self, speed_ms: float) -> int:
         """风速转风力等级"""
@@ -457,154 +746,424 @@ class WeatherAPI:
         return "，".join(tips) if tips else "天气适宜，祝您生活愉快"
 
 # 创建全局实例
-geocoder = AmapGeocoder()
+offline_gazetteer = load_gazetteer(GAZETTEER_PATH, GAZETTEER_COMPILED_PATH)
+# 离线地名库的空间索引在首次查询时才建树
+gazetteer_spatial_index = (
+    SpatialIndex(offline_gazetteer.lats, offline_gazetteer.lons) if offline_gazetteer is not None else None
+)
+
+def find_nearest_place(lat: float, lon: float):
+    """反向地理编码：返回 (地点, 距离公里数)，离线地名库已加载时优先使用，否则使用内置城市
+
+    索引为空（如没有数据行的地名库）时跳过，都没有地点时返回 None。
+    """
+    if gazetteer_spatial_index is not None:
+        nearest = gazetteer_spatial_index.nearest(lat, lon)
+        if nearest is not None:
+            i, distance = nearest
+            return offline_gazetteer.place(i), distance
+    nearest = city_spatial_index.nearest(lat, lon)
+    if nearest is None:
+        return None
+    i, distance = nearest
+    return city_index.cities[i], distance
+
+def snap_to_nearest_place(lat: float, lon: float) -> Optional[tuple[float, float]]:
+    """预报缓存吸附：FORECAST_CACHE_SNAP_KM 范围内有已知地点时使用其坐标"""
+    nearest = find_nearest_place(lat, lon)
+    if nearest is None:
+        return None
+    place, distance = nearest
+    return place.coordinates if distance <= FORECAST_CACHE_SNAP_KM else None
+
+geocoder = AmapGeocoder(gazetteer=offline_gazetteer)
 weather_api = WeatherAPI(geocoder)
+prewarm_scheduler = PrewarmScheduler(
+    weather_api,
+    interval=PREWARM_INTERVAL,
+    hot_cities=PREWARM_CITIES,
+    top_k=PREWARM_TOP_K,
+)
 
 # 定义工具函数
+def to_json(payload: Dict[str, Any]) -> str:
+    """紧凑 JSON 输出（保留中文，不加多余空白）"""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+def invalid_output_format(output_format: str) -> Optional[str]:
+    """校验输出格式，不支持时返回错误信息"""
+    if output_format not in OUTPUT_FORMATS:
+        return f"❌ 不支持的输出格式：{output_format}，可选值为 {'、'.join(OUTPUT_FORMATS)}"
+    return None
+
+def day_payload(data: Dict[str, Any], city: str, target_day: int) -> Dict[str, Any]:
+    """单日天气的结构化结果，与 format_weather_data 的错误分支一一对应"""
+    if data.get("status") != "ok":
+        return {"city": city, "error": f"获取{city}天气失败"}
+    day = weather_api.summarize_day(data, target_day)
+    if day is None:
+        return {"city": city, "error": f"没有{city}第{target_day+1}天的天气数据"}
+    return {"city": city, **day}
+
+def days_payload(data: Dict[str, Any], city: str, days: int) -> Dict[str, Any]:
+    """多日天气的结构化结果"""
+    if data.get("status") != "ok":
+        return {"city": city, "error": f"获取{city}天气失败"}
+    return {"city": city, "days": weather_api.summarize_days(data, days)}
+
 @mcp.tool()
-async def query_weather_today(city: str = "北京") -> str:
+async def query_weather_today(city: str = "北京", output_format: str = WEATHER_OUTPUT_FORMAT) -> str:
     """查询今天的天气
     
     Args:
         city: 城市名称，如：北京、上海、广州等
+        output_format: 输出格式，text（文本）或 json（结构化数据，数值字段为数字类型）
     """
+    if error := invalid_output_format(output_format):
+        return error
     try:
         data = await weather_api.get_daily_weather(city, days=1)
+        if output_format == "json":
+            return to_json(day_payload(data, city, 0))
         return weather_api.format_weather_data(data, city, target_day=0)
     except Exception as e:
         logger.error(f"查询今天天气失败: {e}")
+        if output_format == "json":
+            return to_json({"city": city, "error": f"查询{city}今天天气失败: {str(e)}"})
         return f"❌ 查询{city}今天天气失败: {str(e)}"
 
 @mcp.tool()
-async def query_weather_tomorrow(city: str = "北京") -> str:
+async def query_weather_tomorrow(city: str = "北京", output_format: str = WEATHER_OUTPUT_FORMAT) -> str:
     """查询明天的天气
     
     Args:
         city: 城市名称，如：北京、上海、广州等
+        output_format: 输出格式，text（文本）或 json（结构化数据，数值字段为数字类型）
     """
+    if error := invalid_output_format(output_format):
+        return error
     try:
         data = await weather_api.get_daily_weather(city, days=2)
         if len(data["result"]["daily"]["temperature"]) > 1:
+            if output_format == "json":
+                return to_json(day_payload(data, city, 1))
             return weather_api.format_weather_data(data, city, target_day=1)
         else:
+            if output_format == "json":
+                return to_json({"city": city, "error": f"获取{city}明天天气数据不足"})
             return f"❌ 获取{city}明天天气数据不足"
     except Exception as e:
         logger.error(f"查询明天天气失败: {e}")
+        if output_format == "json":
+            return to_json({"city": city, "error": f"查询{city}明天天气失败: {str(e)}"})
         return f"❌ 查询{city}明天天气失败: {str(e)}"
 
 @mcp.tool()
-async def query_weather_future_days(city: str = "北京", days: int = 3) -> str:
+async def query_weather_future_days(city: str = "北京", days: int = 3, output_format: str = WEATHER_OUTPUT_FORMAT) -> str:
     """查询未来几天的天气预报
     
     Args:
         city: 城市名称，如：北京、上海、广州等
         days: 查询天数，范围1-15天
+        output_format: 输出格式，text（文本）或 json（结构化数据，数值字段为数字类型）
     """
+    if error := invalid_output_format(output_format):
+        return error
     try:
         data = await weather_api.get_daily_weather(city, days=days)
-        
-        if data.get("status") != "ok":
-            return f"❌ 获取{city}天气失败"
-        
-        daily = data["result"]["daily"]
-        results = [f"📍 {city} 未来{days}天天气预报："]
-        
-        for i in range(min(days, len(daily["temperature"]))):
-            date_info = daily["temperature"][i]
-            date = date_info["date"][:10]
-            
-            temp_max = int(date_info["max"])
-            temp_min = int(date_info["min"])
-            
-            skycon = daily["skycon"][i]["value"]
-            weather_desc = SKYCON_MAP.get(skycon, skycon)
-            
-            results.append(f"📅 {date}：{weather_desc}，{temp_min}°C ~ {temp_max}°C")
-        
-        return "\n".join(results)
-        
+        if output_format == "json":
+            return to_json(days_payload(data, city, days))
+        return weather_api.format_future_days(data, city, days)
     except Exception as e:
         logger.error(f"查询未来天气失败: {e}")
+        if output_format == "json":
+            return to_json({"city": city, "error": f"查询{city}未来{days}天天气失败: {str(e)}"})
         return f"❌ 查询{city}未来{days}天天气失败: {str(e)}"
 
 @mcp.tool()
-async def get_supported_cities() -> str:
-    """获取支持的城市列表"""
-    cities = list(CITY_COORDINATES.keys())
-    return "内置城市列表：\n" + "、".join(cities) + "\n\n其他城市也支持，通过高德地图API动态获取坐标。"
+async def query_weather_batch(
+    cities: list[str], horizon: str = "today", days: int = 3, output_format: str = WEATHER_OUTPUT_FORMAT
+) -> str:
+    """批量查询多个城市的天气（一次调用替代多次单城市查询）
+    
+    Args:
+        cities: 城市名称列表，如：["北京", "上海", "广州"]
+        horizon: 查询时间，today（今天）、tomorrow（明天）或 future（未来几天）
+        days: horizon 为 future 时的查询天数，范围1-15天
+        output_format: 输出格式，text（文本）或 json（结构化数据，数值字段为数字类型）
+    """
+    if error := invalid_output_format(output_format):
+        return error
+    if horizon not in ("today", "tomorrow", "future"):
+        return f"❌ 不支持的查询时间：{horizon}，可选值为 today、tomorrow、future"
+    if len(cities) > WEATHER_BATCH_MAX_CITIES:
+        return f"❌ 单次最多查询{WEATHER_BATCH_MAX_CITIES}个城市，当前为{len(cities)}个"
+    
+    fetch_days = {"today": 1, "tomorrow": 2, "future": days}[horizon]
+    results = await weather_api.get_daily_weather_many(
+        cities, days=fetch_days, concurrency=WEATHER_BATCH_CONCURRENCY
+    )
+    
+    blocks = []
+    items = []
+    succeeded = 0
+    for city, data in results.items():
+        if isinstance(data, Exception):
+            logger.error(f"批量查询{city}天气失败: {data}")
+            blocks.append(f"❌ {city}：查询失败: {str(data)}")
+            items.append({"city": city, "error": f"查询失败: {str(data)}"})
+            continue
+        if horizon == "future":
+            block = weather_api.format_future_days(data, city, days)
+            item = days_payload(data, city, days)
+        elif horizon == "tomorrow" and len(data["result"]["daily"]["temperature"]) < 2:
+            block = f"❌ 获取{city}明天天气数据不足"
+            item = {"city": city, "error": f"获取{city}明天天气数据不足"}
+        else:
+            block = weather_api.format_weather_data(data, city, target_day=fetch_days - 1)
+            item = day_payload(data, city, fetch_days - 1)
+        if not block.startswith("❌"):
+            succeeded += 1
+        blocks.append(block)
+        items.append(item)
+    
+    if output_format == "json":
+        return to_json({"horizon": horizon, "total": len(results), "succeeded": succeeded, "results": items})
+    header = f"📊 批量天气查询（共{len(results)}个城市，成功{succeeded}个）："
+    return "\n\n".join([header] + blocks)
 
 @mcp.tool()
-async def get_city_coordinates(city: str = "北京") -> str:
+async def get_supported_cities(output_format: str = WEATHER_OUTPUT_FORMAT) -> str:
+    """获取支持的城市列表
+    
+    Args:
+        output_format: 输出格式，text（文本）或 json（结构化数据）
+    """
+    if error := invalid_output_format(output_format):
+        return error
+    if output_format == "json":
+        return to_json({
+            "cities": [
+                {"name": city.name, "name_en": city.name_en, "country_code": city.country_code, "lat": city.lat, "lon": city.lon}
+                for city in city_index
+            ],
+            "gazetteer_places": len(offline_gazetteer) if offline_gazetteer is not None else 0,
+        })
+    cities = [city.name if city.country_code == "CN" else f"{city.name}({city.name_en})" for city in city_index]
+    result = "内置城市列表：\n" + "、".join(cities)
+    if offline_gazetteer is not None:
+        result += f"\n\n已加载离线地名库：{len(offline_gazetteer)} 个地点"
+    return result + "\n\n其他城市也支持，通过高德地图API动态获取坐标。"
+
+@mcp.tool()
+async def get_city_coordinates(city: str = "北京", output_format: str = WEATHER_OUTPUT_FORMAT) -> str:
     """获取城市坐标（支持全国所有城市）
     
     Args:
         city: 城市名称，支持全国所有城市，如：北京、上海、三亚、拉萨等
+        output_format: 输出格式，text（文本）或 json（结构化数据，数值字段为数字类型）
     """
+    if error := invalid_output_format(output_format):
+        return error
     try:
         coordinates = await geocoder.get_coordinates(city)
         if coordinates:
             lat, lon = coordinates
+            if output_format == "json":
+                return to_json({"city": city, "lat": lat, "lon": lon})
             return f"📍 {city} 坐标信息：\n纬度：{lat}\n经度：{lon}\n坐标：{lat},{lon}"
         else:
+            if output_format == "json":
+                return to_json({"city": city, "error": f"未找到城市：{city}"})
             return f"❌ 未找到城市：{city}，请检查城市名称是否正确"
     except Exception as e:
         logger.error(f"获取城市坐标失败: {e}")
+        if output_format == "json":
+            return to_json({"city": city, "error": f"获取{city}坐标失败: {str(e)}"})
         return f"❌ 获取{city}坐标失败: {str(e)}"
 
 @mcp.tool()
-async def get_user_location_by_ip() -> str:
+async def get_cities_coordinates(cities: list[str], output_format: str = WEATHER_OUTPUT_FORMAT) -> str:
+    """批量获取多个城市的坐标（未缓存的城市合并为高德批量请求）
+    
+    Args:
+        cities: 城市名称列表，如：["北京", "三亚", "桂林"]
+        output_format: 输出格式，text（文本）或 json（结构化数据，数值字段为数字类型）
+    """
+    if error := invalid_output_format(output_format):
+        return error
+    try:
+        results = await geocoder.get_coordinates_batch(cities)
+        if output_format == "json":
+            return to_json({"results": [
+                {"city": city, "lat": coordinates[0], "lon": coordinates[1]} if coordinates
+                else {"city": city, "error": "未找到城市"}
+                for city, coordinates in results.items()
+            ]})
+        lines = [f"📍 批量坐标查询结果（共{len(results)}个城市）："]
+        for city, coordinates in results.items():
+            if coordinates:
+                lat, lon = coordinates
+                lines.append(f"{city}：纬度 {lat}，经度 {lon}")
+            else:
+                lines.append(f"{city}：❌ 未找到城市")
+        return "\n".join(lines)
+    except Exception as e:
+        logger.error(f"批量获取城市坐标失败: {e}")
+        if output_format == "json":
+            return to_json({"error": f"批量获取城市坐标失败: {str(e)}"})
+        return f"❌ 批量获取城市坐标失败: {str(e)}"
+
+@mcp.tool()
+async def nearest_city(lat: float, lon: float, output_format: str = WEATHER_OUTPUT_FORMAT) -> str:
+    """查找距离指定坐标最近的城市（反向地理编码，本地计算，不调用外部API）
+    
+    Args:
+        lat: 纬度，-90 到 90
+        lon: 经度，-180 到 180
+        output_format: 输出格式，text（文本）或 json（结构化数据，数值字段为数字类型）
+    """
+    if error := invalid_output_format(output_format):
+        return error
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        if output_format == "json":
+            return to_json({"lat": lat, "lon": lon, "error": "坐标超出范围"})
+        return f"❌ 坐标超出范围：纬度 {lat}，经度 {lon}"
+    try:
+        i, distance = city_spatial_index.nearest(lat, lon)
+        city = city_index.cities[i]
+        payload = {
+            "lat": lat,
+            "lon": lon,
+            "city": {
+                "name": city.name, "name_en": city.name_en, "country_code": city.country_code,
+                "lat": city.lat, "lon": city.lon, "distance_km": round(distance, 1),
+            },
+        }
+        lines = [f"📍 距离 ({lat}, {lon}) 最近的内置城市：{city.name}（{city.country}，{city.name_en}），约 {distance:.1f} 公里"]
+        # 离线地名库为空时 nearest 返回 None，只输出内置城市
+        nearest = gazetteer_spatial_index.nearest(lat, lon) if gazetteer_spatial_index is not None else None
+        if nearest is not None:
+            i, distance = nearest
+            place = offline_gazetteer.place(i)
+            payload["gazetteer"] = {
+                "name": place.name, "country_code": place.country_code,
+                "lat": place.lat, "lon": place.lon, "distance_km": round(distance, 1),
+            }
+            lines.append(f"🗂️ 离线地名库最近地点：{place.name}（{place.country_code}），约 {distance:.1f} 公里")
+        if output_format == "json":
+            return to_json(payload)
+        return "\n".join(lines)
+    except Exception as e:
+        logger.error(f"反向地理编码失败: {e}")
+        if output_format == "json":
+            return to_json({"lat": lat, "lon": lon, "error": f"查找最近城市失败: {str(e)}"})
+        return f"❌ 查找最近城市失败: {str(e)}"
+
+@mcp.tool()
+async def get_user_location_by_ip(ip: str = "", output_format: str = WEATHER_OUTPUT_FORMAT) -> str:
     """通过IP地址获取用户当前地理位置
     
     当用户没有指定城市时，可以使用此工具自动获取用户所在城市
+    
+    Args:
+        ip: 要定位的IP地址（可选，默认定位当前网络出口IP）
+        output_format: 输出格式，text（文本）或 json（结构化数据，数值字段为数字类型）
     """
+    if error := invalid_output_format(output_format):
+        return error
+    as_json = output_format == "json"
+    if ip.strip():
+        try:
+            ipaddress.ip_address(ip.strip())
+        except ValueError:
+            if as_json:
+                return to_json({"ip": ip, "error": "无效的IP地址"})
+            return f"❌ 无效的IP地址：{ip}，请检查后重试"
     try:
-        # 使用 ipapi.co 免费服务获取IP定位
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get("https://ipapi.co/json/")
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # 提取地理位置信息
-            country = data.get("country_name", "")
-            region = data.get("region", "")
-            city = data.get("city", "")
-            ip = data.get("ip", "")
+        location = await ip_locator.locate(ip)
+        
+        # 提取地理位置信息
+        country = location.country
+        city = location.city
+        ip = location.ip
+        
+        # 通过本地空间索引将定位坐标解析为最近的已知城市（国内外统一处理）
+        latitude, longitude = location.latitude, location.longitude
+        if isinstance(latitude, (int, float)) and isinstance(longitude, (int, float)):
+            nearest = find_nearest_place(latitude, longitude)
+            place, distance = nearest if nearest is not None else (None, float("inf"))
+            if distance <= IP_LOCATION_MAX_DISTANCE_KM:
+                lat, lon = place.coordinates
+                logger.info(f"🌍 IP定位成功：{country} {city} ({latitude},{longitude}) -> 最近城市 {place.name}，{distance:.1f}公里")
+                if as_json:
+                    return to_json({
+                        "ip": ip, "country": country, "city": place.name, "lat": lat, "lon": lon,
+                        "matched": True, "distance_km": round(distance, 1),
+                    })
+                return f"📍 已自动定位到：{place.name}\n🌐 您的IP：{ip}\n🧭 坐标：{lat},{lon}\n✅ 将为您查询 {place.name} 的天气信息"
+        else:
+            latitude = longitude = None
+        
+        # 定位服务未返回坐标时，按城市名匹配内置城市（支持 Beijing、北京市 等写法）
+        if city:
+            matched = city_index.lookup(city)
+            if matched is not None:
+                logger.info(f"🌍 IP定位成功：{country} {city} -> 匹配到 {matched.name}")
+                if as_json:
+                    return to_json({
+                        "ip": ip, "country": country, "city": matched.name,
+                        "lat": matched.lat, "lon": matched.lon, "matched": True,
+                    })
+                return f"📍 已自动定位到：{matched.name}\n🌐 您的IP：{ip}\n✅ 将为您查询 {matched.name} 的天气信息"
+            logger.info(f"🌍 IP定位成功：{country} {city}（使用原始城市名）")
+            if as_json:
+                return to_json({
+                    "ip": ip, "country": country, "city": city,
+                    "lat": latitude, "lon": longitude, "matched": False,
+                })
+            # 定位坐标只随结果返回，不写入共享的地理编码缓存（IP 定位精度有限，且同名地点可能不止一处）
+            coordinates = f"\n🧭 坐标：{latitude},{longitude}" if latitude is not None else ""
+            return f"📍 已定位到：{country} {city}\n🌐 您的IP：{ip}{coordinates}\n💡 将尝试查询 {city} 的天气信息"
+        else:
+            logger.warning(f"🌍 IP定位失败：无法获取城市信息，IP：{ip}")
+            if as_json:
+                return to_json({"ip": ip, "error": "无法精确定位城市"})
+            return f"📍 无法精确定位城市\n🌐 您的IP：{ip}\n💡 建议手动指定城市名称"
             
-            # 处理定位结果（支持全球城市）
-            if city:
-                # 如果是中国城市，尝试匹配已知城市
-                if country == "China":
-                    matched_city = None
-                    city_clean = city.replace("市", "").replace("区", "").replace("县", "")
-                    
-                    # 先检查是否在支持列表中
-                    for supported_city in CITY_COORDINATES.keys():
-                        if city_clean in supported_city or supported_city in city_clean:
-                            matched_city = supported_city
-                            break
-                    
-                    if matched_city:
-                        logger.info(f"🌍 IP定位成功：{country} {city} -> 匹配到 {matched_city}")
-                        return f"📍 已自动定位到：{matched_city}\n🌐 您的IP：{ip}\n✅ 将为您查询 {matched_city} 的天气信息"
-                    else:
-                        logger.info(f"🌍 IP定位成功：{country} {city}（使用原始城市名）")
-                        return f"📍 已定位到：{city}\n🌐 您的IP：{ip}\n💡 将尝试查询 {city} 的天气信息"
-                else:
-                    # 非中国城市，直接使用定位结果
-                    logger.info(f"🌍 IP定位成功：{country} {city}（国外城市）")
-                    return f"📍 已定位到：{country} {city}\n🌐 您的IP：{ip}\n✅ 将尝试为您查询 {city} 的天气信息"
-            else:
-                logger.warning(f"🌍 IP定位失败：无法获取城市信息，IP：{ip}")
-                return f"📍 无法精确定位城市\n🌐 您的IP：{ip}\n💡 建议手动指定城市名称"
-                
     except httpx.HTTPError as e:
         logger.error(f"IP定位服务请求失败: {e}")
+        if as_json:
+            return to_json({"error": "IP定位服务暂时不可用"})
         return "❌ IP定位服务暂时不可用，请手动指定城市名称"
     except Exception as e:
         logger.error(f"IP定位失败: {e}")
+        if as_json:
+            return to_json({"error": f"自动定位失败: {str(e)}"})
         return f"❌ 自动定位失败: {str(e)}，请手动指定城市名称"
 
+async def serve_http(transport: str, host: str, port: int, path: Optional[str] = None):
+    """作为长驻 HTTP/SSE 服务运行
+    
+    生命周期在整个服务期间保持，客户端会话的断开不会关闭共享资源；
+    所有连接进来的团队进程共用同一份预报缓存、地理编码缓存和上游连接池。
+    """
+    async with server_lifespan(mcp):
+        await mcp.run_http_async(transport=transport, host=host, port=port, path=path)
+
 # 运行服务器
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="彩云天气 MCP 服务器")
+    parser.add_argument("--transport", choices=["stdio", "http", "sse"], default="stdio",
+                        help="传输方式：stdio（默认，由代理进程拉起）、http（streamable HTTP）或 sse")
+    parser.add_argument("--host", default="127.0.0.1", help="HTTP/SSE 监听地址（默认 127.0.0.1）")
+    parser.add_argument("--port", type=int, default=8000, help="HTTP/SSE 监听端口（默认 8000）")
+    parser.add_argument("--path", default=None, help="服务路径（默认 http 为 /mcp/，sse 为 /sse/）")
+    args = parser.parse_args()
+
+    if args.transport == "stdio":
+        mcp.run()
+    else:
+        asyncio.run(serve_http(args.transport, args.host, args.port, args.path))
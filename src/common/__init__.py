@@ -0,0 +1,3 @@
+"""
+三种协作模式共用的组件
+"""
@@ -0,0 +1,195 @@
+"""
+本地意图解析
+用内置城市别名索引识别城市，用日期关键词和天数提取识别时间范围；
+只在整句都能解释时给出结果，其余查询交给 LLM 意图解析代理
+"""
+
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from mcp_server.city_index import BUILTIN_CITIES, CityIndex, City
+
+# future 查询未指定天数时的默认值，与天气查询代理的约定一致
+DEFAULT_FUTURE_DAYS = 3
+MAX_FUTURE_DAYS = 15
+
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_NUMBER = r"[0-9]+|[一二两三四五六七八九十]+"
+_DAYS_PATTERN = re.compile(rf"(?:未来|接下来|之后|最近)?\s*(?P<n>{_NUMBER})\s*(?:天|日)|next\s+(?P<en>\d+)\s+days?")
+
+# (关键词, 时间, 天数)，按长度优先匹配
+_TIME_KEYWORDS: Tuple[Tuple[str, str, int], ...] = (
+    ("这几天", "future", DEFAULT_FUTURE_DAYS),
+    ("最近几天", "future", DEFAULT_FUTURE_DAYS),
+    ("近几天", "future", DEFAULT_FUTURE_DAYS),
+    ("未来几天", "future", DEFAULT_FUTURE_DAYS),
+    ("接下来几天", "future", DEFAULT_FUTURE_DAYS),
+    ("这周", "future", 7),
+    ("本周", "future", 7),
+    ("一周", "future", 7),
+    ("明天", "tomorrow", 1),
+    ("明日", "tomorrow", 1),
+    ("明儿", "tomorrow", 1),
+    ("tomorrow", "tomorrow", 1),
+    ("今天", "today", 1),
+    ("今日", "today", 1),
+    ("今儿", "today", 1),
+    ("现在", "today", 1),
+    ("当前", "today", 1),
+    ("today", "today", 1),
+    ("now", "today", 1),
+)
+
+# 无法用 today / tomorrow / future 准确表达的时间（后天只要一天），交给 LLM 意图解析代理
+_UNSUPPORTED_TIMES = re.compile(r"后天|前天|昨天|yesterday")
+
+# 与意图无关的常见措辞，去掉后句子应为空，否则视为无法本地解析
+_FILLERS = re.compile(
+    r"天气预报|天气情况|天气状况|天气|气温|温度|预报|情况"
+    r"|怎么样|怎样|如何|咋样|好不好|会不会下雨|会下雨吗|下雨吗|下雨|热不热|冷不冷|热吗|冷吗"
+    r"|请问|帮我|帮忙|给我|我想知道|想知道|告诉我|查询|查一下|查查|看一下|看看|一下|查|请"
+    r"|的|吗|呢|啊|呀|吧|了|是|在|市"
+    r"|\b(?:weather|forecast|what|how|is|the|in|for|of|s)\b"
+)
+_PUNCTUATION = re.compile(r"[\s\W_]+")
+_LATIN_WORDS = re.compile(r"[a-z][a-z'’.-]*")
+# 拉丁字母城市名最多由几个单词组成（如 new york、los angeles、san francisco）
+_MAX_CITY_WORDS = 3
+# 同时是常见英文单词的城市别名（is the weather nice today），只在 in / for / at 之后才视为城市
+_COMMON_WORD_ALIASES = {"nice", "la"}
+_LOCATION_PREPOSITIONS = {"in", "for", "at"}
+
+
+@dataclass(frozen=True)
+class WeatherIntent:
+    """结构化的天气查询意图"""
+    city: str
+    horizon: str  # today / tomorrow / future
+    days: int = DEFAULT_FUTURE_DAYS
+
+    def describe(self) -> str:
+        if self.horizon == "today":
+            return f"查询{self.city}今天的天气"
+        if self.horizon == "tomorrow":
+            return f"查询{self.city}明天的天气"
+        return f"查询{self.city}未来{self.days}天的天气"
+
+    def to_text(self) -> str:
+        """与 LLM 意图解析代理相同的输出格式，future 查询附带天数"""
+        lines = [f"城市：{self.city}", f"时间：{self.horizon}"]
+        if self.horizon == "future":
+            lines.append(f"天数：{self.days}")
+        lines.append(f"查询：{self.describe()}")
+        return "\n".join(lines)
+
+
+def parse_number(text: str) -> Optional[int]:
+    """解析阿拉伯数字或 99 以内的中文数字"""
+    if text.isdigit():
+        return int(text)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        if len(ones) > 1 or (tens and tens not in _CN_DIGITS) or (ones and ones not in _CN_DIGITS):
+            return None
+        return _CN_DIGITS.get(tens, 1) * 10 + _CN_DIGITS.get(ones, 0)
+    if len(text) == 1:
+        return _CN_DIGITS.get(text)
+    return None
+
+
+class LocalIntentParser:
+    """规则意图解析器
+
+    只有在恰好识别出一个城市、时间表达无冲突、且没有无法解释的剩余文字时才返回意图；
+    没有城市（需要 IP 定位）、多个城市、多个时间或其他复杂措辞都返回 None。
+    """
+
+    def __init__(self, index: Optional[CityIndex] = None):
+        self.index = index or CityIndex(BUILTIN_CITIES)
+        aliases = self.index.aliases()
+        self._cjk_aliases = {alias: city for alias, city in aliases.items() if not alias.isascii()}
+        self._latin_aliases = {alias: city for alias, city in aliases.items() if alias.isascii()}
+        self._max_cjk_length = max(map(len, self._cjk_aliases), default=0)
+
+    def _find_cities(self, text: str) -> Tuple[List[City], str]:
+        """找出句中所有城市名，返回 (城市列表, 去掉城市名后的文本)"""
+        found: List[City] = []
+        # 中文城市名：最长匹配
+        chars, i = [], 0
+        while i < len(text):
+            for length in range(min(self._max_cjk_length, len(text) - i), 1, -1):
+                city = self._cjk_aliases.get(text[i:i + length])
+                if city is not None:
+                    found.append(city)
+                    chars.append(" ")
+                    i += length
+                    break
+            else:
+                chars.append(text[i])
+                i += 1
+        text = "".join(chars)
+
+        # 拉丁字母城市名：按单词匹配，多词城市名拼接后查找
+        words = list(_LATIN_WORDS.finditer(text))
+        spans = []
+        k = 0
+        while k < len(words):
+            for n in range(min(_MAX_CITY_WORDS, len(words) - k), 0, -1):
+                key = "".join(re.sub(r"['’.-]", "", w.group()) for w in words[k:k + n])
+                city = self._latin_aliases.get(key)
+                if city is not None and key in _COMMON_WORD_ALIASES and (
+                    k == 0 or words[k - 1].group() not in _LOCATION_PREPOSITIONS
+                ):
+                    city = None
+                if city is not None:
+                    found.append(city)
+                    spans.append((words[k].start(), words[k + n - 1].end()))
+                    k += n
+                    break
+            else:
+                k += 1
+        for start, end in reversed(spans):
+            text = text[:start] + " " + text[end:]
+        return found, text
+
+    def _find_horizons(self, text: str) -> Tuple[List[Tuple[str, int]], str]:
+        """找出句中所有时间表达，返回 ([(时间, 天数)], 去掉时间表达后的文本)"""
+        horizons: List[Tuple[str, int]] = []
+
+        def days(match: re.Match) -> str:
+            n = parse_number(match["n"]) if match["n"] else int(match["en"])
+            horizons.append(("future", n if n is not None else -1))
+            return " "
+
+        text = _DAYS_PATTERN.sub(days, text)
+        for keyword, horizon, n in _TIME_KEYWORDS:
+            pattern = rf"\b{keyword}\b" if keyword.isascii() else keyword
+            text, count = re.subn(pattern, " ", text)
+            horizons += [(horizon, n)] * count
+        return horizons, text
+
+    def parse(self, query: str, allow_missing_city: bool = False) -> Optional[WeatherIntent]:
+        """解析查询，有把握时返回意图，否则返回 None
+
+        allow_missing_city 为 True 时，没有城市名的查询返回 city 为空字符串的意图（由调用方定位城市）。
+        """
+        text = query.strip().casefold()
+        if not text or _UNSUPPORTED_TIMES.search(text):
+            return None
+
+        cities, text = self._find_cities(text)
+        names = {city.name for city in cities}
+        if len(names) > 1 or (not names and not allow_missing_city):
+            return None
+        horizons, text = self._find_horizons(text)
+        if len(set(horizons)) > 1:
+            return None
+
+        if _PUNCTUATION.sub("", _FILLERS.sub(" ", text)):
+            return None
+
+        horizon, days = horizons[0] if horizons else ("today", 1)
+        if horizon == "future" and not 1 <= days <= MAX_FUTURE_DAYS:
+            return None
+        return WeatherIntent(cities[0].name if cities else "", horizon, days if horizon == "future" else 1)
@@ -0,0 +1,185 @@
+"""
+MCP 会话池
+维持若干个已初始化的长连接 MCP 会话（stdio 时每个会话对应一个服务器子进程），
+工具调用分派给进行中调用最少的健康会话；会话断开或健康检查失败时自动重连
+"""
+
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import anyio
+from autogen_ext.tools.mcp import create_mcp_server_session
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED, CallToolResult, ListToolsResult
+
+logger = logging.getLogger(__name__)
+
+# 说明连接已经不可用的异常，遇到时重建会话
+_CONNECTION_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream, ConnectionError)
+
+
+def is_connection_error(error: BaseException) -> bool:
+    if isinstance(error, McpError):
+        return error.error.code == CONNECTION_CLOSED
+    return isinstance(error, _CONNECTION_ERRORS)
+
+
+class PooledSession:
+    """池中的一个会话槽位"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.session = None
+        self.inflight = 0
+        self.calls = 0
+        self.restarts = 0
+        self.task: Optional[asyncio.Task] = None
+        self.broken = asyncio.Event()
+
+    @property
+    def healthy(self) -> bool:
+        return self.session is not None and not self.broken.is_set()
+
+
+class McpSessionPool:
+    """MCP 会话池
+
+    实现 list_tools / call_tool，可直接作为 mcp_server_tools 的 session 使用，由它生成的工具适配器共享池中的会话。
+    每个会话由独立的后台任务建立、做健康检查（ping）并在断开后重连；会话只能在创建它的事件循环中使用。
+    """
+
+    def __init__(
+        self,
+        server_params,
+        size: int = 2,
+        health_interval: float = 30.0,
+        health_timeout: float = 5.0,
+        connect_timeout: float = 30.0,
+        reconnect_delay: float = 1.0,
+        session_factory: Callable = create_mcp_server_session,
+    ):
+        if size < 1:
+            raise ValueError("会话池大小至少为 1")
+        self.server_params = server_params
+        self.size = size
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.connect_timeout = connect_timeout
+        self.reconnect_delay = reconnect_delay
+        self.session_factory = session_factory
+        self.slots = [PooledSession(i) for i in range(size)]
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    async def start(self):
+        """启动全部会话，至少一个会话就绪后返回"""
+        for slot in self.slots:
+            if slot.task is None:
+                slot.task = asyncio.get_running_loop().create_task(self._run_slot(slot))
+        try:
+            await asyncio.wait_for(self._ready.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            await self.aclose()
+            raise ConnectionError(f"MCP 会话在 {self.connect_timeout:.0f} 秒内未能建立") from None
+        return self
+
+    def _update_ready(self):
+        if any(slot.healthy for slot in self.slots):
+            self._ready.set()
+        else:
+            self._ready.clear()
+
+    async def _run_slot(self, slot: PooledSession):
+        """建立会话并守护，会话结束后（断开、健康检查失败）重新建立"""
+        while not self._closed:
+            try:
+                async with self.session_factory(self.server_params) as session:
+                    await session.initialize()
+                    slot.session = session
+                    slot.broken.clear()
+                    self._update_ready()
+                    logger.info(f"🔌 MCP 会话 #{slot.index} 已就绪")
+                    await self._supervise(slot)
+            except Exception as e:
+                logger.warning(f"⚠️ MCP 会话 #{slot.index} 异常：{e}")
+            finally:
+                slot.session = None
+                self._update_ready()
+            if not self._closed:
+                slot.restarts += 1
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def _supervise(self, slot: PooledSession):
+        """等待会话被标记为断开，期间按间隔做健康检查"""
+        while not self._closed:
+            try:
+                await asyncio.wait_for(slot.broken.wait(), self.health_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await asyncio.wait_for(slot.session.send_ping(), self.health_timeout)
+            except Exception as e:
+                logger.warning(f"⚠️ MCP 会话 #{slot.index} 健康检查失败，重新连接：{e or type(e).__name__}")
+                return
+
+    async def _acquire(self) -> PooledSession:
+        """选择进行中调用最少的健康会话，没有可用会话时等待重连"""
+        while True:
+            healthy = [slot for slot in self.slots if slot.healthy]
+            if healthy:
+                return min(healthy, key=lambda slot: slot.inflight)
+            if self._closed:
+                raise ConnectionError("MCP 会话池已关闭")
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.connect_timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError("没有可用的 MCP 会话") from None
+
+    async def _dispatch(self, method: str, *args, **kwargs) -> Any:
+        """在最空闲的会话上执行请求；连接断开时标记会话待重连，并在其他会话上重试一次"""
+        for attempt in range(2):
+            slot = await self._acquire()
+            slot.inflight += 1
+            slot.calls += 1
+            try:
+                return await getattr(slot.session, method)(*args, **kwargs)
+            except Exception as e:
+                if not is_connection_error(e) or attempt:
+                    raise
+                logger.warning(f"⚠️ MCP 会话 #{slot.index} 连接断开，改用其他会话重试")
+                slot.broken.set()
+                self._update_ready()
+            finally:
+                slot.inflight -= 1
+
+    async def list_tools(self) -> ListToolsResult:
+        return await self._dispatch("list_tools")
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any] = None, **kwargs) -> CallToolResult:
+        return await self._dispatch("call_tool", name, arguments, **kwargs)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各会话的状态"""
+        return [
+            {"index": slot.index, "healthy": slot.healthy, "inflight": slot.inflight,
+             "calls": slot.calls, "restarts": slot.restarts}
+            for slot in self.slots
+        ]
+
+    async def aclose(self):
+        """关闭全部会话"""
+        self._closed = True
+        for slot in self.slots:
+            slot.broken.set()
+        tasks = [slot.task for slot in self.slots if slot.task is not None]
+        if tasks:
+            # 会话正常退出（终止子进程）；仍在建立连接的直接取消
+            _, pending = await asyncio.wait(tasks, timeout=self.health_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for slot in self.slots:
+            slot.task = None
+        self._ready.clear()
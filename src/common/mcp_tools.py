@@ -0,0 +1,193 @@
+"""
+天气 MCP 工具
+默认在进程内直接加载 weather_mcp_server 的 FastMCP 实例，工具调用不再经过 JSON-RPC、管道和独立解释器；
+工具 schema 与结果格式和 stdio 子进程完全一致，stdio 保留为后备传输方式。
+也可以连接长驻的 HTTP/SSE 天气 MCP 服务，多个团队进程共用一份缓存和连接池；
+stdio 和远程服务通过会话池保持多个长连接会话
+"""
+
+import asyncio
+import logging
+import os
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional, Tuple
+
+from autogen_ext.tools.mcp import SseServerParams, StdioServerParams, StreamableHttpServerParams, mcp_server_tools
+from mcp.types import CallToolResult, ListToolsResult, TextContent
+
+from .mcp_session_pool import McpSessionPool
+
+logger = logging.getLogger(__name__)
+
+# 工具传输方式：inprocess（进程内，默认）、stdio（子进程）、http（streamable HTTP 服务）或 sse（SSE 服务）
+MCP_TRANSPORTS = ("inprocess", "stdio", "http", "sse")
+
+# stdio 子进程或远程服务的会话池大小（保持连接的会话数），以及健康检查间隔（秒）
+MCP_POOL_SIZE = int(os.getenv("WEATHER_MCP_POOL_SIZE", "2"))
+MCP_HEALTH_INTERVAL = float(os.getenv("WEATHER_MCP_HEALTH_INTERVAL", "30"))
+
+# stdio 子进程的启动参数，进程内模式下也作为工具适配器的配置
+WEATHER_MCP_SERVER_PARAMS = StdioServerParams(
+    command="python",
+    args=["mcp_server/weather_mcp_server.py"]
+)
+
+
+class InProcessMcpSession:
+    """进程内 MCP 会话
+
+    实现 AutoGen MCP 工具适配器用到的 list_tools / call_tool，通过 FastMCP 的公开工具接口（get_tools、
+    Tool.to_mcp_tool、Tool.run）直接在同进程中处理；与 MCP 服务端一样，工具抛出的异常转换为 isError 的结果。
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self._stack = None
+
+    async def start(self):
+        """进入服务器生命周期（预热调度等），与 stdio 子进程启动时一致"""
+        if self._stack is None:
+            self._stack = AsyncExitStack()
+            await self._stack.enter_async_context(self.server.server_lifespan(self.server.mcp))
+
+    async def list_tools(self) -> ListToolsResult:
+        tools = await self.server.mcp.get_tools()
+        return ListToolsResult(tools=[tool.to_mcp_tool(name=key) for key, tool in tools.items()])
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any] = None) -> CallToolResult:
+        tool = (await self.server.mcp.get_tools()).get(name)
+        if tool is None:
+            return CallToolResult(content=[TextContent(type="text", text=f"Unknown tool: {name}")], isError=True)
+        try:
+            result = await tool.run(arguments or {})
+        except Exception as e:
+            return CallToolResult(content=[TextContent(type="text", text=str(e))], isError=True)
+        return CallToolResult(content=list(result.content), structuredContent=result.structured_content)
+
+    async def aclose(self):
+        """退出服务器生命周期，关闭共享连接"""
+        if self._stack is not None:
+            await self._stack.aclose()
+            self._stack = None
+
+
+async def create_inprocess_session() -> InProcessMcpSession:
+    """在进程内加载天气 MCP 服务器"""
+    # 延迟导入：服务器模块在导入时读取 CAIYUN_API_KEY 等配置
+    from mcp_server import weather_mcp_server
+
+    session = InProcessMcpSession(weather_mcp_server)
+    await session.start()
+    return session
+
+
+async def create_session_pool(server_params, size: int = None) -> McpSessionPool:
+    """建立 stdio 子进程或远程服务的会话池，size 未指定时读取 WEATHER_MCP_POOL_SIZE"""
+    pool = McpSessionPool(
+        server_params,
+        size=size or MCP_POOL_SIZE,
+        health_interval=MCP_HEALTH_INTERVAL,
+    )
+    return await pool.start()
+
+
+def remote_server_params(url: str, transport: str = "http"):
+    """长驻天气 MCP 服务的连接参数"""
+    if transport == "sse":
+        return SseServerParams(url=url)
+    return StreamableHttpServerParams(url=url)
+
+
+def resolve_transport(transport: Optional[str] = None, url: Optional[str] = None) -> str:
+    """确定传输方式：显式参数 > WEATHER_MCP_TRANSPORT；都未指定时有 URL 则连接远程服务（路径以 /sse 结尾为 SSE），否则进程内加载"""
+    transport = (transport or os.getenv("WEATHER_MCP_TRANSPORT", "")).lower()
+    if not transport:
+        if not url:
+            return "inprocess"
+        return "sse" if url.rstrip("/").endswith("/sse") else "http"
+    if transport not in MCP_TRANSPORTS:
+        raise ValueError(f"不支持的 MCP 传输方式：{transport}，可选 {', '.join(MCP_TRANSPORTS)}")
+    if transport in ("http", "sse") and not url:
+        raise ValueError(f"{transport} 传输方式需要服务地址，请设置 WEATHER_MCP_URL")
+    return transport
+
+
+async def load_weather_mcp_tools(transport: str = None, url: str = None) -> Tuple[List, Any]:
+    """建立会话并生成工具，返回 (工具列表, 会话)；进程内加载失败时退回 stdio 子进程"""
+    url = url or os.getenv("WEATHER_MCP_URL", "")
+    transport = resolve_transport(transport, url)
+
+    session = None
+    if transport == "inprocess":
+        try:
+            session = await create_inprocess_session()
+        except Exception as e:
+            logger.warning(f"⚠️ 进程内加载天气 MCP 服务器失败，改用 stdio 子进程：{e}")
+    if transport in ("http", "sse"):
+        server_params = remote_server_params(url, transport)
+    else:
+        server_params = WEATHER_MCP_SERVER_PARAMS
+    if session is None:
+        session = await create_session_pool(server_params)
+
+    try:
+        return await mcp_server_tools(server_params, session=session), session
+    except BaseException:
+        await session.aclose()
+        raise
+
+
+# 每个事件循环一份工具：会话（子进程管道、HTTP 连接）只能在创建它的事件循环中使用。
+# 值为 (工具 Future, 持有会话的任务)；任务在 close_weather_mcp_tools 或事件循环退出
+# （asyncio.run 退出前会取消剩余任务）时关闭会话并移除记录
+_loaded_tools: Dict[asyncio.AbstractEventLoop, Tuple[asyncio.Future, asyncio.Task]] = {}
+
+
+async def _hold_weather_mcp_tools(transport: Optional[str], url: Optional[str], loaded: asyncio.Future):
+    """建立会话并一直持有，直到本任务被取消"""
+    loop = asyncio.get_running_loop()
+    try:
+        try:
+            tools, session = await load_weather_mcp_tools(transport, url)
+        except asyncio.CancelledError:
+            loaded.cancel()
+            raise
+        except Exception as e:
+            loaded.set_exception(e)
+            return
+        try:
+            loaded.set_result(tools)
+            await loop.create_future()
+        finally:
+            await session.aclose()
+    finally:
+        entry = _loaded_tools.get(loop)
+        if entry is not None and entry[1] is asyncio.current_task():
+            del _loaded_tools[loop]
+
+
+async def get_weather_mcp_tools(transport: str = None, url: str = None):
+    """获取天气 MCP 工具
+
+    transport / url 未指定时读取 WEATHER_MCP_TRANSPORT、WEATHER_MCP_URL 环境变量，见 resolve_transport。
+    同一事件循环内的调用（包括并发调用）共用同一组工具和会话，首次调用时确定传输方式。
+    """
+    loop = asyncio.get_running_loop()
+    entry = _loaded_tools.get(loop)
+    if entry is None:
+        # 没有正常退出（未取消剩余任务）就关闭的事件循环，其会话已无法关闭，只移除记录
+        for closed in [other for other in _loaded_tools if other.is_closed()]:
+            del _loaded_tools[closed]
+        loaded = loop.create_future()
+        entry = _loaded_tools[loop] = (loaded, loop.create_task(_hold_weather_mcp_tools(transport, url, loaded)))
+    return await asyncio.shield(entry[0])
+
+
+async def close_weather_mcp_tools():
+    """关闭当前事件循环的天气 MCP 会话（会话池、子进程或进程内服务器的共享连接）"""
+    entry = _loaded_tools.pop(asyncio.get_running_loop(), None)
+    if entry is None:
+        return
+    _, holder = entry
+    holder.cancel()
+    await asyncio.gather(holder, return_exceptions=True)
@@ -0,0 +1,95 @@
+"""
+并发查询
+同一个团队同一时间只能运行一个任务，并发查询由一组预先初始化的团队实例（共享模型客户端和 MCP 工具）分担：
+每条查询取一个空闲实例执行，结果按输入顺序返回，并附带每条查询的耗时。
+QueryPoolMixin 为各模式的团队类提供副本管理和 query_many，团队类只需提供初始化自身和创建副本的方法
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence
+
+
+@dataclass
+class QueryResult:
+    """单条查询的结果"""
+    query: str
+    output: str
+    elapsed: float  # 执行耗时（秒），不含排队等待
+    wait: float = 0.0  # 等待空闲团队实例的时间（秒）
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+async def run_query_pool(members: Sequence[Any], inputs: Sequence[str]) -> List[QueryResult]:
+    """用一组团队实例并发执行查询
+
+    每个实例同一时间只执行一条查询；单条查询失败不影响其他查询，错误记录在对应结果中。
+    """
+    if not members:
+        raise ValueError("至少需要一个团队实例")
+    idle: asyncio.Queue = asyncio.Queue()
+    for member in members:
+        idle.put_nowait(member)
+
+    async def run(user_input: str) -> QueryResult:
+        queued = time.perf_counter()
+        member = await idle.get()
+        started = time.perf_counter()
+        error = None
+        try:
+            output = await member.query(user_input)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            output = f"❌ 查询失败: {error}"
+        finally:
+            finished = time.perf_counter()
+            idle.put_nowait(member)
+        return QueryResult(user_input, output, finished - started, started - queued, error)
+
+    return list(await asyncio.gather(*(run(user_input) for user_input in inputs)))
+
+
+class QueryPoolMixin:
+    """团队类的并发查询支持
+
+    使用方在 __init__ 中设置 self._replicas = []，并实现 _ensure_initialized（初始化自身）和
+    _create_replica（创建并初始化一个共用模型客户端和 MCP 工具的团队副本）。
+    """
+
+    _replicas: List[Any]
+
+    async def _ensure_initialized(self) -> None:
+        raise NotImplementedError
+
+    async def _create_replica(self) -> Any:
+        raise NotImplementedError
+
+    async def _team_pool(self, size: int) -> List[Any]:
+        """返回 size 个已初始化的团队实例（自身和副本），副本在首次需要时创建并保留复用"""
+        await self._ensure_initialized()
+        missing = size - 1 - len(self._replicas)
+        if missing > 0:
+            self._replicas += await asyncio.gather(*(self._create_replica() for _ in range(missing)))
+        return [self] + self._replicas[:size - 1]
+
+    async def query_many(self, inputs: Sequence[str], concurrency: int = 4) -> List[QueryResult]:
+        """并发执行多条查询，结果按输入顺序返回，每条结果附带耗时
+
+        同一个团队不能同时运行多个任务：最多 concurrency 个团队实例各自执行一条查询。
+        """
+        if concurrency < 1:
+            raise ValueError("并发数至少为 1")
+        if not inputs:
+            return []
+        members = await self._team_pool(min(concurrency, len(inputs)))
+        return await run_query_pool(members, inputs)
+
+    async def _close_replicas(self) -> None:
+        """关闭并丢弃所有副本（副本不持有模型客户端，不会关闭共用的客户端）"""
+        replicas, self._replicas = self._replicas, []
+        await asyncio.gather(*(replica.close() for replica in replicas))
@@ -0,0 +1,250 @@
+"""
+确定性天气模板渲染
+按 formatter 代理系统消息中的固定模板和生活建议规则直接生成回复，无需调用大模型；
+同时提供可替代 LLM formatter 的 TemplateFormatterAgent
+"""
+
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_agentchat.base import Response
+from autogen_agentchat.conditions import FunctionalTermination
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, HandoffMessage, TextMessage, ToolCallSummaryMessage
+from autogen_core import CancellationToken
+from autogen_core.models import FunctionExecutionResultMessage
+
+# 成功渲染的消息带有该元数据，供终止条件识别
+RENDERER_METADATA = {"renderer": "template"}
+
+_DAY_HEADER = re.compile(r"^[^\w\s]*\s*(?P<city>.+?)\s+(?P<date>\d{4}-\d{2}-\d{2})$")
+_FUTURE_HEADER = re.compile(r"^[^\w\s]*\s*(?P<city>.+?)\s+未来\d+天天气预报：$")
+_FUTURE_LINE = re.compile(r"^[^\w\s]*\s*(?P<date>\d{4}-\d{2}-\d{2})：(?P<weather>[^，]+)，(?P<temp_min>-?\d+)°C ~ (?P<temp_max>-?\d+)°C$")
+_FIELD_LINE = re.compile(r"^[^\w\s]*\s*(?P<label>天气|温度|湿度|风力|降水概率)：(?P<value>.+)$")
+_TEMPERATURE = re.compile(r"(-?\d+)°C ~ (-?\d+)°C")
+_NUMBER = re.compile(r"-?\d+")
+
+
+def life_advice(weather: str, temp_max: int, temp_min: int, rain_prob: Optional[int] = None) -> str:
+    """按 formatter 的生活建议规则生成建议"""
+    tips = []
+    if "雨" in weather or (rain_prob is not None and rain_prob > 60):
+        tips.append("可能有降水，出门记得带伞")
+    if temp_max > 28:
+        tips.append("气温较高，请注意防暑降温，穿着轻便的衣物")
+    if temp_min < 10:
+        tips.append("气温较低，请注意保暖添衣")
+    if "晴" in weather:
+        tips.append("天气晴朗，适合户外活动")
+    elif "云" in weather or "阴" in weather:
+        tips.append("适宜出行，注意天气变化")
+    return "，".join(tips or ["天气适宜"]) + "。希望你有个愉快的一天！"
+
+
+def _day_lines(day: Dict[str, Any]) -> List[str]:
+    lines = [
+        f"🌤️ 天气：{day['weather']}",
+        f"🌡️ 温度：{day['temp_min']}°C ~ {day['temp_max']}°C",
+    ]
+    # 文本格式的多日预报只有天气和温度
+    if day.get("humidity") is not None:
+        lines.append(f"💧 湿度：{day['humidity']}%")
+    if day.get("wind_level") is not None:
+        lines.append(f"💨 风力：{day['wind_level']}级")
+    if day.get("rain_prob") is not None:
+        lines.append(f"🌧️ 降水概率：{day['rain_prob']}%")
+    return lines
+
+
+def render_report(report: Dict[str, Any]) -> str:
+    """渲染单个城市的天气：单日使用 formatter 模板，多日逐日列出后给出整体建议"""
+    city = report["city"]
+    if report.get("error"):
+        error = report["error"]
+        return f"❌ {error}" if not city or city in error else f"❌ {city}：{error}"
+    days = report["days"]
+    if not days:
+        return f"❌ 没有{city}的天气数据"
+    if len(days) == 1:
+        day = days[0]
+        lines = [f"{city}的天气情况如下：", ""] + _day_lines(day)
+        advice = life_advice(day["weather"], day["temp_max"], day["temp_min"], day.get("rain_prob"))
+    else:
+        lines = [f"{city}未来{len(days)}天的天气情况如下："]
+        for day in days:
+            lines += ["", f"📅 {day['date']}"] + _day_lines(day)
+        rain_probs = [day["rain_prob"] for day in days if day.get("rain_prob") is not None]
+        advice = life_advice(
+            "、".join(dict.fromkeys(day["weather"] for day in days)),
+            max(day["temp_max"] for day in days),
+            min(day["temp_min"] for day in days),
+            max(rain_probs) if rain_probs else None,
+        )
+    return "\n".join(lines + ["", f"生活建议：{advice}"])
+
+
+def render_weather(reports: Sequence[Dict[str, Any]]) -> str:
+    """渲染一个或多个城市的天气"""
+    return "\n\n".join(render_report(report) for report in reports)
+
+
+def _reports_from_payload(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """天气工具 JSON 输出转换为报告列表；坐标、IP 定位等其他工具的输出返回空列表"""
+    if isinstance(payload.get("results"), list) and "horizon" in payload:
+        return [report for item in payload["results"] for report in _reports_from_payload(item)]
+    if "city" not in payload:
+        return []
+    if "error" in payload:
+        return [{"city": payload["city"], "error": payload["error"]}]
+    if isinstance(payload.get("days"), list):
+        return [{"city": payload["city"], "days": payload["days"]}]
+    if "date" in payload and "temp_max" in payload:
+        return [{"city": payload["city"], "days": [payload]}]
+    return []
+
+
+def _reports_from_text(text: str) -> List[Dict[str, Any]]:
+    """解析天气工具的文本输出（单日详情块、多日预报块和 ❌ 错误行）"""
+    reports = []
+    for block in re.split(r"\n\s*\n", text.strip()):
+        lines = [line.strip() for line in block.strip().splitlines() if line.strip()]
+        if not lines:
+            continue
+        header = _DAY_HEADER.match(lines[0])
+        if header:
+            day = {"date": header["date"]}
+            for line in lines[1:]:
+                field = _FIELD_LINE.match(line)
+                if not field:
+                    continue
+                label, value = field["label"], field["value"]
+                if label == "天气":
+                    day["weather"] = value
+                elif label == "温度":
+                    temperature = _TEMPERATURE.search(value)
+                    if temperature:
+                        day["temp_min"], day["temp_max"] = int(temperature[1]), int(temperature[2])
+                else:
+                    number = _NUMBER.search(value)
+                    if number:
+                        key = {"湿度": "humidity", "风力": "wind_level", "降水概率": "rain_prob"}[label]
+                        day[key] = int(number[0])
+            if {"weather", "temp_min", "temp_max"} <= day.keys():
+                reports.append({"city": header["city"], "days": [day]})
+            continue
+        header = _FUTURE_HEADER.match(lines[0])
+        if header:
+            days = [
+                {"date": m["date"], "weather": m["weather"], "temp_min": int(m["temp_min"]), "temp_max": int(m["temp_max"])}
+                for m in map(_FUTURE_LINE.match, lines[1:]) if m
+            ]
+            reports.append({"city": header["city"], "days": days})
+            continue
+        if lines[0].startswith("❌"):
+            # 批量查询中的单城市错误，形如 "❌ 火星市：查询失败: ..."
+            error = lines[0].lstrip("❌ ")
+            reports.append({"city": error.partition("：")[0] if "：" in error else "", "error": error})
+    return reports
+
+
+def _tool_texts(content: str) -> List[str]:
+    """拆出 MCP 工具结果中的文本
+
+    AutoGen 的 MCP 适配器把每次调用的结果序列化为一行 [{"type": "text", "text": ...}]，
+    多次调用的结果按行拼接；无法识别时按原文处理。
+    """
+    texts = []
+    for line in content.splitlines():
+        line = line.strip()
+        if not line.startswith("["):
+            continue
+        try:
+            items = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(items, list):
+            texts += [item["text"] for item in items if isinstance(item, dict) and isinstance(item.get("text"), str)]
+    return texts or [content]
+
+
+def parse_weather_result(content: str) -> List[Dict[str, Any]]:
+    """从工具输出中解析天气报告，兼容 JSON（output_format="json"）和文本两种格式"""
+    reports = []
+    for text in _tool_texts(content):
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict):
+            reports += _reports_from_payload(payload)
+        else:
+            reports += _reports_from_text(text)
+    return reports
+
+
+def _tool_outputs(message: BaseChatMessage) -> Iterable[str]:
+    """消息中携带的工具调用结果"""
+    if isinstance(message, ToolCallSummaryMessage):
+        yield message.content
+    elif isinstance(message, HandoffMessage):
+        for item in message.context:
+            if isinstance(item, FunctionExecutionResultMessage):
+                for result in item.content:
+                    yield result.content
+
+
+class TemplateFormatterAgent(BaseChatAgent):
+    """按固定模板渲染天气结果的 formatter，不调用大模型
+
+    从收到的消息中找到最近一次天气工具的调用结果并渲染；设置 handoff_target 时以交接消息
+    回复（Swarm 模式交接回用户即结束协作）。
+    """
+
+    def __init__(
+        self,
+        name: str = "formatter",
+        description: str = "按固定模板美化天气查询结果并提供生活建议（无需调用大模型）",
+        handoff_target: Optional[str] = None,
+    ):
+        super().__init__(name=name, description=description)
+        self.handoff_target = handoff_target
+        self._history: List[BaseChatMessage] = []
+
+    @property
+    def produced_message_types(self) -> Sequence[type[BaseChatMessage]]:
+        return (HandoffMessage,) if self.handoff_target else (TextMessage,)
+
+    def render(self) -> Optional[str]:
+        """渲染最近一次天气工具结果（工具报错时给出错误）；没有天气数据时返回 None"""
+        for message in reversed(self._history):
+            for output in reversed(list(_tool_outputs(message))):
+                reports = parse_weather_result(output)
+                if reports:
+                    return render_weather(reports)
+        return None
+
+    async def on_messages(self, messages: Sequence[BaseChatMessage], cancellation_token: CancellationToken) -> Response:
+        self._history.extend(messages)
+        content = self.render()
+        metadata = dict(RENDERER_METADATA) if content is not None else {}
+        if content is None:
+            content = "❌ 未获取到天气数据，请先查询天气"
+        if self.handoff_target:
+            return Response(chat_message=HandoffMessage(
+                content=content, target=self.handoff_target, source=self.name, metadata=metadata
+            ))
+        return Response(chat_message=TextMessage(content=content, source=self.name, metadata=metadata))
+
+    async def on_reset(self, cancellation_token: CancellationToken) -> None:
+        self._history.clear()
+
+
+def rendered_termination() -> FunctionalTermination:
+    """模板 formatter 成功渲染后终止协作"""
+    def rendered(messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> bool:
+        return any(
+            isinstance(message, BaseChatMessage) and message.metadata == RENDERER_METADATA
+            for message in messages
+        )
+    return FunctionalTermination(rendered)
@@ -7,25 +7,8 @@
 import asyncio
 from autogen_agentchat.agents import AssistantAgent
 from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_ext.tools.mcp import StdioServerParams, mcp_server_tools
-
-# 全局 MCP 工具缓存
-_mcp_tools = None
-
-async def get_weather_mcp_tools():
-    """获取天气 MCP 工具"""
-    global _mcp_tools
-    if _mcp_tools is None:
-        # 配置 MCP 服务器参数
-        weather_mcp_server = StdioServerParams(
-            command="python",
-            args=["mcp_server/weather_mcp_server.py"]
-        )
-        
-        # 获取 MCP 工具
-        _mcp_tools = await mcp_server_tools(weather_mcp_server)
-    
-    return _mcp_tools
+from ..common.mcp_tools import get_weather_mcp_tools
+from ..common.weather_renderer import TemplateFormatterAgent
 
 async def create_intent_parser_agent(model_client: OpenAIChatCompletionClient) -> AssistantAgent:
     """创建意图解析代理 - Magentic-One 版本，负责意图解析和IP定位"""
@@ -91,7 +74,7 @@ async def create_weather_query_agent(model_client: OpenAIChatCompletionClient) -
 2. **立即查询天气**：根据时间选择对应工具
    - "today" → query_weather_today(城市名)
    - "tomorrow" → query_weather_tomorrow(城市名)
-   - "future" → query_weather_future_days(城市名, days=3)
+   - "future" → query_weather_future_days(城市名, days=天数)（意图中没有"天数"时默认3天）
 3. **返回原始数据**：直接返回API获取的天气数据
 
 **📝 执行示例：**
@@ -167,6 +150,14 @@ def create_response_formatter_agent(model_client: OpenAIChatCompletionClient) ->
     )
 
 
+def create_template_formatter_agent() -> TemplateFormatterAgent:
+    """创建模板格式化代理 - Magentic-One 版本，按固定模板渲染天气原始数据"""
+    return TemplateFormatterAgent(
+        name="formatter",
+        description="最终必需步骤：将天气原始数据按固定模板转换为用户友好格式（模板渲染，无需大模型）"
+    )
+
+
 async def create_simple_weather_agent(model_client: OpenAIChatCompletionClient) -> AssistantAgent:
     """创建简单的一体化天气代理（单代理模式，使用 MCP 工具）"""
     mcp_tools = await get_weather_mcp_tools()
@@ -8,54 +8,105 @@ from dotenv import load_dotenv
 from autogen_agentchat.teams import MagenticOneGroupChat
 from autogen_agentchat.conditions import MaxMessageTermination, TextMentionTermination
 from autogen_agentchat.ui import Console
+from autogen_agentchat.messages import TextMessage
 from autogen_ext.models.openai import OpenAIChatCompletionClient
 from .weather_agents import (
     create_intent_parser_agent,
     create_weather_query_agent,
-    create_response_formatter_agent
+    create_response_formatter_agent,
+    create_template_formatter_agent
 )
+from ..common.weather_renderer import rendered_termination
+from ..common.intent_parser import LocalIntentParser
+from ..common.query_pool import QueryPoolMixin
 
 # 加载环境变量 - 按优先级加载
 load_dotenv(".env.local")  # 优先加载本地配置
 load_dotenv()  # 兜底加载默认配置
 
 
-class WeatherAgentTeam:
+class WeatherAgentTeam(QueryPoolMixin):
     """天气查询智能体群组 - Magentic-One 协作系统"""
     
-    def __init__(self, model_name: str = None, verbose: bool = True):
-        # 检查 OpenAI API Key
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key:
-            raise ValueError("❌ 未设置 OPENAI_API_KEY 环境变量，请在 .env 文件中配置")
-        
-        # 使用传入的模型名称，否则从环境变量获取，最后使用默认值
-        model_name = model_name or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    def __init__(self, model_name: str = None, verbose: bool = True, template_formatter: bool = None,
+                 fast_intent: bool = None, model_client: OpenAIChatCompletionClient = None):
+        # 传入 model_client 时共用该客户端（并发查询的团队副本），关闭时不关闭它
+        self._owns_model_client = model_client is None
+        if model_client is None:
+            # 检查 OpenAI API Key
+            openai_api_key = os.getenv("OPENAI_API_KEY")
+            if not openai_api_key:
+                raise ValueError("❌ 未设置 OPENAI_API_KEY 环境变量，请在 .env 文件中配置")
             
-        self.model_client = OpenAIChatCompletionClient(
-            model=model_name,
-            api_key=openai_api_key
-        )
+            # 使用传入的模型名称，否则从环境变量获取，最后使用默认值
+            model_name = model_name or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+                
+            model_client = OpenAIChatCompletionClient(
+                model=model_name,
+                api_key=openai_api_key
+            )
+        self.model_client = model_client
         self.intent_parser = None
         self.weather_agent = None
         self.formatter = None
         self.magentic_team = None
+        self.magentic_fast_team = None
         self.verbose = verbose
+        # 使用模板渲染代替 LLM formatter：未指定时读取 WEATHER_TEMPLATE_FORMATTER 环境变量
+        if template_formatter is None:
+            template_formatter = os.getenv("WEATHER_TEMPLATE_FORMATTER", "false").lower() == "true"
+        self.template_formatter = template_formatter
+        # 本地规则解析常见查询，跳过 LLM 意图解析：未指定时读取 WEATHER_FAST_INTENT 环境变量
+        if fast_intent is None:
+            fast_intent = os.getenv("WEATHER_FAST_INTENT", "true").lower() == "true"
+        self.local_intent_parser = LocalIntentParser() if fast_intent else None
+        # 运行过查询、下一条查询前需要清空对话状态的团队
+        self._used_teams = []
+        # query_many 使用的团队副本
+        self._replicas = []
         
     async def initialize(self, show_init_message=True):
         """初始化所有代理和 Magentic-One 团队"""
         
         self.intent_parser = await create_intent_parser_agent(self.model_client)
         self.weather_agent = await create_weather_query_agent(self.model_client)
-        self.formatter = create_response_formatter_agent(self.model_client)
+        if self.template_formatter:
+            self.formatter = create_template_formatter_agent()
+        else:
+            self.formatter = create_response_formatter_agent(self.model_client)
       
-        termination = MaxMessageTermination(max_messages=20) | TextMentionTermination("查询完成")
-        
         self.magentic_team = MagenticOneGroupChat(
             participants=[self.intent_parser, self.weather_agent, self.formatter],
             model_client=self.model_client,
-            termination_condition=termination
+            termination_condition=self._create_termination_condition()
         )
+        # 本地已解析出意图的查询使用不含意图解析代理的团队，编排器无需再安排意图解析
+        self.magentic_fast_team = MagenticOneGroupChat(
+            participants=[self.weather_agent, self.formatter],
+            model_client=self.model_client,
+            termination_condition=self._create_termination_condition()
+        )
+    
+    def _create_termination_condition(self):
+        """创建终止条件"""
+        termination = MaxMessageTermination(max_messages=20) | TextMentionTermination("查询完成")
+        if self.template_formatter:
+            # 模板 formatter 成功渲染后即结束，没有数据时交回编排器继续安排查询
+            termination = termination | rendered_termination()
+        return termination
+    
+    async def reset(self):
+        """清空上一条查询的对话状态（团队消息线程、各代理的模型上下文），复用已创建的代理和团队"""
+        while self._used_teams:
+            await self._used_teams.pop().reset()
+    
+    def _build_task(self, user_input: str):
+        """本地能解析出意图时返回 (结构化意图消息, 不含意图解析代理的团队)，否则返回 (原始查询, 完整团队)"""
+        intent = self.local_intent_parser.parse(user_input) if self.local_intent_parser else None
+        if intent is None:
+            return user_input, self.magentic_team
+        task = TextMessage(content=intent.to_text(), source="user", metadata={"intent": "local"})
+        return task, self.magentic_fast_team
     
     async def query(self, user_input: str, show_process: bool = None) -> str:
         """执行天气查询"""
@@ -66,13 +117,20 @@ class WeatherAgentTeam:
         if show_process is None:
             show_process = False
             
+        # 每条查询相互独立，不延续上一条查询的对话
+        await self.reset()
+        task, team = self._build_task(user_input)
+        self._used_teams.append(team)
+        
         if show_process:
             print(f"\n{'='*60}")
             print(f"🗣️ 用户查询：{user_input}")
+            if team is self.magentic_fast_team:
+                print("⚡ 本地意图解析命中，跳过 intent_parser")
             print(f"{'='*60}")
             
             # 流式显示 Magentic-One 协作过程
-            stream = self.magentic_team.run_stream(task=user_input)
+            stream = team.run_stream(task=task)
             result = await Console(stream)
             
             print(f"\n{'='*60}")
@@ -84,12 +142,29 @@ class WeatherAgentTeam:
             return final_message
         else:
             # 静默模式
-            result = await self.magentic_team.run(task=user_input)
+            result = await team.run(task=task)
             return result.messages[-1].content if result.messages else "Magentic-One 协作查询失败"
     
     
+    async def _ensure_initialized(self):
+        """团队尚未初始化时先初始化（供 query_many 使用）"""
+        if not self.magentic_team:
+            await self.initialize(show_init_message=False)
+    
+    async def _create_replica(self) -> "WeatherAgentTeam":
+        """创建共用模型客户端和 MCP 工具的团队副本（供 query_many 使用）"""
+        replica = WeatherAgentTeam(
+            verbose=self.verbose,
+            template_formatter=self.template_formatter,
+            fast_intent=self.local_intent_parser is not None,
+            model_client=self.model_client,
+        )
+        await replica.initialize(show_init_message=False)
+        return replica
+    
     async def close(self):
         """关闭资源"""
-        if self.model_client:
+        await self._close_replicas()
+        if self.model_client and self._owns_model_client:
             await self.model_client.close()
             print("🔒 Magentic-One 智能体群组资源已释放")
\ No newline at end of file
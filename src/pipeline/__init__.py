@@ -0,0 +1,3 @@
+"""
+Pipeline 直连模式（无大模型）
+"""
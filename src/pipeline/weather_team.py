@@ -0,0 +1,107 @@
+"""
+直连流水线天气查询
+本地意图解析 → 进程内调用天气工具 → 模板渲染，全程不调用大模型、不启动 MCP 子进程；
+既是最快的查询路径，也是衡量多代理协作模式开销的基线
+"""
+
+import json
+import time
+from contextlib import AsyncExitStack
+from dataclasses import replace
+from typing import List, Sequence
+from dotenv import load_dotenv
+from ..common.intent_parser import LocalIntentParser, WeatherIntent
+from ..common.query_pool import QueryResult, run_query_pool
+from ..common.weather_renderer import parse_weather_result, render_weather
+
+# 加载环境变量 - 按优先级加载
+load_dotenv(".env.local")  # 优先加载本地配置
+load_dotenv()  # 兜底加载默认配置
+
+# IP 定位失败时的默认城市，与意图解析代理的约定一致
+DEFAULT_CITY = "上海"
+
+UNSUPPORTED_QUERY = "❌ 直连模式无法解析该查询，请使用「城市 + 今天/明天/未来N天」的写法，或切换到多代理协作模式"
+
+
+class WeatherPipeline:
+    """直连流水线 - 与 WeatherAgentTeam 接口一致（initialize / query / close），无需 OPENAI_API_KEY"""
+    
+    def __init__(self, verbose: bool = True):
+        self.verbose = verbose
+        self.intent_parser = LocalIntentParser()
+        self.server = None
+        self._stack = None
+    
+    async def initialize(self):
+        """在进程内加载天气 MCP 服务器模块并进入其生命周期（共享连接池、缓存预热等）"""
+        # 延迟导入：服务器模块在导入时读取 CAIYUN_API_KEY 等配置
+        from mcp_server import weather_mcp_server
+        
+        self.server = weather_mcp_server
+        self._stack = AsyncExitStack()
+        await self._stack.enter_async_context(self.server.server_lifespan(self.server.mcp))
+    
+    def _tool(self, name: str):
+        tool = getattr(self.server, name)
+        return getattr(tool, "fn", tool)
+    
+    async def _locate_city(self) -> str:
+        """没有城市名时通过 IP 定位，失败则使用默认城市"""
+        payload = json.loads(await self._tool("get_user_location_by_ip")(output_format="json"))
+        return payload.get("city") or DEFAULT_CITY
+    
+    async def _fetch(self, intent: WeatherIntent) -> str:
+        """直接调用天气工具函数，取 JSON 输出"""
+        if intent.horizon == "future":
+            return await self._tool("query_weather_future_days")(intent.city, days=intent.days, output_format="json")
+        return await self._tool(f"query_weather_{intent.horizon}")(intent.city, output_format="json")
+    
+    async def query(self, user_input: str, show_process: bool = None) -> str:
+        """执行天气查询"""
+        if self.server is None:
+            await self.initialize()
+        
+        started = time.perf_counter()
+        intent = self.intent_parser.parse(user_input, allow_missing_city=True)
+        if intent is None:
+            return UNSUPPORTED_QUERY
+        if not intent.city:
+            intent = replace(intent, city=await self._locate_city())
+        parsed = time.perf_counter()
+        
+        content = await self._fetch(intent)
+        fetched = time.perf_counter()
+        
+        reports = parse_weather_result(content)
+        result = render_weather(reports) if reports else content
+        rendered = time.perf_counter()
+        
+        if show_process:
+            print(f"\n{'='*60}")
+            print(f"🗣️ 用户查询：{user_input}")
+            print(f"🧭 意图解析：{intent.describe()}（{(parsed - started) * 1000:.1f}ms）")
+            print(f"🌤️ 天气数据：{(fetched - parsed) * 1000:.1f}ms")
+            print(f"✨ 模板渲染：{(rendered - fetched) * 1000:.1f}ms")
+            print(f"⚡ 直连流水线完成，总耗时 {(rendered - started) * 1000:.1f}ms")
+            print(f"{'='*60}")
+        return result
+    
+    async def query_many(self, inputs: Sequence[str], concurrency: int = 4) -> List[QueryResult]:
+        """并发执行多条查询，结果按输入顺序返回，每条结果附带耗时
+
+        流水线没有对话状态，同一个实例即可同时处理 concurrency 条查询。
+        """
+        if concurrency < 1:
+            raise ValueError("并发数至少为 1")
+        if self.server is None:
+            await self.initialize()
+        return await run_query_pool([self] * min(concurrency, max(len(inputs), 1)), inputs)
+    
+    async def close(self):
+        """关闭资源"""
+        if self._stack is not None:
+            await self._stack.aclose()
+            self._stack = None
+            self.server = None
+            print("🔒 直连流水线资源已释放")
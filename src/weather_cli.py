@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 通用天气查询CLI
-支持三种协作模式：selector_groupchat, swarm, magentic_one
+支持三种协作模式：selector_groupchat, swarm, magentic_one，以及无需大模型的 pipeline 直连模式
 隐藏复杂的多代理协作日志，只显示关键步骤和结果
 """
 
@@ -20,10 +20,11 @@ def choose_mode():
     print("1. selector_groupchat - 集中式选择器协作模式")
     print("2. swarm - 去中心化 handoff 协作模式") 
     print("3. magentic_one - 智能自动化团队协作模式 (默认)")
+    print("4. pipeline - 直连流水线模式（无需大模型，评测基线）")
     
     while True:
         try:
-            choice = input("\n请选择模式 (1-3, 默认3): ").strip()
+            choice = input("\n请选择模式 (1-4, 默认3): ").strip()
             if choice == "" or choice == "3":
                 mode = "magentic_one"
                 break
@@ -33,8 +34,11 @@ def choose_mode():
             elif choice == "2":
                 mode = "swarm"
                 break
+            elif choice == "4":
+                mode = "pipeline"
+                break
             else:
-                print("❌ 无效选择，请输入 1、2、3 或直接回车选择默认模式")
+                print("❌ 无效选择，请输入 1、2、3、4 或直接回车选择默认模式")
                 continue
         except KeyboardInterrupt:
             print("\n👋 再见！")
@@ -91,18 +95,20 @@ class SimpleWeatherCLI:
     def _get_team_class(self):
         """动态导入对应模式的WeatherAgentTeam"""
         try:
-            # 添加当前目录到Python路径
+            # 添加项目根目录到Python路径（各模式通过 src.common 共享组件）
             import os
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            if current_dir not in sys.path:
-                sys.path.insert(0, current_dir)
+            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            if project_root not in sys.path:
+                sys.path.insert(0, project_root)
             
             if self.mode == "selector_groupchat":
-                from selector_groupchat.weather_team import WeatherAgentTeam
+                from src.selector_groupchat.weather_team import WeatherAgentTeam
             elif self.mode == "swarm":
-                from swarm.weather_team import WeatherAgentTeam
+                from src.swarm.weather_team import WeatherAgentTeam
             elif self.mode == "magentic_one":
-                from magentic_one.weather_team import WeatherAgentTeam
+                from src.magentic_one.weather_team import WeatherAgentTeam
+            elif self.mode == "pipeline":
+                from src.pipeline.weather_team import WeatherPipeline as WeatherAgentTeam
             else:
                 raise ValueError(f"未知的协作模式: {self.mode}")
             return WeatherAgentTeam
@@ -115,7 +121,8 @@ class SimpleWeatherCLI:
         mode_names = {
             "selector_groupchat": "SelectorGroupChat 集中式选择器",
             "swarm": "Swarm 去中心化 handoff", 
-            "magentic_one": "Magentic-One 智能自动化"
+            "magentic_one": "Magentic-One 智能自动化",
+            "pipeline": "Pipeline 直连流水线（无大模型）"
         }
         
         print("🤖 初始化天气查询系统...")
@@ -220,6 +227,9 @@ class SimpleWeatherCLI:
         """关闭系统"""
         if self.team:
             await self.team.close()
+            # 关闭各团队共用的天气 MCP 会话（会话池中的子进程或远程连接）
+            from src.common.mcp_tools import close_weather_mcp_tools
+            await close_weather_mcp_tools()
 
 async def main():
     """主函数"""
@@ -5,13 +5,278 @@ API层测试 - 测试高德地图API和彩云天气API的基础功能
 
 import pytest
 import pytest_asyncio
+import asyncio
+import json
 import sys
 import os
+import struct
+import time
+from urllib.parse import urlsplit, parse_qs
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+# 测试使用内存地理编码缓存，避免读写用户缓存目录中上次运行留下的结果
+os.environ["GEOCODE_CACHE_PATH"] = ":memory:"
+
 from mcp_server.weather_mcp_server import AmapGeocoder, WeatherAPI
+from mcp_server.http_clients import HttpClientPool
+from mcp_server.forecast_cache import ForecastCache
+from mcp_server.singleflight import SingleFlight
+from mcp_server.geocode_store import GeocodeStore
+from mcp_server.prewarm import PrewarmScheduler
+from mcp_server.city_index import BUILTIN_CITIES, CityIndex, normalize_name
+from mcp_server.gazetteer import Gazetteer, build as build_gazetteer, load_gazetteer
+from mcp_server import spatial
+from mcp_server.spatial import SpatialIndex, haversine_km
+from mcp_server.ip_location import CachedIPLocator, IpapiProvider, IPLocation, IPLocationProvider, MmdbProvider
+from mcp_server.mmdb import MmdbReader, InvalidDatabaseError
+from mcp_server.rate_limit import (
+    CircuitBreaker, CircuitOpenError, TokenBucket, UpstreamGuard, parse_retry_after
+)
+
+
+class StubUpstream:
+    """本地桩服务器 - 模拟彩云天气和高德地图接口（HTTP/1.1 keep-alive）"""
+    
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.unknown_addresses = set()
+        self.ip_location = {}  # /json/ 路径返回的 ipapi.co 格式定位结果
+        self.scripted = []  # 依次返回的 (状态码, 响应头)，用完后恢复正常响应
+        self.requests = []
+        self.connections = 0
+        self.writers = set()
+        self.active = 0
+        self.max_active = 0
+        self.server = None
+        self.url = ""
+    
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        host, port = self.server.sockets[0].getsockname()[:2]
+        self.url = f"http://{host}:{port}"
+        return self
+    
+    async def stop(self):
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+    
+    def respond(self, path: str, query: dict) -> tuple[int, dict, dict]:
+        """根据请求路径生成响应：(状态码, 额外响应头, JSON体)"""
+        if self.scripted:
+            status, headers = self.scripted.pop(0)
+            return status, headers, {"status": "failed"}
+        if path.startswith("/json"):
+            return 200, {}, self.ip_location
+        if path.startswith("/geo"):
+            address = query.get("address", [""])[0]
+            if query.get("batch", ["false"])[0] == "true":
+                addresses = address.split("|")
+                return 200, {}, {
+                    "status": "1",
+                    "count": str(len(addresses)),
+                    "geocodes": [
+                        {"formatted_address": a, "location": [] if a in self.unknown_addresses else f"{100 + i}.0,{20 + i}.0"}
+                        for i, a in enumerate(addresses)
+                    ],
+                }
+            if address in self.unknown_addresses:
+                return 200, {}, {"status": "1", "count": "0", "geocodes": []}
+            return 200, {}, {
+                "status": "1",
+                "count": "1",
+                "geocodes": [{"formatted_address": address, "location": "116.4074,39.9042"}],
+            }
+        steps = int(query.get("dailysteps", ["1"])[0])
+        return 200, {}, make_daily_payload(steps)
+    
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self.writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                target = request_line.decode().split(" ")[1]
+                parts = urlsplit(target)
+                self.requests.append(target)
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                try:
+                    if self.delay:
+                        await asyncio.sleep(self.delay)
+                    status, headers, payload = self.respond(parts.path, parse_qs(parts.query))
+                finally:
+                    self.active -= 1
+                body = json.dumps(payload).encode()
+                head = f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                head += "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+                writer.write(head.encode() + b"\r\n" + body)
+                await writer.drain()
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+
+def make_daily_payload(steps: int, server_time: int = None) -> dict:
+    """构造彩云天气 daily 接口格式的模拟数据"""
+    server_time = server_time or int(time.time())
+    dates = [f"2025-06-{27 + i:02d}T00:00+08:00" for i in range(steps)]
+    return {
+        "status": "ok",
+        "server_time": server_time,
+        "result": {
+            "daily": {
+                "temperature": [{"date": d, "max": 31.0 + i, "min": 23.0 + i} for i, d in enumerate(dates)],
+                "skycon": [{"date": d, "value": "PARTLY_CLOUDY_DAY"} for d in dates],
+                "precipitation": [{"date": d, "probability": 0.1} for d in dates],
+                "humidity": [{"date": d, "avg": 0.53} for d in dates],
+                "wind": [{"date": d, "avg": {"speed": 10.2, "direction": 90}} for d in dates],
+            }
+        },
+    }
+
+
+@pytest_asyncio.fixture
+async def stub_upstream():
+    """本地桩服务器实例"""
+    stub = await StubUpstream().start()
+    yield stub
+    await stub.stop()
+
+
+def geonames_row(geonameid: int, name: str, lat: float, lon: float, country: str = "CN",
+                 population: int = 0, alternates: str = "", feature_class: str = "P") -> str:
+    """生成一行 GeoNames 格式的记录"""
+    cols = [str(geonameid), name, name, alternates, str(lat), str(lon), feature_class, "PPL", country,
+            "", "", "", "", "", str(population), "", "0", "Asia/Shanghai", "2024-01-01"]
+    return "\t".join(cols) + "\n"
+
+
+def encode_mmdb_value(value) -> bytes:
+    """按 MaxMind DB 数据段格式编码（测试用，支持 map/array/字符串/double/无符号整数/布尔）"""
+    def control(kind: int, size: int) -> bytes:
+        if size < 29:
+            head, extra = size, b""
+        elif size < 285:
+            head, extra = 29, bytes([size - 29])
+        else:
+            head, extra = 30, (size - 285).to_bytes(2, "big")
+        if kind <= 7:
+            return bytes([(kind << 5) | head]) + extra
+        return bytes([head, kind - 7]) + extra
+    
+    if isinstance(value, bool):
+        return control(14, int(value))
+    if isinstance(value, str):
+        raw = value.encode("utf-8")
+        return control(2, len(raw)) + raw
+    if isinstance(value, float):
+        return control(3, 8) + struct.pack(">d", value)
+    if isinstance(value, int):
+        raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+        return control(6, len(raw)) + raw
+    if isinstance(value, dict):
+        return control(7, len(value)) + b"".join(encode_mmdb_value(k) + encode_mmdb_value(v) for k, v in value.items())
+    if isinstance(value, list):
+        return control(11, len(value)) + b"".join(encode_mmdb_value(v) for v in value)
+    raise TypeError(value)
+
+
+def write_mmdb(path, networks: dict, ip_version: int = 6, record_size: int = 28):
+    """生成最小的 MaxMind DB 文件：networks 为 {CIDR: 记录}"""
+    import ipaddress
+    nodes = [[None, None]]
+    data, offsets = b"", []
+    for cidr, record in networks.items():
+        network = ipaddress.ip_network(cidr)
+        bits = network.prefixlen
+        value = int(network.network_address)
+        if ip_version == 6 and network.version == 4:
+            bits += 96
+        total = 32 if ip_version == 4 else 128
+        node = 0
+        for depth in range(bits):
+            bit = (value >> (total - 1 - depth)) & 1
+            if depth == bits - 1:
+                nodes[node][bit] = ("data", len(offsets))
+            else:
+                if nodes[node][bit] is None:
+                    nodes.append([None, None])
+                    nodes[node][bit] = len(nodes) - 1
+                node = nodes[node][bit]
+        offsets.append(len(data))
+        data += encode_mmdb_value(record)
+    
+    node_count = len(nodes)
+    
+    def resolve(slot):
+        if slot is None:
+            return node_count
+        if isinstance(slot, tuple):
+            return node_count + 16 + offsets[slot[1]]
+        return slot
+    
+    tree = b""
+    for left, right in nodes:
+        left, right = resolve(left), resolve(right)
+        if record_size == 24:
+            tree += left.to_bytes(3, "big") + right.to_bytes(3, "big")
+        elif record_size == 28:
+            tree += (left & 0xFFFFFF).to_bytes(3, "big") + bytes([((left >> 24) << 4) | (right >> 24)]) + (right & 0xFFFFFF).to_bytes(3, "big")
+        else:
+            tree += left.to_bytes(4, "big") + right.to_bytes(4, "big")
+    metadata = {
+        "node_count": node_count, "record_size": record_size, "ip_version": ip_version,
+        "database_type": "GeoLite2-City", "binary_format_major_version": 2, "binary_format_minor_version": 0,
+    }
+    with open(path, "wb") as f:
+        f.write(tree + b"\0" * 16 + data + b"\xab\xcd\xefMaxMind.com" + encode_mmdb_value(metadata))
+
+
+GEOIP_BEIJING = {
+    "city": {"names": {"en": "Beijing", "zh-CN": "北京"}},
+    "country": {"iso_code": "CN", "names": {"en": "China", "zh-CN": "中国"}},
+    "location": {"latitude": 39.9075, "longitude": 116.3972},
+    "subdivisions": [{"names": {"en": "Beijing", "zh-CN": "北京市"}}],
+}
+GEOIP_SANYA = {
+    "city": {"names": {"en": "Sanya"}},
+    "country": {"iso_code": "CN", "names": {"en": "China"}},
+    "location": {"latitude": 18.25, "longitude": 109.51},
+}
+
+
+def make_stub_guard(max_retries: int = 2, failure_threshold: int = 5, reset_timeout: float = 30.0) -> UpstreamGuard:
+    """不限流、快速退避的上游保护策略"""
+    return UpstreamGuard(
+        "桩服务器",
+        TokenBucket(0),
+        CircuitBreaker("桩服务器", failure_threshold, reset_timeout),
+        max_retries=max_retries,
+        backoff_base=0.01,
+        backoff_max=0.5,
+    )
+
+
+def make_stub_api(stub: StubUpstream, http: HttpClientPool = None, guard: UpstreamGuard = None) -> WeatherAPI:
+    """构造指向本地桩服务器的 WeatherAPI"""
+    http = http or HttpClientPool()
+    geocoder = AmapGeocoder(http, store=GeocodeStore(":memory:"), guard=make_stub_guard())
+    geocoder.api_key = "stub"
+    geocoder.base_url = f"{stub.url}/geo"
+    api = WeatherAPI(geocoder, http, guard=guard or make_stub_guard())
+    api.api_key = "stub"
+    api.base_url = stub.url
+    return api
 
 class TestAmapAPI:
     """高德地图API测试"""
@@ -162,6 +427,992 @@ class TestAPIIntegration:
         assert data.get("status") == "ok", f"使用坐标查询{city}天气失败"
     
 
+class TestForecastCache:
+    """天气预报缓存测试（本地桩服务器，不消耗 API 配额）"""
+    
+    @pytest.mark.asyncio
+    async def test_repeat_query_served_from_cache(self, stub_upstream):
+        """相同城市重复查询只调用一次上游"""
+        api = make_stub_api(stub_upstream)
+        
+        first = await api.get_daily_weather("北京", days=3)
+        second = await api.get_daily_weather("北京", days=3)
+        
+        assert first == second
+        assert len(stub_upstream.requests) == 1
+        stats = api.forecast_cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_shorter_horizon_served_from_longer_entry(self, stub_upstream):
+        """2天的请求可以由已缓存的15天响应满足"""
+        api = make_stub_api(stub_upstream)
+        
+        await api.get_daily_weather("北京", days=15)
+        data = await api.get_daily_weather("北京", days=2)
+        
+        assert len(stub_upstream.requests) == 1
+        assert len(data["result"]["daily"]["temperature"]) >= 2
+    
+    @pytest.mark.asyncio
+    async def test_all_horizons_share_one_upstream_request(self, stub_upstream):
+        """今天、明天、未来N天共享同一次15天请求，并按天数切片"""
+        api = make_stub_api(stub_upstream)
+        
+        today = await api.get_daily_weather("北京", days=1)
+        tomorrow = await api.get_daily_weather("北京", days=2)
+        future = await api.get_daily_weather("北京", days=7)
+        
+        assert len(stub_upstream.requests) == 1
+        assert "dailysteps=15" in stub_upstream.requests[0]
+        assert len(today["result"]["daily"]["temperature"]) == 1
+        assert len(tomorrow["result"]["daily"]["skycon"]) == 2
+        assert len(future["result"]["daily"]["wind"]) == 7
+        
+        # 切片不能修改缓存中的完整数据
+        full = await api.get_daily_weather("北京", days=15)
+        assert len(full["result"]["daily"]["temperature"]) == 15
+    
+    @staticmethod
+    def _stale_api(stub, swr: bool = True):
+        """构造带可控时钟的 WeatherAPI，并预置一条15天缓存"""
+        now = [time.time()]
+        api = make_stub_api(stub)
+        api.forecast_cache = ForecastCache(ttl=60, max_stale=600, clock=lambda: now[0])
+        api.stale_while_revalidate = swr
+        old = make_daily_payload(15, server_time=int(now[0]))
+        old["marker"] = "old"
+        api.forecast_cache.put(39.9042, 116.4074, 15, old)
+        return api, now
+    
+    @pytest.mark.asyncio
+    async def test_stale_entry_served_while_revalidating(self, stub_upstream):
+        """过期条目立即返回，同时后台刷新"""
+        api, now = self._stale_api(stub_upstream)
+        now[0] += 61
+        
+        data = await api.get_daily_weather("北京", days=1)
+        assert data["marker"] == "old"
+        assert len(stub_upstream.requests) == 0
+        
+        # 重复请求不会创建多个刷新任务
+        await api.get_daily_weather("北京", days=1)
+        assert len(api._revalidating) == 1
+        await asyncio.gather(*api._revalidating.values())
+        
+        assert len(stub_upstream.requests) == 1
+        fresh = await api.get_daily_weather("北京", days=1)
+        assert "marker" not in fresh
+        assert api.forecast_cache.stats()["stale_hits"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_upstream_error_falls_back_to_stale(self, stub_upstream):
+        """上游出错时回退到过期数据"""
+        api, now = self._stale_api(stub_upstream, swr=False)
+        stub_upstream.scripted = [(503, {})] * 3
+        now[0] += 61
+        
+        data = await api.get_daily_weather("北京", days=1)
+        assert data["marker"] == "old"
+        assert len(stub_upstream.requests) == 3
+    
+    @pytest.mark.asyncio
+    async def test_max_stale_is_a_hard_bound(self, stub_upstream):
+        """超过最大陈旧时间后不再返回旧数据"""
+        api, now = self._stale_api(stub_upstream, swr=False)
+        stub_upstream.scripted = [(503, {})] * 3
+        now[0] += 661
+        
+        with pytest.raises(Exception, match="天气API请求失败"):
+            await api.get_daily_weather("北京", days=1)
+        assert len(api.forecast_cache) == 0
+    
+    def test_nearby_coordinates_share_grid_cell(self):
+        """同一网格内的坐标共享缓存条目"""
+        cache = ForecastCache(grid=0.01)
+        cache.put(39.9042, 116.4074, 3, make_daily_payload(3))
+        
+        assert cache.get(39.9021, 116.4051, 3) is not None
+        assert cache.get(39.9500, 116.4074, 3) is None
+    
+    def test_snap_to_nearest_city_shares_entry(self):
+        """吸附半径内的查询共享最近城市的缓存条目"""
+        index = SpatialIndex([39.9042, 31.2304], [116.4074, 121.4737])
+        coordinates = [(39.9042, 116.4074), (31.2304, 121.4737)]
+        
+        def snap(lat, lon):
+            i, distance = index.nearest(lat, lon)
+            return coordinates[i] if distance <= 20 else None
+        
+        cache = ForecastCache(grid=0.01, snap=snap)
+        cache.put(39.95, 116.35, 3, make_daily_payload(3))
+        
+        assert cache.get(39.85, 116.45, 3) is not None   # 同样吸附到北京
+        assert cache.get(31.25, 121.45, 3) is None       # 上海
+        assert cache.get(40.50, 116.40, 3) is None       # 超出吸附半径，使用自身网格
+    
+    def test_ttl_derived_from_server_time(self):
+        """过期时间由 server_time 推算"""
+        now = [1_000_000.0]
+        cache = ForecastCache(ttl=600, clock=lambda: now[0])
+        cache.put(39.9, 116.4, 1, make_daily_payload(1, server_time=int(now[0]) - 500))
+        
+        assert cache.get(39.9, 116.4, 1) is not None
+        now[0] += 101
+        assert cache.get(39.9, 116.4, 1) is None
+        assert len(cache) == 0
+    
+    def test_lru_eviction_respects_caps(self):
+        """超出条目数或内存上限时淘汰最久未使用的条目"""
+        cache = ForecastCache(max_entries=2)
+        cache.put(10.0, 10.0, 1, make_daily_payload(1))
+        cache.put(20.0, 20.0, 1, make_daily_payload(1))
+        cache.get(10.0, 10.0, 1)
+        cache.put(30.0, 30.0, 1, make_daily_payload(1))
+        
+        assert cache.get(20.0, 20.0, 1) is None
+        assert cache.get(10.0, 10.0, 1) is not None
+        assert cache.stats()["evictions"] == 1
+        
+        entry_size = cache.stats()["bytes"] // len(cache)
+        small_cache = ForecastCache(max_bytes=entry_size * 3 // 2)
+        small_cache.put(10.0, 10.0, 1, make_daily_payload(1))
+        small_cache.put(20.0, 20.0, 1, make_daily_payload(1))
+        assert len(small_cache) == 1
+
+
+class TestHttpClientPool:
+    """共享 HTTP 客户端池测试"""
+    
+    def test_clients_closed_with_their_event_loop(self):
+        """每个事件循环各自一组客户端，事件循环退出时即使没有调用 aclose 也会关闭"""
+        pool = HttpClientPool()
+        
+        async def use():
+            client = pool.get_client("https://api.example.com/v1")
+            assert pool.get_client("https://api.example.com/v2") is client
+            return client
+        
+        first = asyncio.run(use())
+        assert first.is_closed and pool._clients == {}
+        
+        second = asyncio.run(use())
+        assert second is not first and second.is_closed
+    
+    @pytest.mark.asyncio
+    async def test_aclose_releases_current_loop_clients(self):
+        pool = HttpClientPool()
+        client = pool.get_client("https://api.example.com")
+        await pool.aclose()
+        assert client.is_closed and pool._clients == {}
+        
+        # 关闭后仍可继续使用，按需重建客户端
+        assert not pool.get_client("https://api.example.com").is_closed
+        await pool.aclose()
+
+
+class TestSingleFlight:
+    """并发请求合并测试"""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_weather_queries_hit_upstream_once(self, stub_upstream):
+        """100个并发调用方只产生1次彩云天气请求"""
+        stub_upstream.delay = 0.05
+        api = make_stub_api(stub_upstream)
+        
+        results = await asyncio.gather(*[api.get_daily_weather("北京", days=3) for _ in range(100)])
+        
+        assert len(stub_upstream.requests) == 1
+        assert all(r["status"] == "ok" for r in results)
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_geocoding_hits_upstream_once(self, stub_upstream):
+        """100个并发地理编码只产生1次高德请求"""
+        stub_upstream.delay = 0.05
+        api = make_stub_api(stub_upstream)
+        
+        results = await asyncio.gather(*[api.geocoder.get_coordinates("三亚") for _ in range(100)])
+        
+        assert len(stub_upstream.requests) == 1
+        assert len(set(results)) == 1 and results[0] is not None
+    
+    @pytest.mark.asyncio
+    async def test_errors_propagate_and_next_call_retries(self):
+        """失败结果传递给所有等待者，之后的调用重新执行"""
+        flight = SingleFlight()
+        calls = 0
+        
+        async def failing():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+        
+        results = await asyncio.gather(*[flight.do("k", failing) for _ in range(10)], return_exceptions=True)
+        assert calls == 1
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert len(flight) == 0
+        
+        with pytest.raises(RuntimeError):
+            await flight.do("k", failing)
+        assert calls == 2
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        """单个调用方被取消不影响其他等待者"""
+        flight = SingleFlight()
+        
+        async def slow():
+            await asyncio.sleep(0.05)
+            return "done"
+        
+        first = asyncio.create_task(flight.do("k", slow))
+        second = asyncio.create_task(flight.do("k", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        
+        assert await second == "done"
+
+
+class TestCityIndex:
+    """内置城市别名索引测试"""
+    
+    def test_one_record_per_city(self):
+        """每个城市只有一条记录，坐标不重复"""
+        index = CityIndex(BUILTIN_CITIES)
+        assert len(index) == len({city.name for city in index})
+        assert len(index) == len({city.coordinates for city in index})
+    
+    def test_aliases_resolve_to_same_city(self):
+        """中文、英文、拼音、后缀变体和大小写都指向同一条记录"""
+        index = CityIndex(BUILTIN_CITIES)
+        beijing = index.lookup("北京")
+        for alias in ["Beijing", "BEIJING", " beijing ", "北京市", "Peking"]:
+            assert index.lookup(alias) is beijing
+        assert index.lookup("new york").name == "纽约"
+        assert index.lookup("NewYork").name == "纽约"
+        assert index.lookup("xian").name == "西安"
+        assert index.lookup("Düsseldorf").name == "杜塞尔多夫"
+        assert index.lookup("火星") is None
+        assert index.lookup("") is None
+    
+    def test_names_take_precedence_over_pinyin(self):
+        """拼音重名时保留先登记的城市，英文名不受影响"""
+        index = CityIndex(BUILTIN_CITIES)
+        assert index.lookup("guangzhou").name == "广州"
+        assert index.lookup("Gwangju").name == "光州"
+    
+    def test_prefix_and_typo_matching(self):
+        """唯一前缀补全和拼写纠错，有歧义或名称过短时不猜测"""
+        index = CityIndex(BUILTIN_CITIES)
+        assert index.resolve("Moskow").name == "莫斯科"
+        assert index.resolve("Bejing").name == "北京"
+        assert index.resolve("Frankf").name == "法兰克福"
+        assert index.resolve("乌鲁").name == "乌鲁木齐"
+        assert index.resolve("哈尔宾").name == "哈尔滨"
+        assert index.resolve("sanfransisco").name == "旧金山"
+        assert index.resolve("San") is None          # 圣安东尼奥/圣地亚哥/旧金山...
+        assert index.resolve("Xiamn") is None        # 与 xiamen、xian 距离相同
+        assert index.resolve("北惊") is None          # 两个字不纠错
+        assert [city.name for city in index.complete("san d")] == ["圣地亚哥"]
+    
+    def test_no_guessing_for_real_places(self):
+        """完整地名、拉丁字母短前缀和相似度不足的拼写不匹配成内置城市"""
+        index = CityIndex(BUILTIN_CITIES)
+        for name in ["凤凰县", "多伦县", "Tai", "Lon", "Par", "Hebei", "Tokio", "Jilin", "Guangdong"]:
+            assert index.fuzzy_lookup(name) is None, name
+    
+    @pytest.mark.asyncio
+    async def test_geocoder_resolves_locally_without_api_key(self, stub_upstream):
+        """精确匹配不发请求；未配置高德时模糊匹配兜底"""
+        api = make_stub_api(stub_upstream)
+        assert await api.geocoder.get_coordinates("San francisco") == (37.7749, -122.4194)
+        assert stub_upstream.requests == []
+        
+        api.geocoder.api_key = ""
+        assert await api.geocoder.get_coordinates("北京市") == (39.9042, 116.4074)
+        assert await api.geocoder.get_coordinates("Moskow") == (55.7558, 37.6176)
+        assert await api.geocoder.get_coordinates("Hebei") is None
+        assert stub_upstream.requests == []
+    
+    @pytest.mark.asyncio
+    async def test_fuzzy_match_after_geocoder_miss(self, stub_upstream):
+        """模糊匹配排在缓存和高德之后：真实地名不会被猜成名字相近的内置城市"""
+        api = make_stub_api(stub_upstream)
+        amap_result = (39.9042, 116.4074)  # 桩服务器地理编码的固定结果
+        for name in ["凤凰县", "多伦县", "Hebei", "Tai", "Lon", "Par"]:
+            assert await api.geocoder.get_coordinates(name) == amap_result, name
+        assert len(stub_upstream.requests) == 6
+        
+        # 缓存命中不再请求高德
+        assert await api.geocoder.get_coordinates("Hebei") == amap_result
+        assert len(stub_upstream.requests) == 6
+        
+        # 高德查无此地时才模糊匹配，未命中结果缓存后也不再请求
+        stub_upstream.unknown_addresses.add("Moskow")
+        assert await api.geocoder.get_coordinates("Moskow") == (55.7558, 37.6176)
+        assert await api.geocoder.get_coordinates("Moskow") == (55.7558, 37.6176)
+        assert len(stub_upstream.requests) == 7
+        
+        # 批量接口同样先查高德，未匹配的地址再模糊匹配
+        stub_upstream.unknown_addresses.add("Frankf")
+        results = await api.geocoder.get_coordinates_batch(["Rom", "Frankf"])
+        assert results == {"Rom": (20.0, 100.0), "Frankf": (50.1109, 8.6821)}
+    
+    def test_normalize_name(self):
+        assert normalize_name("  San Francisco ") == "sanfrancisco"
+        assert normalize_name("朝阳区") == "朝阳"
+        assert normalize_name("Xi'an") == "xian"
+        # 两个字的地名不去后缀，避免误伤
+        assert normalize_name("沙市") == "沙市"
+
+
+class TestGazetteer:
+    """离线地名库测试"""
+    
+    def write_source(self, tmp_path):
+        source = tmp_path / "cities.txt"
+        source.write_text(
+            geonames_row(1, "Sanya", 18.24306, 109.505, population=685408, alternates="三亚,San-ya")
+            + geonames_row(2, "Springfield", 39.80172, -89.64371, "US", population=114394)
+            + geonames_row(3, "Springfield", 37.21533, -93.29824, "US", population=166810)
+            + geonames_row(4, "Guangdong", 23.0, 113.0, alternates="广东", feature_class="A"),
+            encoding="utf-8",
+        )
+        return str(source)
+    
+    def test_build_and_lookup(self, tmp_path):
+        """别名和后缀变体都能命中，重名时取人口最多的地点"""
+        target = str(tmp_path / "gazetteer.bin")
+        assert build_gazetteer(self.write_source(tmp_path), target) == 3
+        
+        gazetteer = Gazetteer(target)
+        assert len(gazetteer) == 3
+        sanya = gazetteer.lookup("三亚市")
+        assert sanya.name == "Sanya" and sanya.country_code == "CN"
+        assert sanya.coordinates == (18.24306, 109.505)
+        assert gazetteer.lookup("san ya") == sanya
+        assert gazetteer.lookup("springfield").coordinates == (37.21533, -93.29824)
+        assert gazetteer.lookup("广东") is None  # 只收录居民点
+        assert gazetteer.lookup("火星") is None
+        gazetteer.close()
+    
+    def test_load_compiles_when_source_changes(self, tmp_path):
+        """编译结果缺失或源文件更新时重新编译，无效文件不影响启动"""
+        source = self.write_source(tmp_path)
+        target = str(tmp_path / "gazetteer.bin")
+        assert load_gazetteer("", target) is None
+        assert len(load_gazetteer(source, target)) == 3
+        
+        with open(source, "a", encoding="utf-8") as f:
+            f.write(geonames_row(5, "Guilin", 25.28, 110.29, population=1000))
+        os.utime(source, (time.time() + 10, time.time() + 10))
+        assert load_gazetteer(source, target).lookup("Guilin") is not None
+        
+        (tmp_path / "broken.bin").write_bytes(b"not a gazetteer")
+        assert load_gazetteer(str(tmp_path / "broken.bin"), target) is None
+    
+    @pytest.mark.asyncio
+    async def test_geocoder_uses_gazetteer_before_network(self, stub_upstream, tmp_path):
+        target = str(tmp_path / "gazetteer.bin")
+        build_gazetteer(self.write_source(tmp_path), target)
+        api = make_stub_api(stub_upstream)
+        api.geocoder.gazetteer = Gazetteer(target)
+        
+        assert await api.geocoder.get_coordinates("三亚") == (18.24306, 109.505)
+        assert await api.geocoder.get_coordinates("北京") == (39.9042, 116.4074)
+        assert stub_upstream.requests == []
+
+
+class TestSpatialIndex:
+    """最近邻空间索引测试"""
+    
+    @pytest.fixture(params=["numpy", "pure"])
+    def backend(self, request, monkeypatch):
+        """分别测试 NumPy 向量化实现和纯 Python 实现"""
+        if request.param == "pure":
+            monkeypatch.setattr(spatial, "np", None)
+        elif spatial.np is None:
+            pytest.skip("未安装 NumPy")
+        return request.param
+    
+    def test_matches_brute_force(self, backend):
+        import random
+        rng = random.Random(7)
+        lats = [rng.uniform(-90, 90) for _ in range(2000)]
+        lons = [rng.uniform(-180, 180) for _ in range(2000)]
+        index = SpatialIndex(lats, lons)
+        queries = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(50)]
+        # 跨越日期变更线和极地附近的点
+        queries += [(0.0, 179.99), (0.0, -179.99), (89.9, 0.0), (-89.9, 90.0)]
+        
+        batch = index.nearest_many([q[0] for q in queries], [q[1] for q in queries])
+        for (lat, lon), (i, distance) in zip(queries, batch):
+            expected = min(range(len(lats)), key=lambda j: haversine_km(lat, lon, lats[j], lons[j]))
+            assert index.nearest(lat, lon)[0] == expected
+            assert i == expected
+            assert distance == pytest.approx(haversine_km(lat, lon, lats[i], lons[i]), abs=1e-3)
+    
+    def test_empty_and_builtin_cities(self, backend):
+        assert SpatialIndex([], []).nearest(0, 0) is None
+        index = CityIndex(BUILTIN_CITIES)
+        cities = SpatialIndex([c.lat for c in index], [c.lon for c in index])
+        i, distance = cities.nearest(35.70, 139.70)
+        assert index.cities[i].name == "东京"
+        assert distance < 10
+    
+    @pytest.mark.asyncio
+    async def test_nearest_city_tool(self):
+        from mcp_server.weather_mcp_server import nearest_city
+        tool = getattr(nearest_city, "fn", nearest_city)
+        
+        result = await tool(31.22, 121.48)
+        assert "上海" in result and "公里" in result
+        assert "❌" in await tool(91, 0)
+    
+    @pytest.mark.asyncio
+    async def test_empty_indexes_fall_through(self, monkeypatch):
+        """没有数据行的离线地名库不影响反向地理编码，两个索引都为空时返回 None"""
+        import mcp_server.weather_mcp_server as server
+        tool = getattr(server.nearest_city, "fn", server.nearest_city)
+        
+        monkeypatch.setattr(server, "gazetteer_spatial_index", SpatialIndex([], []))
+        place, _ = server.find_nearest_place(31.22, 121.48)
+        assert place.name == "上海"
+        result = await tool(31.22, 121.48)
+        assert "上海" in result and "离线地名库" not in result
+        
+        monkeypatch.setattr(server, "city_spatial_index", SpatialIndex([], []))
+        assert server.find_nearest_place(31.22, 121.48) is None
+        assert server.snap_to_nearest_place(31.22, 121.48) is None
+
+
+class TestGeocodeStore:
+    """持久化地理编码缓存测试"""
+    
+    def test_entries_survive_restart(self, tmp_path):
+        """重启后预加载已缓存的坐标"""
+        path = str(tmp_path / "geocode.sqlite3")
+        store = GeocodeStore(path)
+        store.put("三亚", (18.25, 109.51))
+        store.close()
+        
+        restarted = GeocodeStore(path)
+        assert len(restarted) == 1
+        assert restarted.get("三亚").coordinates == (18.25, 109.51)
+    
+    def test_shared_between_processes(self, tmp_path):
+        """其他进程写入的结果无需重启即可读取"""
+        path = str(tmp_path / "geocode.sqlite3")
+        reader = GeocodeStore(path)
+        writer = GeocodeStore(path)
+        
+        assert reader.get("桂林") is None
+        writer.put("桂林", (25.27, 110.29))
+        assert reader.get("桂林").coordinates == (25.27, 110.29)
+    
+    def test_negative_results_and_ttls(self):
+        """未命中结果使用更短的 TTL"""
+        now = [1_000.0]
+        store = GeocodeStore(ttl=100, negative_ttl=10, clock=lambda: now[0])
+        store.put("丽江", (26.86, 100.23))
+        store.put("火星市", None)
+        
+        assert store.get("火星市").coordinates is None
+        now[0] += 11
+        assert store.get("火星市") is None
+        assert store.get("丽江").coordinates == (26.86, 100.23)
+        now[0] += 90
+        assert store.get("丽江") is None
+    
+    @pytest.mark.asyncio
+    async def test_geocoder_caches_not_found(self, stub_upstream):
+        """查无此地的城市只请求一次高德 API"""
+        stub_upstream.unknown_addresses.add("火星市")
+        api = make_stub_api(stub_upstream)
+        
+        assert await api.geocoder.get_coordinates("火星市") is None
+        assert await api.geocoder.get_coordinates("火星市") is None
+        assert len(stub_upstream.requests) == 1
+
+
+class TestBatchGeocoding:
+    """批量地理编码测试"""
+    
+    @pytest.mark.asyncio
+    async def test_fifty_cities_cost_five_requests(self, stub_upstream):
+        """50个城市分5个批次请求，并发执行"""
+        api = make_stub_api(stub_upstream)
+        cities = [f"测试城市{i}" for i in range(50)]
+        
+        results = await api.geocoder.get_coordinates_batch(cities)
+        
+        assert len(stub_upstream.requests) == 5
+        assert all("batch=true" in r for r in stub_upstream.requests)
+        assert list(results) == cities
+        assert all(coords is not None for coords in results.values())
+    
+    @pytest.mark.asyncio
+    async def test_merges_builtin_cached_and_unknown(self, stub_upstream):
+        """内置坐标和缓存不发请求，未匹配地址返回 None 并缓存"""
+        stub_upstream.unknown_addresses.add("火星市")
+        api = make_stub_api(stub_upstream)
+        api.geocoder.coord_cache.put("桂林", (25.27, 110.29))
+        
+        results = await api.geocoder.get_coordinates_batch(["北京", "桂林", "三亚", "火星市"])
+        
+        assert results["北京"] == (39.9042, 116.4074)
+        assert results["桂林"] == (25.27, 110.29)
+        assert results["三亚"] == (20.0, 100.0)
+        assert results["火星市"] is None
+        assert len(stub_upstream.requests) == 1
+        assert "%E4%B8%89%E4%BA%9A%7C" in stub_upstream.requests[0]  # 三亚|火星市
+        
+        await api.geocoder.get_coordinates_batch(["三亚", "火星市"])
+        assert len(stub_upstream.requests) == 1
+
+
+class TestWeatherBatch:
+    """多城市并发查询测试"""
+    
+    @pytest.mark.asyncio
+    async def test_per_city_errors_do_not_fail_batch(self, stub_upstream):
+        """单个城市失败时其余城市正常返回"""
+        stub_upstream.unknown_addresses.add("火星市")
+        api = make_stub_api(stub_upstream)
+        
+        results = await api.get_daily_weather_many(["北京", "火星市", "上海"], days=2)
+        
+        assert list(results) == ["北京", "火星市", "上海"]
+        assert results["北京"]["status"] == "ok"
+        assert len(results["上海"]["result"]["daily"]["temperature"]) == 2
+        assert isinstance(results["火星市"], ValueError)
+    
+    @pytest.mark.asyncio
+    async def test_concurrency_is_bounded(self, stub_upstream):
+        """并发请求数不超过信号量上限"""
+        stub_upstream.delay = 0.02
+        api = make_stub_api(stub_upstream)
+        cities = ["北京", "上海", "广州", "深圳", "杭州", "南京", "武汉", "成都", "西安", "重庆"]
+        
+        results = await api.get_daily_weather_many(cities, days=1, concurrency=3)
+        
+        assert all(not isinstance(r, Exception) for r in results.values())
+        assert len(stub_upstream.requests) == len(cities)
+        assert stub_upstream.max_active <= 3
+    
+    @pytest.mark.asyncio
+    async def test_batch_tool_output(self, stub_upstream, monkeypatch):
+        """批量查询工具返回每个城市的结果和错误"""
+        import mcp_server.weather_mcp_server as server
+        
+        stub_upstream.unknown_addresses.add("火星市")
+        monkeypatch.setattr(server, "weather_api", make_stub_api(stub_upstream))
+        tool = getattr(server.query_weather_batch, "fn", server.query_weather_batch)
+        
+        content = await tool(["北京", "火星市"], horizon="tomorrow")
+        
+        assert "共2个城市，成功1个" in content
+        assert "📍 北京 2025-06-28" in content
+        assert "❌ 火星市" in content
+        
+        future = await tool(["上海"], horizon="future", days=5)
+        assert "未来5天" in future
+        assert future.count("📅") == 5
+
+
+class TestJSONOutput:
+    """工具结构化输出测试"""
+    
+    @pytest.fixture
+    def server(self, stub_upstream, monkeypatch):
+        import mcp_server.weather_mcp_server as server
+        
+        stub_upstream.unknown_addresses.add("火星市")
+        monkeypatch.setattr(server, "weather_api", make_stub_api(stub_upstream))
+        return server
+    
+    @staticmethod
+    def tool(server, name):
+        tool = getattr(server, name)
+        return getattr(tool, "fn", tool)
+    
+    @pytest.mark.asyncio
+    async def test_daily_fields_are_typed(self, server):
+        """数值字段为数字类型，文本输出由同一份摘要生成"""
+        today = json.loads(await self.tool(server, "query_weather_today")("北京", output_format="json"))
+        assert today == {
+            "city": "北京", "date": "2025-06-27", "weather": "多云", "skycon": "PARTLY_CLOUDY_DAY",
+            "temp_min": 23, "temp_max": 31, "humidity": 53, "wind_level": 5, "rain_prob": 10,
+            "tips": today["tips"],
+        }
+        text = await self.tool(server, "query_weather_today")("北京", output_format="text")
+        assert f"🌡️ 温度：{today['temp_min']}°C ~ {today['temp_max']}°C" in text
+        
+        tomorrow = json.loads(await self.tool(server, "query_weather_tomorrow")("北京", output_format="json"))
+        assert tomorrow["date"] == "2025-06-28" and tomorrow["temp_max"] == 32
+        
+        future = json.loads(await self.tool(server, "query_weather_future_days")("上海", days=5, output_format="json"))
+        assert [day["date"] for day in future["days"]] == [f"2025-06-{27 + i}" for i in range(5)]
+    
+    @pytest.mark.asyncio
+    async def test_batch_and_errors(self, server):
+        """批量结果逐城市给出数据或错误，无效格式直接报错"""
+        batch = json.loads(await self.tool(server, "query_weather_batch")(["北京", "火星市"], output_format="json"))
+        assert (batch["horizon"], batch["total"], batch["succeeded"]) == ("today", 2, 1)
+        assert batch["results"][0]["city"] == "北京" and batch["results"][0]["temp_min"] == 23
+        assert set(batch["results"][1]) == {"city", "error"}
+        
+        failed = json.loads(await self.tool(server, "query_weather_today")("火星市", output_format="json"))
+        assert set(failed) == {"city", "error"}
+        
+        assert "不支持的输出格式" in await self.tool(server, "query_weather_today")("北京", output_format="xml")
+    
+    def test_invalid_default_format_falls_back_to_text(self, server):
+        """WEATHER_OUTPUT_FORMAT 配置错误时启动即回退为 text，而不是让每次工具调用都报错"""
+        assert server.default_output_format(" JSON ") == "json"
+        assert server.default_output_format("jsno") == "text"
+        assert server.default_output_format("") == "text"
+    
+    @pytest.mark.asyncio
+    async def test_similar_province_without_amap(self, server):
+        """未配置高德时，与内置城市拼写相近的省份名返回不支持的城市，不会查成该内置城市的天气"""
+        server.weather_api.geocoder.api_key = ""
+        result = await self.tool(server, "query_weather_today")("Hebei")
+        assert "不支持的城市：Hebei" in result and "合肥" not in result
+        failed = json.loads(await self.tool(server, "query_weather_today")("Hebei", output_format="json"))
+        assert failed["city"] == "Hebei" and "error" in failed
+    
+    @pytest.mark.asyncio
+    async def test_location_tools(self, server):
+        coordinates = json.loads(await self.tool(server, "get_city_coordinates")("北京", output_format="json"))
+        assert coordinates == {"city": "北京", "lat": 39.9042, "lon": 116.4074}
+        
+        nearest = json.loads(await self.tool(server, "nearest_city")(31.25, 121.5, output_format="json"))
+        assert nearest["city"]["name"] == "上海" and nearest["city"]["distance_km"] < 10
+        
+        cities = json.loads(await self.tool(server, "get_supported_cities")(output_format="json"))
+        assert {"name": "北京", "name_en": "Beijing", "country_code": "CN", "lat": 39.9042, "lon": 116.4074} in cities["cities"]
+        
+        # 紧凑输出：不含多余空白，中文不转义
+        compact = await self.tool(server, "get_city_coordinates")("上海", output_format="json")
+        assert ": " not in compact and "上海" in compact
+
+
+class TestIPLocation:
+    """IP 定位结果的本地反向地理编码测试"""
+    
+    @pytest.fixture
+    def locate(self, stub_upstream, monkeypatch):
+        import mcp_server.weather_mcp_server as server
+        
+        api = make_stub_api(stub_upstream)
+        provider = IpapiProvider(HttpClientPool(), make_stub_guard(), f"{stub_upstream.url}/json/", f"{stub_upstream.url}/json/{{ip}}/")
+        monkeypatch.setattr(server, "ip_locator", CachedIPLocator(provider, ttl=0))
+        monkeypatch.setattr(server, "geocoder", api.geocoder)
+        
+        async def call(ip="", **payload):
+            stub_upstream.ip_location = {"ip": "203.0.113.7", **payload}
+            return await getattr(server.get_user_location_by_ip, "fn", server.get_user_location_by_ip)(ip)
+        call.geocoder = api.geocoder
+        return call
+    
+    @pytest.mark.asyncio
+    async def test_coordinates_resolve_to_nearest_city(self, locate):
+        """国内外统一按坐标匹配最近城市，不依赖城市名写法"""
+        result = await locate(country_name="China", city="Chaoyang", latitude=39.92, longitude=116.44)
+        assert "已自动定位到：北京" in result and "39.9042,116.4074" in result
+        
+        result = await locate(country_name="Japan", city="Shinjuku", latitude=35.69, longitude=139.70)
+        assert "已自动定位到：东京" in result
+    
+    @pytest.mark.asyncio
+    async def test_remote_location_keeps_geocode_cache_clean(self, locate):
+        """附近没有已知城市时使用原始城市名并返回定位坐标，但不写入共享的地理编码缓存"""
+        result = await locate(country_name="China", city="Sanya", latitude=18.25, longitude=109.51)
+        assert "已定位到：China Sanya" in result and "18.25,109.51" in result
+        assert locate.geocoder.coord_cache.get("Sanya") is None
+    
+    @pytest.mark.asyncio
+    async def test_falls_back_to_city_name(self, locate):
+        result = await locate(country_name="China", city="Shanghai")
+        assert "已自动定位到：上海" in result
+        assert "无法精确定位" in await locate(country_name="China")
+
+
+    @pytest.mark.asyncio
+    async def test_offline_database_without_network(self, stub_upstream, monkeypatch, tmp_path):
+        """离线数据库模式下指定 IP 的定位不访问网络，无效 IP 直接报错"""
+        import mcp_server.weather_mcp_server as server
+        
+        path = str(tmp_path / "city.mmdb")
+        write_mmdb(path, {"1.2.3.0/24": GEOIP_BEIJING})
+        monkeypatch.setattr(server, "ip_locator", CachedIPLocator(MmdbProvider(MmdbReader(path))))
+        tool = getattr(server.get_user_location_by_ip, "fn", server.get_user_location_by_ip)
+        
+        assert "已自动定位到：北京" in await tool("1.2.3.4")
+        assert "无法精确定位" in await tool("8.8.8.8")
+        assert "无效的IP地址" in await tool("not-an-ip")
+        assert stub_upstream.requests == []
+
+
+class TestIPLocationProviders:
+    """离线 IP 数据库和定位缓存测试"""
+    
+    def test_provider_must_implement_locate(self):
+        class Incomplete(IPLocationProvider):
+            pass
+        
+        with pytest.raises(TypeError):
+            Incomplete()
+    
+    @pytest.mark.parametrize("record_size", [24, 28, 32])
+    @pytest.mark.parametrize("ip_version", [4, 6])
+    def test_mmdb_reader(self, tmp_path, record_size, ip_version):
+        path = str(tmp_path / "city.mmdb")
+        networks = {"1.2.3.0/24": GEOIP_BEIJING, "10.0.0.0/8": GEOIP_SANYA}
+        if ip_version == 6:
+            networks["2001:db8::/32"] = GEOIP_SANYA
+        write_mmdb(path, networks, ip_version=ip_version, record_size=record_size)
+        
+        reader = MmdbReader(path)
+        assert reader.metadata["database_type"] == "GeoLite2-City"
+        assert reader.get("1.2.3.200") == GEOIP_BEIJING
+        assert reader.get("10.20.30.40")["city"]["names"]["en"] == "Sanya"
+        assert reader.get("1.2.4.1") is None
+        if ip_version == 6:
+            assert reader.get("2001:db8::1") == GEOIP_SANYA
+        reader.close()
+    
+    def test_invalid_database(self, tmp_path):
+        path = tmp_path / "broken.mmdb"
+        path.write_bytes(b"\0" * 64)
+        with pytest.raises(InvalidDatabaseError):
+            MmdbReader(str(path))
+    
+    @pytest.mark.asyncio
+    async def test_mmdb_provider_fields(self, tmp_path):
+        path = str(tmp_path / "city.mmdb")
+        write_mmdb(path, {"1.2.3.0/24": GEOIP_BEIJING, "10.0.0.0/8": GEOIP_SANYA})
+        provider = MmdbProvider(MmdbReader(path))
+        
+        beijing = await provider.locate("1.2.3.4")
+        assert (beijing.country, beijing.region, beijing.city) == ("中国", "北京市", "北京")
+        assert (beijing.latitude, beijing.longitude) == (39.9075, 116.3972)
+        sanya = await provider.locate("10.1.1.1")
+        assert sanya.city == "Sanya" and sanya.region == ""
+        assert await provider.locate(None) == IPLocation(ip="")
+    
+    @pytest.mark.asyncio
+    async def test_cache_ttl_lru_and_single_flight(self):
+        """同一 IP 在 TTL 内只查询一次，并发请求合并，超出容量时淘汰最久未用的 IP"""
+        class CountingProvider(IPLocationProvider):
+            def __init__(self):
+                self.calls = []
+            
+            async def locate(self, ip):
+                self.calls.append(ip)
+                await asyncio.sleep(0.01)
+                return IPLocation(ip=ip or "203.0.113.7", city="北京")
+        
+        now = [0.0]
+        provider = CountingProvider()
+        locator = CachedIPLocator(provider, ttl=60, max_entries=2, clock=lambda: now[0])
+        
+        await asyncio.gather(*[locator.locate("1.1.1.1") for _ in range(5)])
+        assert provider.calls == ["1.1.1.1"]
+        await locator.locate("")
+        await locator.locate(" 1.1.1.1 ")
+        assert provider.calls == ["1.1.1.1", None]
+        
+        await locator.locate("2.2.2.2")  # 淘汰本机出口 IP 的条目
+        await locator.locate("")
+        assert provider.calls[-1] is None and len(provider.calls) == 4
+        
+        now[0] += 61
+        await locator.locate("1.1.1.1")
+        assert provider.calls.count("1.1.1.1") == 2
+        with pytest.raises(ValueError):
+            await locator.locate("999.1.1.1")
+
+
+class TestUpstreamGuard:
+    """限流、重试与熔断测试"""
+    
+    @pytest.mark.asyncio
+    async def test_token_bucket_paces_requests(self):
+        """令牌耗尽后按速率放行"""
+        bucket = TokenBucket(rate=20, burst=2)
+        start = time.perf_counter()
+        for _ in range(6):
+            await bucket.acquire()
+        elapsed = time.perf_counter() - start
+        
+        # 突发2个立即放行，其余4个按 20次/秒 放行
+        assert elapsed >= 0.18
+    
+    @pytest.mark.asyncio
+    async def test_retries_honour_retry_after(self, stub_upstream):
+        """429/503 之后重试成功"""
+        stub_upstream.scripted = [(429, {"Retry-After": "0"}), (503, {})]
+        api = make_stub_api(stub_upstream)
+        
+        data = await api.get_daily_weather("北京", days=1)
+        
+        assert data["status"] == "ok"
+        assert len(stub_upstream.requests) == 3
+    
+    @pytest.mark.asyncio
+    async def test_rate_limit_error_after_retries_exhausted(self, stub_upstream):
+        """重试用尽后仍返回频率限制错误"""
+        stub_upstream.scripted = [(429, {})] * 3
+        api = make_stub_api(stub_upstream)
+        
+        with pytest.raises(Exception, match="API调用频率过高"):
+            await api.get_daily_weather("北京", days=1)
+        assert len(stub_upstream.requests) == 3
+    
+    @pytest.mark.asyncio
+    async def test_long_retry_after_is_not_waited(self, stub_upstream):
+        """Retry-After 超过退避上限时不等待，直接返回"""
+        stub_upstream.scripted = [(429, {"Retry-After": "120"})]
+        api = make_stub_api(stub_upstream)
+        
+        with pytest.raises(Exception, match="API调用频率过高"):
+            await api.get_daily_weather("北京", days=1)
+        assert len(stub_upstream.requests) == 1
+    
+    @pytest.mark.asyncio
+    async def test_circuit_breaker_fails_fast(self, stub_upstream):
+        """连续失败后熔断，冷却期后放行试探请求"""
+        stub_upstream.scripted = [(503, {})] * 2
+        api = make_stub_api(stub_upstream, guard=make_stub_guard(max_retries=0, failure_threshold=2, reset_timeout=0.05))
+        
+        for _ in range(2):
+            with pytest.raises(Exception, match="天气API请求失败"):
+                await api.get_daily_weather("北京", days=1)
+        with pytest.raises(Exception, match="熔断"):
+            await api.get_daily_weather("北京", days=1)
+        assert len(stub_upstream.requests) == 2
+        
+        await asyncio.sleep(0.06)
+        data = await api.get_daily_weather("北京", days=1)
+        assert data["status"] == "ok"
+        assert api.guard.breaker.state == "closed"
+    
+    def test_half_open_allows_single_trial(self):
+        """半开状态同一时间只放行一个试探请求"""
+        now = [0.0]
+        breaker = CircuitBreaker("测试", failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+        
+        now[0] = 10.0
+        breaker.check()
+        with pytest.raises(CircuitOpenError):
+            breaker.check()
+        breaker.record_success()
+        breaker.check()
+    
+    def test_parse_retry_after(self):
+        """Retry-After 支持秒数和 HTTP 日期"""
+        from email.utils import formatdate
+        
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("invalid") is None
+        assert 50 <= parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+
+
+class TestPrewarmScheduler:
+    """热门城市预热测试"""
+    
+    @pytest.mark.asyncio
+    async def test_hot_cities_refreshed_and_spread(self, stub_upstream):
+        """配置的热门城市被刷新，刷新在间隔内均匀分布"""
+        api = make_stub_api(stub_upstream)
+        scheduler = PrewarmScheduler(api, interval=0.2, hot_cities=["北京", "上海"])
+        
+        start = time.perf_counter()
+        await scheduler.run_once()
+        elapsed = time.perf_counter() - start
+        
+        assert len(stub_upstream.requests) == 2
+        assert scheduler.refreshed == 2
+        assert elapsed >= 0.2
+        
+        # 用户请求命中预热后的缓存
+        await api.get_daily_weather("上海", days=2)
+        assert len(stub_upstream.requests) == 2
+    
+    @pytest.mark.asyncio
+    async def test_fresh_entries_are_skipped(self, stub_upstream):
+        """缓存在下一轮之前不会过期时不刷新"""
+        api = make_stub_api(stub_upstream)
+        await api.get_daily_weather("北京", days=1)
+        scheduler = PrewarmScheduler(api, interval=0.01, hot_cities=["北京"])
+        
+        await scheduler.run_once()
+        
+        assert len(stub_upstream.requests) == 1
+        assert scheduler.refreshed == 0
+    
+    @pytest.mark.asyncio
+    async def test_top_k_by_observed_frequency(self, stub_upstream):
+        """按请求次数选取 Top-K 城市"""
+        api = make_stub_api(stub_upstream)
+        for city, count in [("广州", 3), ("深圳", 5), ("杭州", 1)]:
+            for _ in range(count):
+                api._record_request(city)
+        scheduler = PrewarmScheduler(api, interval=0.01, hot_cities=["北京"], top_k=2)
+        
+        assert scheduler.targets() == ["北京", "深圳", "广州"]
+    
+    @pytest.mark.asyncio
+    async def test_start_and_stop(self, stub_upstream):
+        """后台任务可以启动和停止"""
+        api = make_stub_api(stub_upstream)
+        scheduler = PrewarmScheduler(api, interval=0.05, hot_cities=["北京"])
+        
+        scheduler.start()
+        for _ in range(100):
+            if scheduler.refreshed:
+                break
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+        
+        assert scheduler.refreshed == 1
+        assert scheduler._task is None
+
+
+class TestServerLifespan:
+    """服务器生命周期测试"""
+    
+    @pytest.mark.asyncio
+    async def test_shared_resources_closed_by_last_session(self, monkeypatch):
+        """HTTP/SSE 服务的每个客户端会话都会进入生命周期，共享资源只在最后一个会话退出时关闭"""
+        import mcp_server.weather_mcp_server as server
+        
+        closed = []
+        
+        class Locator:
+            def close(self):
+                closed.append("ip_locator")
+        
+        monkeypatch.setattr(server, "ip_locator", Locator())
+        monkeypatch.setattr(server, "_lifespan_users", 0)
+        
+        async with server.server_lifespan(server.mcp):
+            async with server.server_lifespan(server.mcp):
+                pass
+            assert closed == []
+            async with server.server_lifespan(server.mcp):
+                pass
+            assert closed == []
+        assert closed == ["ip_locator"]
+
+
 # 慢速测试标记
 @pytest.mark.slow
 @pytest.mark.asyncio
@@ -184,4 +1435,144 @@ async def test_api_performance():
     
     # 性能断言（可根据实际情况调整）
     assert geocoding_time < 5.0, f"地理编码耗时过长: {geocoding_time:.2f}s"
-    assert weather_time < 5.0, f"天气查询耗时过长: {weather_time:.2f}s"
\ No newline at end of file
+    assert weather_time < 5.0, f"天气查询耗时过长: {weather_time:.2f}s"
+
+
+@pytest.mark.performance
+@pytest.mark.asyncio
+async def test_pooled_client_tail_latency(stub_upstream):
+    """共享连接池对比每次新建客户端的延迟（本地桩服务器）"""
+    import httpx
+    
+    url = f"{stub_upstream.url}/stub/116.4,39.9/daily"
+    rounds = 100
+    
+    async def fresh_client_call():
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            return await client.get(url, params={"dailysteps": 1})
+    
+    pool = HttpClientPool()
+    
+    async def pooled_call():
+        return await pool.get(url, params={"dailysteps": 1}, timeout=10.0)
+    
+    async def measure(call):
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            response = await call()
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 200
+        samples.sort()
+        return samples[len(samples) // 2], samples[int(len(samples) * 0.95)]
+    
+    connections_before = stub_upstream.connections
+    fresh_p50, fresh_p95 = await measure(fresh_client_call)
+    fresh_connections = stub_upstream.connections - connections_before
+    
+    connections_before = stub_upstream.connections
+    pooled_p50, pooled_p95 = await measure(pooled_call)
+    pooled_connections = stub_upstream.connections - connections_before
+    await pool.aclose()
+    
+    print(f"📊 每次新建客户端: p50={fresh_p50*1000:.2f}ms p95={fresh_p95*1000:.2f}ms 连接数={fresh_connections}")
+    print(f"📊 共享连接池:     p50={pooled_p50*1000:.2f}ms p95={pooled_p95*1000:.2f}ms 连接数={pooled_connections}")
+    
+    assert pooled_connections == 1, "共享连接池应复用同一个 keep-alive 连接"
+    assert fresh_connections == rounds
+    assert pooled_p95 < fresh_p95, "共享连接池的尾延迟应低于每次新建客户端"
+
+
+@pytest.mark.slow
+@pytest.mark.performance
+def test_city_resolution_latency():
+    """内置城市解析耗时：精确匹配和模糊匹配都应在微秒级"""
+    index = CityIndex(BUILTIN_CITIES)
+    rounds = 2000
+    
+    for query in ["北京", "San francisco", "Frankf", "Moskow", "三亚"]:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            index.resolve(query)
+        per_call = (time.perf_counter() - start) / rounds
+        print(f"📊 解析 {query!r}: {per_call * 1e6:.1f}µs")
+        assert per_call < 500e-6, f"{query} 解析耗时 {per_call * 1e6:.1f}µs"
+
+
+@pytest.mark.slow
+@pytest.mark.performance
+def test_large_gazetteer_open_and_lookup(tmp_path):
+    """10 万地点的离线地名库：打开和查询都不随数据量线性增长"""
+    source = tmp_path / "cities.txt"
+    with open(source, "w", encoding="utf-8") as f:
+        for i in range(100_000):
+            f.write(geonames_row(i, f"Place{i}", (i % 18000) / 100 - 90, (i % 36000) / 100 - 180, population=i))
+    target = str(tmp_path / "gazetteer.bin")
+    build_gazetteer(str(source), target)
+    
+    start = time.perf_counter()
+    gazetteer = Gazetteer(target)
+    open_time = time.perf_counter() - start
+    
+    rounds = 2000
+    start = time.perf_counter()
+    for i in range(rounds):
+        assert gazetteer.lookup(f"place{i * 37}") is not None
+    per_lookup = (time.perf_counter() - start) / rounds
+    
+    print(f"📊 离线地名库：{len(gazetteer)} 个地点，文件 {os.path.getsize(target) / 1024 / 1024:.1f}MB，"
+          f"打开 {open_time * 1000:.2f}ms，查询 {per_lookup * 1e6:.1f}µs")
+    assert open_time < 0.05
+    assert per_lookup < 200e-6
+    gazetteer.close()
+
+
+@pytest.mark.slow
+@pytest.mark.performance
+def test_spatial_index_latency():
+    """10 万地点的最近邻查询耗时"""
+    import random
+    rng = random.Random(3)
+    lats = [rng.uniform(-90, 90) for _ in range(100_000)]
+    lons = [rng.uniform(-180, 180) for _ in range(100_000)]
+    index = SpatialIndex(lats, lons)
+    
+    start = time.perf_counter()
+    index.nearest(0, 0)
+    build_time = time.perf_counter() - start
+    
+    rounds = 1000
+    queries = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(rounds)]
+    start = time.perf_counter()
+    for lat, lon in queries:
+        index.nearest(lat, lon)
+    per_query = (time.perf_counter() - start) / rounds
+    
+    backend = "NumPy" if spatial.np is not None else "纯 Python"
+    print(f"📊 空间索引（{backend}）：建树 {build_time * 1000:.0f}ms，最近邻查询 {per_query * 1e6:.1f}µs")
+    assert per_query < 1e-3
+
+
+@pytest.mark.slow
+@pytest.mark.performance
+@pytest.mark.asyncio
+async def test_offline_ip_location_latency(tmp_path):
+    """离线 IP 定位：首次查询和缓存命中都应在亚毫秒级"""
+    path = str(tmp_path / "city.mmdb")
+    write_mmdb(path, {f"{i}.0.0.0/8": GEOIP_BEIJING for i in range(1, 200)})
+    locator = CachedIPLocator(MmdbProvider(MmdbReader(path)), max_entries=10_000)
+    
+    rounds = 1000
+    start = time.perf_counter()
+    for i in range(rounds):
+        await locator.locate(f"{i % 199 + 1}.{i // 199}.0.1")
+    uncached = (time.perf_counter() - start) / rounds
+    
+    start = time.perf_counter()
+    for i in range(rounds):
+        await locator.locate(f"{i % 199 + 1}.{i // 199}.0.1")
+    cached = (time.perf_counter() - start) / rounds
+    
+    print(f"📊 离线IP定位：首次 {uncached * 1e6:.1f}µs，缓存命中 {cached * 1e6:.1f}µs")
+    assert uncached < 1e-3
+    assert cached < 1e-3
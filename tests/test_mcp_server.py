@@ -11,6 +11,9 @@ import os
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+# 测试使用内存地理编码缓存，避免读写用户缓存目录中上次运行留下的结果
+os.environ["GEOCODE_CACHE_PATH"] = ":memory:"
+
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
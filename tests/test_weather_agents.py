@@ -4,13 +4,19 @@ Weather Agents测试 - 测试AutoGen代理系统
 """
 
 import pytest
+import pytest_asyncio
 import asyncio
+import json
 import sys
 import os
+from contextlib import asynccontextmanager
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
+# 测试使用内存地理编码缓存，避免读写用户缓存目录中上次运行留下的结果
+os.environ["GEOCODE_CACHE_PATH"] = ":memory:"
+
 # 动态导入基于环境变量选择的模式
 def get_weather_module():
     """根据环境变量获取对应的天气模块"""
@@ -32,6 +38,19 @@ def get_weather_module():
 weather_agents = get_weather_module()
 
 from autogen_ext.models.openai import OpenAIChatCompletionClient
+from autogen_ext.models.replay import ReplayChatCompletionClient
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_agentchat.base import Response
+from autogen_agentchat.messages import HandoffMessage, TextMessage, ToolCallSummaryMessage
+from autogen_core import CancellationToken
+from autogen_core import FunctionCall
+from autogen_core.models import CreateResult, FunctionExecutionResult, FunctionExecutionResultMessage, RequestUsage, UserMessage
+from src.common.weather_renderer import TemplateFormatterAgent, life_advice, parse_weather_result, render_weather
+from src.common.intent_parser import LocalIntentParser, WeatherIntent, parse_number
+from src.common import mcp_tools as weather_mcp_tools
+from src.common.mcp_session_pool import McpSessionPool
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED, CallToolResult, ErrorData, ListToolsResult, TextContent
 
 # 动态获取函数
 create_intent_parser_agent = weather_agents.create_intent_parser_agent
@@ -146,6 +165,342 @@ class TestMCPToolsIntegration:
         assert len(tools1) == len(tools2)
         assert [t.name for t in tools1] == [t.name for t in tools2]
 
+def stdio_server_params():
+    """stdio 子进程参数，透传当前环境变量（测试环境的密钥可能只在环境变量中）"""
+    from autogen_ext.tools.mcp import StdioServerParams
+    
+    params = weather_mcp_tools.WEATHER_MCP_SERVER_PARAMS
+    return StdioServerParams(command=params.command, args=params.args, env=dict(os.environ))
+
+
+@pytest_asyncio.fixture
+async def inprocess_tools():
+    """进程内天气 MCP 工具，测试结束时退出服务器生命周期"""
+    from autogen_ext.tools.mcp import mcp_server_tools
+    
+    session = await weather_mcp_tools.create_inprocess_session()
+    tools = await mcp_server_tools(weather_mcp_tools.WEATHER_MCP_SERVER_PARAMS, session=session)
+    yield {tool.name: tool for tool in tools}
+    await session.aclose()
+
+
+class TestInProcessMcpTransport:
+    """进程内 MCP 传输测试"""
+    
+    @pytest.mark.asyncio
+    async def test_schemas_and_results_match_stdio(self, inprocess_tools):
+        """进程内工具的 schema 和结果序列化与 stdio 子进程完全一致"""
+        from autogen_ext.tools.mcp import create_mcp_server_session, mcp_server_tools
+        
+        params = stdio_server_params()
+        async with create_mcp_server_session(params) as session:
+            await session.initialize()
+            stdio_tools = {tool.name: tool for tool in await mcp_server_tools(params, session=session)}
+            assert list(stdio_tools) == list(inprocess_tools)
+            assert [tool.schema for tool in stdio_tools.values()] == [tool.schema for tool in inprocess_tools.values()]
+            
+            args = {"city": "北京", "output_format": "json"}
+            results = [
+                tools["get_city_coordinates"].return_value_as_string(
+                    await tools["get_city_coordinates"].run_json(args, CancellationToken())
+                )
+                for tools in (stdio_tools, inprocess_tools)
+            ]
+            assert results[0] == results[1]
+            assert parse_weather_result(results[1]) == []
+    
+    @pytest.mark.asyncio
+    async def test_tool_errors_are_results(self, inprocess_tools):
+        """工具异常与 MCP 服务端一样转换为 isError 结果"""
+        session = inprocess_tools["get_city_coordinates"]._session
+        result = await session.call_tool("no_such_tool", {})
+        assert result.isError and "no_such_tool" in result.content[0].text
+    
+    def test_import_leaves_host_process_alone(self, inprocess_tools):
+        """进程内加载服务器不修改宿主的环境变量，服务器日志遵循宿主的根日志级别"""
+        import logging
+        
+        assert os.getenv("FASTMCP_LOG_LEVEL") != "CRITICAL"
+        assert logging.getLogger("weather-mcp-server").level == logging.NOTSET
+    
+    @pytest.mark.asyncio
+    async def test_transport_selection_and_fallback(self, monkeypatch):
+        """进程内加载失败时退回 stdio，未知传输方式直接报错"""
+        calls = []
+        
+        async def broken():
+            calls.append("inprocess")
+            raise ValueError("CAIYUN_API_KEY 环境变量未设置")
+        
+        async def pool(server_params):
+            calls.append(server_params.command)
+            return FakeMcpServer().session()
+        
+        monkeypatch.setattr(weather_mcp_tools, "create_inprocess_session", broken)
+        monkeypatch.setattr(weather_mcp_tools, "create_session_pool", pool)
+        monkeypatch.setattr(weather_mcp_tools, "_loaded_tools", {})
+        assert await weather_mcp_tools.get_weather_mcp_tools() == []
+        assert calls == ["inprocess", "python"]
+        
+        await weather_mcp_tools.close_weather_mcp_tools()
+        await weather_mcp_tools.get_weather_mcp_tools(transport="stdio")
+        assert calls == ["inprocess", "python", "python"]
+        
+        await weather_mcp_tools.close_weather_mcp_tools()
+        with pytest.raises(ValueError, match="不支持的 MCP 传输方式"):
+            await weather_mcp_tools.get_weather_mcp_tools(transport="pipe")
+
+class FakeMcpSession:
+    """模拟的 MCP 客户端会话，alive 为 False 时与断开的连接一样报错"""
+    
+    def __init__(self, server):
+        self.server = server
+        self.alive = True
+    
+    def _check(self):
+        if not self.alive:
+            raise McpError(ErrorData(code=CONNECTION_CLOSED, message="Connection closed"))
+    
+    async def initialize(self):
+        pass
+    
+    async def send_ping(self):
+        self._check()
+    
+    async def list_tools(self):
+        self._check()
+        return ListToolsResult(tools=[])
+    
+    async def call_tool(self, name, arguments=None, **kwargs):
+        self._check()
+        self.server.calls.append(self)
+        await self.server.gate.wait()
+        return CallToolResult(content=[TextContent(type="text", text=name)])
+    
+    async def aclose(self):
+        pass
+
+
+class FakeMcpServer:
+    """模拟的 MCP 服务器，记录建立过的会话和每次调用使用的会话"""
+    
+    def __init__(self):
+        self.sessions = []
+        self.calls = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+    
+    def session(self):
+        session = FakeMcpSession(self)
+        self.sessions.append(session)
+        return session
+    
+    @asynccontextmanager
+    async def connect(self, server_params):
+        yield self.session()
+
+
+async def wait_until(condition, timeout: float = 2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    pytest.fail("等待条件超时")
+
+
+class TestMcpSessionPool:
+    """MCP 会话池测试"""
+    
+    @staticmethod
+    async def start_pool(server, size, **kwargs):
+        pool = McpSessionPool("params", size=size, reconnect_delay=0, session_factory=server.connect, **kwargs)
+        await pool.start()
+        await wait_until(lambda: all(slot["healthy"] for slot in pool.stats()))
+        return pool
+    
+    @pytest.mark.asyncio
+    async def test_least_busy_dispatch(self):
+        """并发调用分散到不同会话，不会排在同一个管道后面"""
+        server = FakeMcpServer()
+        pool = await self.start_pool(server, size=3)
+        
+        server.gate.clear()
+        calls = [asyncio.create_task(pool.call_tool("query_weather_today", {"city": "北京"})) for _ in range(3)]
+        await wait_until(lambda: len(server.calls) == 3)
+        assert [slot["inflight"] for slot in pool.stats()] == [1, 1, 1]
+        assert len(set(map(id, server.calls))) == 3
+        
+        server.gate.set()
+        results = await asyncio.gather(*calls)
+        assert [result.content[0].text for result in results] == ["query_weather_today"] * 3
+        assert [slot["inflight"] for slot in pool.stats()] == [0, 0, 0]
+        await pool.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_reconnect_after_crash(self):
+        """会话断开时调用改由其他会话完成，断开的会话自动重连"""
+        server = FakeMcpServer()
+        pool = await self.start_pool(server, size=2)
+        server.sessions[0].alive = False
+        
+        for _ in range(3):
+            result = await pool.call_tool("get_supported_cities")
+            assert result.content[0].text == "get_supported_cities"
+        
+        await wait_until(lambda: pool.stats()[0]["healthy"])
+        assert pool.stats()[0]["restarts"] == 1 and len(server.sessions) == 3
+        await pool.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_health_check_replaces_dead_session(self):
+        """空闲时健康检查发现断开的会话并重连"""
+        server = FakeMcpServer()
+        pool = await self.start_pool(server, size=1, health_interval=0.01)
+        server.sessions[0].alive = False
+        
+        await wait_until(lambda: len(server.sessions) == 2 and pool.stats()[0]["healthy"])
+        assert pool.stats()[0]["restarts"] == 1
+        await pool.aclose()
+        
+        with pytest.raises(ConnectionError, match="已关闭"):
+            await pool.call_tool("get_supported_cities")
+    
+    @pytest.mark.asyncio
+    async def test_stdio_sessions_stay_warm(self):
+        """stdio 会话池：多个服务器子进程保持连接，并发调用分散到各子进程"""
+        from autogen_ext.tools.mcp import mcp_server_tools
+        
+        params = stdio_server_params()
+        pool = await McpSessionPool(params, size=2).start()
+        try:
+            await wait_until(lambda: all(slot["healthy"] for slot in pool.stats()), timeout=30)
+            tools = {tool.name: tool for tool in await mcp_server_tools(params, session=pool)}
+            
+            calls_before = [slot["calls"] for slot in pool.stats()]
+            results = await asyncio.gather(*[
+                tools["get_city_coordinates"].run_json({"city": city}, CancellationToken())
+                for city in ("北京", "上海", "广州", "深圳")
+            ])
+            texts = [json.loads(tools["get_city_coordinates"].return_value_as_string(result))[0]["text"] for result in results]
+            assert all("坐标" in text for text in texts)
+            assert [slot["calls"] - before for slot, before in zip(pool.stats(), calls_before)] == [2, 2]
+        finally:
+            await pool.aclose()
+
+
+def test_tools_are_per_event_loop(monkeypatch):
+    """每个事件循环各自建立会话，同一循环内的并发调用只建立一次"""
+    loads = []
+    
+    async def load(transport=None, url=None):
+        await asyncio.sleep(0.01)
+        loads.append(asyncio.get_running_loop())
+        return [f"tool-{len(loads)}"], FakeMcpServer().session()
+    
+    monkeypatch.setattr(weather_mcp_tools, "load_weather_mcp_tools", load)
+    monkeypatch.setattr(weather_mcp_tools, "_loaded_tools", {})
+    
+    async def burst():
+        return await asyncio.gather(*[weather_mcp_tools.get_weather_mcp_tools() for _ in range(5)])
+    
+    first, second = asyncio.run(burst()), asyncio.run(burst())
+    assert first == [["tool-1"]] * 5 and second == [["tool-2"]] * 5
+    assert loads[0] is not loads[1]
+
+
+def test_tools_closed_when_loop_exits(monkeypatch):
+    """事件循环退出时即使没有调用 close_weather_mcp_tools，会话也会关闭，记录随之移除"""
+    closed = []
+    
+    class Session:
+        async def aclose(self):
+            closed.append(self)
+    
+    async def load(transport=None, url=None):
+        return ["tool"], Session()
+    
+    monkeypatch.setattr(weather_mcp_tools, "load_weather_mcp_tools", load)
+    monkeypatch.setattr(weather_mcp_tools, "_loaded_tools", {})
+    
+    assert asyncio.run(weather_mcp_tools.get_weather_mcp_tools()) == ["tool"]
+    assert len(closed) == 1
+    assert weather_mcp_tools._loaded_tools == {}
+    
+    async def failing_load(transport=None, url=None):
+        raise ConnectionError("无法连接")
+    
+    async def retry():
+        with pytest.raises(ConnectionError):
+            await weather_mcp_tools.get_weather_mcp_tools()
+        monkeypatch.setattr(weather_mcp_tools, "load_weather_mcp_tools", load)
+        return await weather_mcp_tools.get_weather_mcp_tools()
+    
+    monkeypatch.setattr(weather_mcp_tools, "load_weather_mcp_tools", failing_load)
+    assert asyncio.run(retry()) == ["tool"]
+    assert len(closed) == 2 and weather_mcp_tools._loaded_tools == {}
+
+
+@pytest_asyncio.fixture
+async def http_mcp_server():
+    """以 streamable HTTP 方式运行的长驻天气 MCP 服务，返回服务地址"""
+    import socket
+    
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    root = os.path.join(os.path.dirname(__file__), "..")
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "mcp_server/weather_mcp_server.py", "--transport", "http", "--port", str(port),
+        cwd=root, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(200):
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+            except OSError:
+                await asyncio.sleep(0.05)
+                continue
+            writer.close()
+            break
+        else:
+            pytest.fail("HTTP MCP 服务未能启动")
+        yield f"http://127.0.0.1:{port}/mcp"
+    finally:
+        process.terminate()
+        await process.wait()
+
+
+class TestRemoteMcpTransport:
+    """长驻 HTTP/SSE MCP 服务测试"""
+    
+    def test_resolve_transport(self, monkeypatch):
+        resolve = weather_mcp_tools.resolve_transport
+        monkeypatch.delenv("WEATHER_MCP_TRANSPORT", raising=False)
+        assert resolve() == "inprocess"
+        assert resolve(url="http://mcp.internal:8000/mcp") == "http"
+        assert resolve(url="http://mcp.internal:8000/sse/") == "sse"
+        assert resolve("stdio", url="http://mcp.internal:8000/mcp") == "stdio"
+        
+        monkeypatch.setenv("WEATHER_MCP_TRANSPORT", "sse")
+        assert resolve(url="http://mcp.internal:8000/events") == "sse"
+        with pytest.raises(ValueError, match="需要服务地址"):
+            resolve()
+    
+    @pytest.mark.asyncio
+    async def test_tools_from_shared_server(self, http_mcp_server, inprocess_tools, monkeypatch):
+        """通过 URL 连接长驻服务，工具 schema 与进程内一致，多次调用（各自的会话）共用同一服务"""
+        monkeypatch.setattr(weather_mcp_tools, "_loaded_tools", {})
+        monkeypatch.delenv("WEATHER_MCP_TRANSPORT", raising=False)
+        tools = {tool.name: tool for tool in await weather_mcp_tools.get_weather_mcp_tools(url=http_mcp_server)}
+        assert [tool.schema for tool in tools.values()] == [tool.schema for tool in inprocess_tools.values()]
+        
+        args = {"city": "上海", "output_format": "json"}
+        for _ in range(2):
+            result = await tools["get_city_coordinates"].run_json(args, CancellationToken())
+            payload = json.loads(json.loads(tools["get_city_coordinates"].return_value_as_string(result))[0]["text"])
+            assert payload == {"city": "上海", "lat": 31.2304, "lon": 121.4737}
+        await weather_mcp_tools.close_weather_mcp_tools()
+
 class TestAgentSystemMessages:
     """代理系统消息测试"""
     
@@ -505,6 +860,433 @@ class TestWeatherQueryFunctionality:
         advice_keywords = ["建议", "适合", "注意", "记得", "可以", "适宜"]
         assert any(word in actual_text for word in advice_keywords)
 
+# 天气工具的输出示例（与 mcp_server 的 format_weather_data / JSON 输出格式一致）
+TOOL_TEXT_TODAY = """📍 北京 2025-06-27
+🌤️ 天气：小雨
+🌡️ 温度：8°C ~ 16°C
+💧 湿度：81%
+💨 风力：3级
+🌧️ 降水概率：75%
+💡 生活建议：降雨概率高，建议携带雨具"""
+TOOL_JSON_FUTURE = json.dumps({"city": "三亚", "days": [
+    {"date": "2025-06-27", "weather": "晴天", "skycon": "CLEAR_DAY", "temp_min": 26, "temp_max": 33,
+     "humidity": 70, "wind_level": 3, "rain_prob": 5, "tips": ""},
+    {"date": "2025-06-28", "weather": "多云", "skycon": "PARTLY_CLOUDY_DAY", "temp_min": 27, "temp_max": 32,
+     "humidity": 74, "wind_level": 4, "rain_prob": 20, "tips": ""},
+]}, ensure_ascii=False, separators=(",", ":"))
+
+
+def mcp_result(text: str) -> str:
+    """AutoGen MCP 适配器序列化后的工具结果"""
+    return json.dumps([{"type": "text", "text": text}])
+
+
+class StubWeatherAgent(BaseChatAgent):
+    """回放固定工具结果的天气查询代理"""
+    
+    def __init__(self, message_factory):
+        super().__init__("weather_agent", "回放天气工具结果")
+        self.message_factory = message_factory
+    
+    @property
+    def produced_message_types(self):
+        return (ToolCallSummaryMessage, HandoffMessage)
+    
+    async def on_messages(self, messages, cancellation_token):
+        return Response(chat_message=self.message_factory())
+    
+    async def on_reset(self, cancellation_token):
+        pass
+
+
+class TestTemplateFormatter:
+    """确定性模板渲染测试（不调用大模型）"""
+    
+    def test_renders_formatter_template(self):
+        """单日结果严格按 formatter 模板输出"""
+        reports = parse_weather_result(mcp_result(TOOL_TEXT_TODAY))
+        assert render_weather(reports) == """北京的天气情况如下：
+
+🌤️ 天气：小雨
+🌡️ 温度：8°C ~ 16°C
+💧 湿度：81%
+💨 风力：3级
+🌧️ 降水概率：75%
+
+生活建议：可能有降水，出门记得带伞，气温较低，请注意保暖添衣。希望你有个愉快的一天！"""
+    
+    def test_json_and_batch_results(self):
+        future = render_weather(parse_weather_result(mcp_result(TOOL_JSON_FUTURE)))
+        assert future.startswith("三亚未来2天的天气情况如下：")
+        assert future.count("📅") == 2 and "🌧️ 降水概率：20%" in future
+        
+        batch = json.dumps({"horizon": "today", "total": 2, "succeeded": 1, "results": [
+            {"city": "三亚", **json.loads(TOOL_JSON_FUTURE)["days"][0]},
+            {"city": "火星市", "error": "查询失败: 未找到城市"},
+        ]}, ensure_ascii=False)
+        rendered = render_weather(parse_weather_result(batch))
+        assert "三亚的天气情况如下：" in rendered and rendered.endswith("❌ 火星市：查询失败: 未找到城市")
+        
+        # 坐标等非天气工具的输出不参与渲染
+        assert parse_weather_result(mcp_result('{"city":"北京","lat":39.9042,"lon":116.4074}')) == []
+    
+    def test_life_advice_rules(self):
+        assert "带伞" in life_advice("多云", 25, 18, 65)
+        assert "防暑降温" in life_advice("晴天", 33, 25, 0)
+        assert "保暖添衣" in life_advice("阴天", 12, 2, 0)
+        assert "适合户外活动" in life_advice("晴天", 22, 12, 0)
+        assert "注意天气变化" in life_advice("多云", 22, 12, 0)
+    
+    @pytest.mark.asyncio
+    async def test_selector_flow_ends_at_formatter(self):
+        """SelectorGroupChat：formatter 渲染后即终止，不调用选择器模型"""
+        from autogen_agentchat.conditions import MaxMessageTermination, SourceMatchTermination
+        from autogen_agentchat.teams import SelectorGroupChat
+        from autogen_ext.models.replay import ReplayChatCompletionClient
+        
+        weather = StubWeatherAgent(lambda: ToolCallSummaryMessage(
+            content=mcp_result(TOOL_TEXT_TODAY), source="weather_agent", tool_calls=[], results=[]
+        ))
+        model_client = ReplayChatCompletionClient([])
+        team = SelectorGroupChat(
+            participants=[weather, TemplateFormatterAgent()],
+            model_client=model_client,
+            selector_func=lambda messages: "weather_agent" if len(messages) <= 1 else "formatter",
+            termination_condition=SourceMatchTermination(["formatter"]) | MaxMessageTermination(8),
+        )
+        
+        result = await team.run(task="北京今天天气")
+        
+        assert result.messages[-1].source == "formatter"
+        assert result.messages[-1].content.startswith("北京的天气情况如下：")
+        assert model_client.create_calls == []
+    
+    @pytest.mark.asyncio
+    async def test_swarm_flow_hands_off_to_user(self):
+        """Swarm：从交接上下文中读取工具结果，渲染后交接回用户"""
+        from autogen_agentchat.conditions import HandoffTermination
+        from autogen_agentchat.teams import Swarm
+        
+        weather = StubWeatherAgent(lambda: HandoffMessage(
+            content="转交格式化", target="formatter", source="weather_agent",
+            context=[FunctionExecutionResultMessage(content=[FunctionExecutionResult(
+                call_id="1", name="query_weather_future_days", content=mcp_result(TOOL_JSON_FUTURE)
+            )])],
+        ))
+        team = Swarm(
+            participants=[weather, TemplateFormatterAgent(handoff_target="user")],
+            termination_condition=HandoffTermination(target="user"),
+        )
+        
+        result = await team.run(task="三亚未来两天天气")
+        
+        assert isinstance(result.messages[-1], HandoffMessage)
+        assert result.messages[-1].content.startswith("三亚未来2天的天气情况如下：")
+
+
+class TestLocalIntentParser:
+    """本地规则意图解析测试"""
+    
+    @pytest.fixture(scope="class")
+    def parser(self):
+        return LocalIntentParser()
+    
+    @pytest.mark.parametrize("query, expected", [
+        ("上海明天天气", WeatherIntent("上海", "tomorrow", 1)),
+        ("广州未来3天天气", WeatherIntent("广州", "future", 3)),
+        ("深圳未来十五天的天气预报", WeatherIntent("深圳", "future", 15)),
+        ("请帮我查一下北京市今天天气怎么样？", WeatherIntent("北京", "today", 1)),
+        ("成都天气", WeatherIntent("成都", "today", 1)),
+        ("东京这周天气", WeatherIntent("东京", "future", 7)),
+        ("Tokyo weather tomorrow", WeatherIntent("东京", "tomorrow", 1)),
+        ("weather in New York next 5 days", WeatherIntent("纽约", "future", 5)),
+        ("weather in Nice today", WeatherIntent("尼斯", "today", 1)),
+    ])
+    def test_confident_queries(self, parser, query, expected):
+        assert parser.parse(query) == expected
+    
+    @pytest.mark.parametrize("query", [
+        "今天天气怎么样",            # 没有城市，需要 IP 定位
+        "北京和上海明天天气",        # 多个城市
+        "杭州今天和明天天气",        # 多个时间
+        "北京明天适合跑步吗",        # 无法解释的措辞
+        "深圳未来二十天天气",        # 超出预报范围
+        "三亚今天天气",              # 不在内置城市中，交给 LLM 和地理编码
+        "上海后天天气",              # 后天只要一天，不是未来三天
+        "is the weather nice today", # nice 是形容词，不是尼斯
+    ])
+    def test_ambiguous_queries_fall_back(self, parser, query):
+        assert parser.parse(query) is None
+    
+    def test_intent_text_matches_llm_parser_format(self):
+        assert WeatherIntent("广州", "future", 5).to_text() == "城市：广州\n时间：future\n天数：5\n查询：查询广州未来5天的天气"
+        assert WeatherIntent("上海", "tomorrow", 1).to_text() == "城市：上海\n时间：tomorrow\n查询：查询上海明天的天气"
+        assert [parse_number(n) for n in ("7", "三", "两", "十", "十二", "二十", "一百")] == [7, 3, 2, 10, 12, 20, None]
+    
+    def test_teams_skip_llm_intent_parser(self, monkeypatch):
+        """命中本地解析时 SelectorGroupChat 直接选择天气查询代理，Swarm 直接交接给天气查询代理"""
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        from src.selector_groupchat.weather_team import WeatherAgentTeam as SelectorTeam
+        from src.swarm.weather_team import WeatherAgentTeam as SwarmTeam
+        
+        selector = SelectorTeam(fast_intent=True)
+        assert selector._agent_selector([selector._build_task("上海明天天气")]) == "weather_agent"
+        assert selector._agent_selector([TextMessage(content=selector._build_task("今天天气怎么样"), source="user")]) == "intent_parser"
+        
+        handoff = SwarmTeam(fast_intent=True)._build_task("广州未来3天天气")
+        assert isinstance(handoff, HandoffMessage) and handoff.target == "weather_agent"
+        assert SwarmTeam(fast_intent=False)._build_task("广州未来3天天气") == "广州未来3天天气"
+
+
+class FixedLocationProvider:
+    """返回固定定位结果的 IP 定位服务"""
+    
+    name = "fixed"
+    
+    def __init__(self, location):
+        self.location = location
+    
+    async def locate(self, ip):
+        return self.location
+    
+    def close(self):
+        pass
+
+
+@pytest_asyncio.fixture
+async def stub_weather_server(monkeypatch):
+    """天气 MCP 服务器的上游天气 API 和 IP 定位指向本地桩服务器，返回桩服务器"""
+    from test_api import StubUpstream, make_stub_api
+    from mcp_server import weather_mcp_server as server
+    from mcp_server.ip_location import CachedIPLocator, IPLocation
+    
+    stub = await StubUpstream().start()
+    api = make_stub_api(stub)
+    monkeypatch.setattr(server, "weather_api", api)
+    monkeypatch.setattr(server, "ip_locator", CachedIPLocator(FixedLocationProvider(
+        IPLocation(ip="203.0.113.7", country="China", city="Tianhe", latitude=23.13, longitude=113.32)
+    )))
+    yield stub
+    await api.aclose()
+    await api.http.aclose()
+    await stub.stop()
+
+
+@pytest_asyncio.fixture
+async def weather_pipeline(stub_weather_server):
+    """指向本地桩服务器的直连流水线"""
+    from mcp_server import weather_mcp_server as server
+    from src.pipeline.weather_team import WeatherPipeline
+    
+    pipeline = WeatherPipeline(verbose=False)
+    pipeline.server = server
+    pipeline.stub = stub_weather_server
+    yield pipeline
+
+
+class TestWeatherPipeline:
+    """直连流水线模式测试（不调用大模型）"""
+    
+    @pytest.mark.asyncio
+    async def test_query_renders_template(self, weather_pipeline):
+        result = await weather_pipeline.query("上海明天天气")
+        assert result.startswith("上海的天气情况如下：") and "🌡️ 温度：24°C ~ 32°C" in result
+        assert "生活建议：" in result
+        
+        result = await weather_pipeline.query("广州未来3天天气")
+        assert result.startswith("广州未来3天的天气情况如下：") and result.count("📅") == 3
+    
+    @pytest.mark.asyncio
+    async def test_missing_city_uses_ip_location(self, weather_pipeline):
+        result = await weather_pipeline.query("今天天气怎么样")
+        assert result.startswith("广州的天气情况如下：")
+    
+    @pytest.mark.asyncio
+    async def test_unsupported_query(self, weather_pipeline):
+        from src.pipeline.weather_team import UNSUPPORTED_QUERY
+        
+        assert await weather_pipeline.query("北京和上海明天天气") == UNSUPPORTED_QUERY
+        assert await weather_pipeline.query("北京明天适合跑步吗") == UNSUPPORTED_QUERY
+        assert weather_pipeline.stub.requests == []
+    
+    @pytest.mark.asyncio
+    async def test_query_many_keeps_input_order(self, weather_pipeline):
+        inputs = ["上海明天天气", "北京和上海明天天气", "广州未来3天天气"]
+        results = await weather_pipeline.query_many(inputs, concurrency=3)
+        
+        assert [result.query for result in results] == inputs
+        assert results[0].output.startswith("上海的天气情况如下：")
+        assert results[2].output.startswith("广州未来3天的天气情况如下：")
+        assert all(result.ok and result.elapsed >= 0 for result in results)
+
+
+class StubTeam:
+    """记录并发情况的团队实例"""
+    
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.running = False
+    
+    async def query(self, user_input):
+        assert not self.running, "同一个团队实例被并发使用"
+        self.running = True
+        self.tracker["active"] += 1
+        self.tracker["peak"] = max(self.tracker["peak"], self.tracker["active"])
+        try:
+            # 输入越靠前耗时越长，完成顺序与输入顺序相反
+            await asyncio.sleep(0.01 * (10 - int(user_input[-1])))
+            if user_input.endswith("3"):
+                raise RuntimeError("模型超时")
+            return f"结果{user_input[-1]}"
+        finally:
+            self.tracker["active"] -= 1
+            self.running = False
+
+
+class IntentEchoModelClient(ReplayChatCompletionClient):
+    """按结构化意图调用对应天气工具的模型客户端，记录每次调用时上下文中的用户消息数"""
+    
+    def __init__(self):
+        super().__init__([], model_info={
+            "vision": False, "function_calling": True, "json_output": False,
+            "family": "unknown", "structured_output": False,
+        })
+        self.user_message_counts = []
+    
+    async def create(self, messages, *, tools=[], tool_choice="auto", json_output=None,
+                     extra_create_args={}, cancellation_token=None):
+        user_messages = [message for message in messages if isinstance(message, UserMessage)]
+        self.user_message_counts.append(len(user_messages))
+        intent = dict(line.split("：", 1) for line in user_messages[-1].content.splitlines())
+        await asyncio.sleep(0.01)
+        return CreateResult(
+            finish_reason="function_calls",
+            content=[FunctionCall(
+                id=str(len(self.user_message_counts)),
+                name=f"query_weather_{intent['时间']}",
+                arguments=json.dumps({"city": intent["城市"]}, ensure_ascii=False),
+            )],
+            usage=RequestUsage(prompt_tokens=0, completion_tokens=0),
+            cached=False,
+        )
+
+
+@pytest_asyncio.fixture
+async def fresh_mcp_tools(monkeypatch):
+    """当前事件循环使用一组新的进程内天气 MCP 工具，测试结束时关闭"""
+    monkeypatch.setenv("WEATHER_MCP_TRANSPORT", "inprocess")
+    monkeypatch.setattr(weather_mcp_tools, "_loaded_tools", {})
+    yield
+    await weather_mcp_tools.close_weather_mcp_tools()
+
+
+class TestConcurrentQueries:
+    """并发查询测试（不调用大模型）"""
+    
+    @pytest.mark.asyncio
+    async def test_run_query_pool(self):
+        """每个实例同一时间只执行一条查询，结果按输入顺序返回，单条失败不影响其他查询"""
+        from src.common.query_pool import run_query_pool
+        
+        tracker = {"active": 0, "peak": 0}
+        members = [StubTeam(tracker) for _ in range(2)]
+        inputs = [f"查询{i}" for i in range(6)]
+        results = await run_query_pool(members, inputs)
+        
+        assert [result.query for result in results] == inputs
+        assert [result.output for result in results[:4]] == ["结果0", "结果1", "结果2", "❌ 查询失败: 模型超时"]
+        assert results[3].error == "模型超时" and not results[3].ok
+        assert all(result.ok for i, result in enumerate(results) if i != 3)
+        assert tracker["peak"] == 2
+        # 前两条立即开始，其余排队等待空闲实例
+        assert results[0].wait < 0.01 and results[5].wait > results[0].elapsed * 0.9
+        assert results[0].elapsed > results[5].elapsed
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mode", ["selector_groupchat", "swarm", "magentic_one"])
+    async def test_replicas_share_client_and_tools(self, mode, fresh_mcp_tools):
+        import importlib
+        
+        module = importlib.import_module(f"src.{mode}.weather_team")
+        model_client = IntentEchoModelClient()
+        team = module.WeatherAgentTeam(verbose=False, template_formatter=True, model_client=model_client)
+        
+        members = await team._team_pool(3)
+        assert len(members) == 3 and members[0] is team
+        assert all(member.model_client is model_client for member in members)
+        assert len({id(member.weather_agent) for member in members}) == 3
+        tools = [member.weather_agent._workbench[0]._tools for member in members]
+        assert all(a is b for a, b in zip(tools[0], tools[1]))
+        
+        # 副本保留复用；关闭团队不关闭传入的模型客户端
+        assert (await team._team_pool(2))[1] is members[1]
+        await team.close()
+        assert team._replicas == []
+        assert model_client.user_message_counts == []
+    
+    @pytest.mark.asyncio
+    async def test_selector_query_many(self, stub_weather_server, fresh_mcp_tools):
+        """多条查询由多个团队实例并发完成，复用的实例不带上一条查询的对话状态"""
+        from src.selector_groupchat.weather_team import WeatherAgentTeam
+        
+        model_client = IntentEchoModelClient()
+        team = WeatherAgentTeam(verbose=False, template_formatter=True, fast_intent=True, model_client=model_client)
+        inputs = ["北京今天天气", "上海明天天气", "广州今天天气", "深圳明天天气", "北京和上海明天天气"]
+        
+        results = await team.query_many(inputs, concurrency=2)
+        
+        assert [result.query for result in results] == inputs
+        for result, city in zip(results, ["北京", "上海", "广州", "深圳"]):
+            assert result.ok and result.output.startswith(f"{city}的天气情况如下："), result.output
+        # 本地解析不了的查询交给 LLM 意图解析代理，测试用的模型客户端无法处理，错误只影响这一条
+        assert not results[4].ok and results[4].output.startswith("❌ 查询失败")
+        assert len(team._replicas) == 1
+        # 每次调用模型时上下文中只有当前查询
+        assert model_client.user_message_counts == [1] * 5
+
+
+
+class TestTeamReset:
+    """团队复用测试（不调用大模型）"""
+    
+    @pytest.mark.asyncio
+    async def test_query_resets_previous_conversation(self, stub_weather_server, fresh_mcp_tools):
+        """连续查询复用同一组代理，每条查询开始前清空上一条查询的对话"""
+        from src.selector_groupchat.weather_team import WeatherAgentTeam
+        
+        model_client = IntentEchoModelClient()
+        team = WeatherAgentTeam(verbose=False, template_formatter=True, fast_intent=True, model_client=model_client)
+        await team.initialize()
+        agents = (team.weather_agent, team.formatter, team.team)
+        
+        assert (await team.query("北京今天天气")).startswith("北京的天气情况如下：")
+        assert (await team.query("上海明天天气")).startswith("上海的天气情况如下：")
+        
+        assert (team.weather_agent, team.formatter, team.team) == agents
+        assert model_client.user_message_counts == [1, 1]
+        
+        await team.reset()
+        assert await team.weather_agent._model_context.get_messages() == []
+        assert team.formatter._history == []
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mode", ["selector_groupchat", "swarm", "magentic_one"])
+    async def test_reset_before_first_query_is_noop(self, mode, fresh_mcp_tools, monkeypatch):
+        import importlib
+        
+        module = importlib.import_module(f"src.{mode}.weather_team")
+        team = module.WeatherAgentTeam(verbose=False, template_formatter=True, model_client=IntentEchoModelClient())
+        await team.initialize()
+        
+        async def fail_reset():
+            pytest.fail("未运行过的团队不需要重置")
+        
+        for name in ("team", "swarm_team", "magentic_team", "magentic_fast_team"):
+            if getattr(team, name, None) is not None:
+                monkeypatch.setattr(getattr(team, name), "reset", fail_reset)
+        await team.reset()
+
+
 # 性能测试
 @pytest.mark.slow
 @pytest.mark.asyncio
@@ -538,4 +1320,167 @@ async def test_agent_creation_performance():
     # 验证所有代理都创建成功
     agents = [intent_agent, weather_agent, formatter_agent, simple_agent]
     assert len(agents) == 4
-    assert all(agent is not None for agent in agents)
\ No newline at end of file
+    assert all(agent is not None for agent in agents)
+
+
+@pytest.mark.slow
+@pytest.mark.performance
+@pytest.mark.asyncio
+async def test_template_formatter_benchmark():
+    """模板 formatter 的渲染延迟（不调用大模型）"""
+    import time
+    
+    message = ToolCallSummaryMessage(content=mcp_result(TOOL_TEXT_TODAY), source="weather_agent", tool_calls=[], results=[])
+    formatter = TemplateFormatterAgent()
+    rounds = 200
+    start = time.perf_counter()
+    for _ in range(rounds):
+        response = await formatter.on_messages([message], None)
+        await formatter.on_reset(None)
+    template_ms = (time.perf_counter() - start) / rounds * 1000
+    
+    print(f"\n📊 模板 formatter：平均 {template_ms:.3f}ms/次，0 token")
+    assert response.chat_message.content.startswith("北京的天气情况如下：")
+    assert response.chat_message.models_usage is None
+    assert template_ms < 5, f"模板渲染耗时过长: {template_ms:.3f}ms"
+
+
+@pytest.mark.slow
+@pytest.mark.performance
+@pytest.mark.asyncio
+async def test_llm_formatter_comparison():
+    """模板 formatter 与 LLM formatter 的延迟和 token 对比（调用真实模型）"""
+    import time
+    
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        pytest.skip("OPENAI_API_KEY环境变量未设置")
+    
+    message = ToolCallSummaryMessage(content=mcp_result(TOOL_TEXT_TODAY), source="weather_agent", tool_calls=[], results=[])
+    formatter = TemplateFormatterAgent()
+    start = time.perf_counter()
+    await formatter.on_messages([message], None)
+    template_ms = (time.perf_counter() - start) * 1000
+    
+    model_client = OpenAIChatCompletionClient(model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"), api_key=api_key)
+    try:
+        latencies, prompt_tokens, completion_tokens = [], 0, 0
+        for _ in range(3):
+            llm_formatter = create_response_formatter_agent(model_client)
+            start = time.perf_counter()
+            llm_response = await llm_formatter.on_messages([message], CancellationToken())
+            latencies.append((time.perf_counter() - start) * 1000)
+            usage = llm_response.chat_message.models_usage
+            prompt_tokens += usage.prompt_tokens
+            completion_tokens += usage.completion_tokens
+    finally:
+        await model_client.close()
+    
+    llm_ms = sum(latencies) / len(latencies)
+    print(f"\n📊 LLM formatter：平均 {llm_ms:.0f}ms/次，"
+          f"{prompt_tokens // 3} 输入 + {completion_tokens // 3} 输出 token/次")
+    print(f"📊 每次查询节省：{llm_ms - template_ms:.0f}ms，{(prompt_tokens + completion_tokens) // 3} token")
+    assert template_ms < llm_ms
+
+
+@pytest.mark.slow
+@pytest.mark.performance
+def test_local_intent_parser_latency():
+    """本地意图解析应远快于一次模型调用（亚毫秒级）"""
+    import time
+    
+    parser = LocalIntentParser()
+    queries = ["上海明天天气", "广州未来3天天气", "北京今天天气怎么样", "今天天气怎么样", "Tokyo weather tomorrow"] * 200
+    start = time.perf_counter()
+    hits = sum(parser.parse(q) is not None for q in queries)
+    avg_ms = (time.perf_counter() - start) / len(queries) * 1000
+    
+    print(f"\n📊 本地意图解析：平均 {avg_ms:.3f}ms/次，命中率 {hits / len(queries):.0%}")
+    assert hits == 800
+    assert avg_ms < 1, f"本地意图解析耗时过长: {avg_ms:.3f}ms"
+
+
+@pytest.mark.slow
+@pytest.mark.performance
+@pytest.mark.asyncio
+async def test_pipeline_latency(weather_pipeline):
+    """直连流水线端到端延迟（本地桩服务器）应低于 100ms，作为多代理模式的评测基线"""
+    import time
+    
+    start = time.perf_counter()
+    await weather_pipeline.query("北京今天天气")
+    cold_ms = (time.perf_counter() - start) * 1000
+    
+    queries = ["北京今天天气", "上海明天天气", "广州未来3天天气", "Tokyo weather tomorrow"] * 25
+    start = time.perf_counter()
+    for query in queries:
+        await weather_pipeline.query(query)
+    avg_ms = (time.perf_counter() - start) / len(queries) * 1000
+    
+    print(f"\n📊 直连流水线：首次 {cold_ms:.1f}ms，平均 {avg_ms:.2f}ms/次")
+    assert cold_ms < 100, f"直连流水线首次查询耗时过长: {cold_ms:.1f}ms"
+    assert avg_ms < 100, f"直连流水线平均耗时过长: {avg_ms:.2f}ms"
+
+
+@pytest.mark.performance
+@pytest.mark.asyncio
+async def test_mcp_transport_call_overhead(inprocess_tools):
+    """同一工具调用的单次开销：进程内 vs stdio 子进程（复用同一会话）"""
+    import time
+    from autogen_ext.tools.mcp import create_mcp_server_session, mcp_server_tools
+    
+    args = {"output_format": "json"}
+    rounds = 50
+    
+    async def per_call_ms(tool):
+        await tool.run_json(args, CancellationToken())  # 预热
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await tool.run_json(args, CancellationToken())
+        return (time.perf_counter() - start) / rounds * 1000
+    
+    inprocess_ms = await per_call_ms(inprocess_tools["get_supported_cities"])
+    params = stdio_server_params()
+    async with create_mcp_server_session(params) as session:
+        await session.initialize()
+        tools = {tool.name: tool for tool in await mcp_server_tools(params, session=session)}
+        stdio_ms = await per_call_ms(tools["get_supported_cities"])
+    
+    print(f"\n📊 MCP 工具调用开销：进程内 {inprocess_ms:.2f}ms/次，stdio {stdio_ms:.2f}ms/次")
+    assert inprocess_ms < stdio_ms, "进程内调用应快于 stdio 子进程"
+
+
+@pytest.mark.performance
+@pytest.mark.asyncio
+async def test_team_reset_vs_rebuild(stub_weather_server, fresh_mcp_tools):
+    """每条查询的准备开销：重建代理和团队 vs 重置已有团队"""
+    import time
+    from src.selector_groupchat.weather_team import WeatherAgentTeam
+    
+    model_client = IntentEchoModelClient()
+    
+    def new_team():
+        return WeatherAgentTeam(verbose=False, template_formatter=True, fast_intent=True, model_client=model_client)
+    
+    # 预热：工具加载、团队运行时初始化
+    team = new_team()
+    await team.query("北京今天天气")
+    
+    rounds = 20
+    rebuild = 0.0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        rebuilt = new_team()
+        await rebuilt.initialize()
+        rebuild += time.perf_counter() - started
+    
+    reset = 0.0
+    for _ in range(rounds):
+        await team.query("上海明天天气")
+        started = time.perf_counter()
+        await team.reset()
+        reset += time.perf_counter() - started
+    
+    print(f"\n每条查询准备开销：重建 {rebuild / rounds * 1000:.2f}ms，重置 {reset / rounds * 1000:.2f}ms")
+    assert model_client.user_message_counts == [1] * (rounds + 1)
+    assert reset < rebuild